@@ -7,7 +7,8 @@ from fastapi.middleware.cors import CORSMiddleware
 import os
 from dotenv import load_dotenv
 
-from database import engine, Base
+from database import engine, Base, SessionLocal
+from services import inventory_balance, low_level_code, schema_upgrade
 from routers import auth, items, partners, warehouses, inventory, wms, planning, qms, users, bom, workorder, machines, sales, accounting, chart_of_accounts, thai_tax
 
 load_dotenv()
@@ -15,6 +16,16 @@ load_dotenv()
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# One-time upgrade of databases created before the unique inventory balance key
+inventory_balance.ensure_balance_key(engine)
+
+# Indexes and columns added to tables that existed before them
+schema_upgrade.upgrade_schema(engine)
+
+# Build the low-level code table on databases created before it (BOM writes keep it current)
+with SessionLocal() as db:
+    low_level_code.ensure_low_level_codes(db)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="RetroEarthERP API",
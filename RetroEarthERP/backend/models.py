@@ -4,7 +4,7 @@ Includes all 26 tables with multi-language support
 """
 from sqlalchemy import (
     Column, Integer, String, Boolean, DateTime, Date, Numeric,
-    ForeignKey, Enum as SQLEnum, Text, JSON
+    ForeignKey, Enum as SQLEnum, Text, JSON, Index
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -244,6 +244,24 @@ class SystemLog(Base):
     user = relationship("User")
 
 
+class CacheVersion(Base):
+    """Version counters shared by all workers to invalidate in-process caches"""
+    __tablename__ = "cache_versions"
+
+    cache_key = Column(String(50), primary_key=True)  # e.g., 'bom_graph'
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class DocumentSequence(Base):
+    """Last number issued per document series (row-locked counter, replaces COUNT(*) + 1)"""
+    __tablename__ = "document_sequences"
+
+    series = Column(String(30), primary_key=True)  # e.g., 'WO', 'JV-2024-01'
+    last_value = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 # Master Data Tables
 class MasterItem(Base):
     __tablename__ = "master_items"
@@ -386,6 +404,7 @@ class MasterMachine(Base):
     next_maintenance_date = Column(Date, nullable=True)
     qa_representative_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     status = Column(SQLEnum(MachineStatus), default=MachineStatus.ACTIVE)
+    hours_per_day = Column(Numeric(5, 2), default=8)  # New: Capacity per working day (scheduling)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -668,7 +687,7 @@ class MasterBOM(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     parent_item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False, index=True)
-    child_item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False)
+    child_item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False, index=True)  # Where-used lookups
     bom_type = Column(SQLEnum('ASSEMBLY', 'FORMULA', 'MODULAR', 'TAILOR_MADE', name='bom_type_enum'), default='ASSEMBLY')
     is_template = Column(Boolean, default=True)  # False for tailor-made WO-specific BOMs
     sequence_order = Column(Integer, default=0)  # For ASSEMBLY type
@@ -709,6 +728,48 @@ class MasterBOM(Base):
     creator = relationship("User", foreign_keys=[created_by])
 
 
+class ItemLowLevelCode(Base):
+    """Lowest BOM level at which an item is used (0 = never a component)"""
+    __tablename__ = "item_low_level_codes"
+    
+    item_id = Column(Integer, ForeignKey("master_items.id"), primary_key=True)
+    low_level_code = Column(Integer, nullable=False, default=0, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    item = relationship("MasterItem")
+
+
+class CostRollupRun(Base):
+    """One standard cost roll-up over the whole item catalog"""
+    __tablename__ = "cost_rollup_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    bom_version = Column(Integer, nullable=False, default=0)  # BOM structure version rolled up
+    item_count = Column(Integer, default=0)
+    standards_updated = Column(Boolean, default=False)  # Estimates released to standard_cost
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    creator = relationship("User")
+    estimates = relationship("CostEstimate", back_populates="run", cascade="all, delete-orphan")
+
+
+class CostEstimate(Base):
+    """Rolled-up material cost of a manufactured item, against its current standard"""
+    __tablename__ = "cost_estimates"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("cost_rollup_runs.id"), nullable=False, index=True)
+    item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False, index=True)
+    low_level_code = Column(Integer, default=0)
+    current_standard_cost = Column(Numeric(15, 4), default=0)
+    estimated_cost = Column(Numeric(15, 4), nullable=False)
+    cost_difference = Column(Numeric(15, 4), default=0)  # estimated - current
+    
+    run = relationship("CostRollupRun", back_populates="estimates")
+    item = relationship("MasterItem")
+
+
 class TrnJobOrderHead(Base):
     __tablename__ = "trn_job_order_head"
     
@@ -719,6 +780,7 @@ class TrnJobOrderHead(Base):
     qty_produced = Column(Numeric(15, 4), default=0)
     start_date = Column(Date, nullable=False)
     end_date = Column(Date, nullable=True)
+    due_date = Column(Date, nullable=True)  # New: Required date (start/end are the schedule)
     status = Column(SQLEnum(JobStatus), default=JobStatus.PLANNED)
     warehouse_id = Column(Integer, ForeignKey("master_warehouses.id"), nullable=False)
     lot_number = Column(String(50), nullable=True)  # New: Produced Lot Number
@@ -731,6 +793,25 @@ class TrnJobOrderHead(Base):
     details = relationship("TrnJobOrderDetail", back_populates="job_head")
 
 
+class MachineLoad(Base):
+    """Machine hours a scheduled work order takes on one day (rebuilt by each scheduling run)"""
+    __tablename__ = "machine_load"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    machine_id = Column(Integer, ForeignKey("master_machines.id"), nullable=False)
+    job_id = Column(Integer, ForeignKey("trn_job_order_head.id"), nullable=False, index=True)
+    operation_seq = Column(Integer, default=0)
+    load_date = Column(Date, nullable=False)
+    hours = Column(Numeric(10, 4), nullable=False)
+    
+    __table_args__ = (
+        Index("ix_machine_load_machine_date", "machine_id", "load_date"),
+    )
+    
+    machine = relationship("MasterMachine")
+    job = relationship("TrnJobOrderHead")
+
+
 class TrnJobOrderDetail(Base):
     __tablename__ = "trn_job_order_detail"
     
@@ -754,8 +835,50 @@ class MRPScenario(Base):
     run_date = Column(DateTime(timezone=True), server_default=func.now())
     run_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     status = Column(SQLEnum(MRPStatus), default=MRPStatus.COMPLETED)
+    plan_id = Column(Integer, ForeignKey("production_plan.id"), nullable=True)  # Base demand (None = open sales orders)
+    bucket = Column(String(10), default='DAY')  # DAY, WEEK
+    description = Column(Text, nullable=True)
     
     user = relationship("User")
+    plan = relationship("ProductionPlan")
+    deltas = relationship("MRPScenarioDelta", back_populates="scenario", cascade="all, delete-orphan")
+    results = relationship("MRPScenarioResult", back_populates="scenario", cascade="all, delete-orphan")
+
+
+class MRPScenarioDelta(Base):
+    """Change a what-if scenario overlays on the live planning data"""
+    __tablename__ = "mrp_scenario_deltas"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scenario_id = Column(Integer, ForeignKey("mrp_scenarios.id"), nullable=False, index=True)
+    delta_type = Column(SQLEnum('DEMAND', 'INVENTORY', 'BOM', name='scenario_delta_type_enum'), nullable=False)
+    item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False)  # BOM: parent item
+    child_item_id = Column(Integer, ForeignKey("master_items.id"), nullable=True)  # BOM only
+    delta_date = Column(Date, nullable=True)  # DEMAND only
+    quantity = Column(Numeric(15, 4), nullable=False)  # DEMAND/INVENTORY: +/- change, BOM: new qty per parent (0 = remove)
+    
+    scenario = relationship("MRPScenario", back_populates="deltas")
+    item = relationship("MasterItem", foreign_keys=[item_id])
+    child_item = relationship("MasterItem", foreign_keys=[child_item_id])
+
+
+class MRPScenarioResult(Base):
+    """MRP result of a what-if scenario (same columns as MRPResult)"""
+    __tablename__ = "mrp_scenario_results"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scenario_id = Column(Integer, ForeignKey("mrp_scenarios.id"), nullable=False, index=True)
+    item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False)
+    required_date = Column(Date, nullable=False)
+    gross_requirement = Column(Numeric(15, 4), nullable=False)
+    on_hand_qty = Column(Numeric(15, 4), default=0)
+    open_po_qty = Column(Numeric(15, 4), default=0)
+    net_requirement = Column(Numeric(15, 4), nullable=False)
+    suggested_action = Column(SQLEnum(SuggestedAction), nullable=True)
+    suggested_qty = Column(Numeric(15, 4), nullable=True)
+    
+    scenario = relationship("MRPScenario", back_populates="results")
+    item = relationship("MasterItem")
 
 
 class MRPResult(Base):
@@ -776,6 +899,81 @@ class MRPResult(Base):
     item = relationship("MasterItem")
 
 
+class MRPPegging(Base):
+    """Supply of an item allocated to a requirement, traced to the end demand it serves"""
+    __tablename__ = "mrp_pegging"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    plan_id = Column(Integer, ForeignKey("production_plan.id"), nullable=False)
+    item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False)
+    level = Column(Integer, nullable=False, default=0)  # BOM levels below the end demand (0 = independent demand)
+    parent_item_id = Column(Integer, ForeignKey("master_items.id"), nullable=True)  # Parent whose planned order needs this item
+    requirement_date = Column(Date, nullable=False)
+    quantity = Column(Numeric(15, 4), nullable=False)
+    supply_type = Column(SQLEnum('ON_HAND', 'PURCHASE_ORDER', 'PLANNED_ORDER', name='pegging_supply_type_enum'), nullable=False)
+    supply_ref_id = Column(Integer, nullable=True)  # trn_purchase_order_detail.id for PURCHASE_ORDER
+    supply_date = Column(Date, nullable=True)  # PO delivery date / planned order due date
+    demand_type = Column(SQLEnum('SALES_ORDER', 'PLAN_ITEM', 'STOCK', name='pegging_demand_type_enum'), nullable=False)
+    demand_ref_id = Column(Integer, nullable=True)  # trn_sales_order_detail.id / production_plan_items.id
+    demand_item_id = Column(Integer, ForeignKey("master_items.id"), nullable=True)
+    demand_date = Column(Date, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_mrp_pegging_plan_item", "plan_id", "item_id", "supply_date"),
+        Index("ix_mrp_pegging_supply", "supply_type", "supply_ref_id"),
+        Index("ix_mrp_pegging_demand", "demand_type", "demand_ref_id"),
+    )
+    
+    item = relationship("MasterItem", foreign_keys=[item_id])
+    demand_item = relationship("MasterItem", foreign_keys=[demand_item_id])
+
+
+class MRPDirtyItem(Base):
+    """Item whose planning inputs changed since it was last marked (net-change MRP)"""
+    __tablename__ = "mrp_dirty_items"
+    
+    item_id = Column(Integer, ForeignKey("master_items.id"), primary_key=True)
+    source = Column(String(20), nullable=False)  # INVENTORY, PURCHASE_ORDER, SALES_ORDER, BOM
+    marked_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    
+    item = relationship("MasterItem")
+
+
+class ItemLotSizing(Base):
+    """MRP lot-sizing policy of an item (items without a row use their reorder quantity, else lot-for-lot)"""
+    __tablename__ = "item_lot_sizing"
+    
+    item_id = Column(Integer, ForeignKey("master_items.id"), primary_key=True)
+    policy = Column(SQLEnum('L4L', 'FOQ', 'EOQ', 'POQ', 'MIN_MAX', name='lot_sizing_policy_enum'), nullable=False, default='L4L')
+    order_quantity = Column(Numeric(15, 4), nullable=True)  # FOQ lot (default: item reorder_quantity)
+    periods = Column(Integer, nullable=True)  # POQ buckets per order (default: derived from EOQ)
+    min_qty = Column(Numeric(15, 4), nullable=True)  # MIN_MAX (default: item reorder_point)
+    max_qty = Column(Numeric(15, 4), nullable=True)  # MIN_MAX (default: reorder_point + reorder_quantity)
+    ordering_cost = Column(Numeric(15, 4), default=0)  # EOQ/POQ cost per order
+    holding_cost_rate = Column(Numeric(5, 2), default=0)  # EOQ/POQ annual holding cost, % of standard cost
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    item = relationship("MasterItem")
+
+
+class ItemVendorSource(Base):
+    """Vendor an item can be bought from, used to choose the vendor of MRP purchase requisitions"""
+    __tablename__ = "item_vendor_sources"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    item_id = Column(Integer, ForeignKey("master_items.id"), nullable=False, index=True)
+    vendor_id = Column(Integer, ForeignKey("master_business_partners.id"), nullable=False)
+    priority = Column(Integer, nullable=False, default=1)  # Lower = preferred
+    lead_time_days = Column(Integer, nullable=True)  # Default: vendor production + transit lead time
+    min_order_qty = Column(Numeric(15, 4), default=0)
+    last_price = Column(Numeric(15, 4), nullable=True)
+    is_active = Column(Boolean, default=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    item = relationship("MasterItem")
+    vendor = relationship("MasterBusinessPartner")
+
+
 # Inventory Tables
 class InventoryTransaction(Base):
     __tablename__ = "inventory_transactions"
@@ -810,6 +1008,15 @@ class InventoryBalance(Base):
     avg_cost = Column(Numeric(15, 4), default=0)
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
+    __table_args__ = (
+        # New: One row per stock key (no location / no lot folded to 0 / '' so they are unique too)
+        Index(
+            "uq_inventory_balance_key",
+            "item_id", "warehouse_id", func.coalesce(location_id, 0), func.coalesce(lot_number, ""),
+            unique=True
+        ),
+    )
+    
     item = relationship("MasterItem")
     warehouse = relationship("MasterWarehouse")
     location = relationship("LocationMaster") # Added
@@ -890,6 +1097,33 @@ class DraftPurchaseRequisition(Base):
     approver = relationship("User", foreign_keys=[approved_by])
 
 
+class PlanningJob(Base):
+    """Background run of a plan calculation or processing"""
+    __tablename__ = "planning_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    plan_id = Column(Integer, ForeignKey("production_plan.id"), nullable=False, index=True)
+    job_type = Column(SQLEnum('CALCULATE', 'PROCESS', name='planning_job_type_enum'), nullable=False)
+    parameters = Column(JSON, nullable=True)  # e.g. {"bucket": "WEEK", "mode": "FULL"}
+    status = Column(
+        SQLEnum('QUEUED', 'RUNNING', 'COMPLETED', 'FAILED', 'CANCELLED', name='planning_job_status_enum'),
+        default='QUEUED', index=True
+    )
+    progress = Column(Integer, default=0)  # Percent complete
+    cancel_requested = Column(Boolean, default=False)  # Read by the worker at its progress checkpoints
+    error = Column(Text, nullable=True)
+    result = Column(JSON, nullable=True)  # Same payload the synchronous endpoint returns
+    worker_id = Column(String(100), nullable=True)  # New: host:pid of the server process running the job
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # New: Last sign of life of the worker
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    plan = relationship("ProductionPlan")
+    creator = relationship("User")
+
+
 # Quality Management Tables
 class QualityInspectionHeader(Base):
     __tablename__ = "quality_inspection_header"
@@ -5,8 +5,8 @@ Features: Revision control, export, search, location tracking
 """
 from fastapi import APIRouter, Depends, HTTPException, status, Response
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import or_, and_, func, case, cast, String
 from typing import List, Optional
 from decimal import Decimal
 from datetime import datetime, date, timezone
@@ -18,6 +18,9 @@ from database import get_db
 import models
 import schemas
 import auth as auth_utils
+from services import (
+    bom_explosion, bom_gozinto, bom_graph, bom_where_used, cost_rollup, low_level_code, mrp_net_change
+)
 
 router = APIRouter()
 
@@ -26,6 +29,31 @@ MAX_REVISIONS = 3
 
 
 # ==================== HELPER FUNCTIONS ====================
+def check_no_cycle(graph, parent_item_id, child_item_ids):
+    """Reject a BOM change that would make an item a component of itself"""
+    try:
+        low_level_code.ensure_acyclic(graph, parent_item_id, child_item_ids)
+    except low_level_code.BOMCycleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def active_child_ids(graph, parent_item_id):
+    """IDs of the components in the parent's currently active BOM"""
+    return {edge.child_item_id for edge in graph.children.get(parent_item_id, ())}
+
+
+def commit_bom_change(db, changed_items):
+    """
+    Commit a BOM write together with everything derived from the structure:
+    the MRP dirty marks and the low-level codes of the changed items. The
+    write must have started with bom_graph.lock_bom_structure (which also
+    bumps the version, so other workers rebuild their cache).
+    """
+    mrp_net_change.mark_items_dirty(db, changed_items, mrp_net_change.SOURCE_BOM)
+    low_level_code.refresh_low_level_codes(db, changed_items)
+    db.commit()
+
+
 def get_bom_line_dict(bom, db):
     """Convert BOM model to dictionary with enriched data"""
     parent = db.query(models.MasterItem).filter(models.MasterItem.id == bom.parent_item_id).first()
@@ -187,71 +215,106 @@ def list_boms(
 @router.get("/parents", response_model=List[dict])
 def get_bom_parents(
     include_inactive: bool = False,
+    limit: Optional[int] = None,
+    after_item_code: Optional[str] = None,
+    after_revision: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth_utils.get_current_user)
 ):
-    """Get list of parent items that have BOMs (grouped by parent and revision)"""
-    query = db.query(models.MasterBOM)
+    """
+    Get list of parent items that have BOMs (grouped by parent and revision).
     
+    Sorted by item_code, then revision (descending). For keyset pagination
+    pass limit, and the item_code/revision of the last row received as
+    after_item_code/after_revision.
+    """
+    B = models.MasterBOM
+    
+    partition = (B.parent_item_id, B.revision)
+    lines = db.query(
+        B.parent_item_id.label("parent_item_id"),
+        B.revision.label("revision"),
+        B.bom_type.label("bom_type"),
+        B.is_template.label("is_template"),
+        B.status.label("status"),
+        B.revision_date.label("revision_date"),
+        B.is_active.label("is_active"),
+        func.row_number().over(
+            partition_by=partition,
+            order_by=(B.is_active.desc(), B.id)
+        ).label("row_no"),
+        func.sum(case((B.is_active == True, 1), else_=0)).over(
+            partition_by=partition
+        ).label("component_count")
+    )
     if not include_inactive:
-        query = query.filter(models.MasterBOM.is_active == True)
-    
-    # Get distinct parent items with their revisions
-    bom_parents = query.with_entities(
-        models.MasterBOM.parent_item_id,
-        models.MasterBOM.revision,
-        models.MasterBOM.status,
-        models.MasterBOM.revision_date
-    ).distinct().all()
+        lines = lines.filter(B.is_active == True)
+    lines = lines.subquery()
+    
+    # One row per (parent, revision): the first component carries type/status
+    revisions = db.query(lines).filter(lines.c.row_no == 1).subquery()
+    
+    # Revisions that still have active lines, per parent
+    revision_lists = db.query(
+        revisions.c.parent_item_id.label("parent_item_id"),
+        func.aggregate_strings(cast(revisions.c.revision, String), ",").label("revision_list")
+    ).filter(
+        revisions.c.component_count > 0
+    ).group_by(revisions.c.parent_item_id).subquery()
+    
+    query = db.query(
+        models.MasterItem.id,
+        models.MasterItem.item_code,
+        models.MasterItem.item_name,
+        models.MasterItem.item_type,
+        revisions.c.revision,
+        revisions.c.bom_type,
+        revisions.c.is_template,
+        revisions.c.is_active,
+        revisions.c.component_count,
+        revisions.c.status,
+        revisions.c.revision_date,
+        revision_lists.c.revision_list
+    ).join(
+        revisions, revisions.c.parent_item_id == models.MasterItem.id
+    ).outerjoin(
+        revision_lists, revision_lists.c.parent_item_id == models.MasterItem.id
+    )
     
-    result = []
-    seen = set()
+    if after_item_code is not None:
+        if after_revision is not None:
+            query = query.filter(or_(
+                models.MasterItem.item_code > after_item_code,
+                and_(
+                    models.MasterItem.item_code == after_item_code,
+                    revisions.c.revision < after_revision
+                )
+            ))
+        else:
+            query = query.filter(models.MasterItem.item_code > after_item_code)
     
-    for parent_id, revision, status, revision_date in bom_parents:
-        key = (parent_id, revision)
-        if key in seen:
-            continue
-        seen.add(key)
-        
-        parent = db.query(models.MasterItem).filter(models.MasterItem.id == parent_id).first()
-        if parent:
-            # Count components for this revision
-            component_count = db.query(models.MasterBOM).filter(
-                models.MasterBOM.parent_item_id == parent_id,
-                models.MasterBOM.revision == revision,
-                models.MasterBOM.is_active == True
-            ).count()
-            
-            # Get BOM type (from first component)
-            first_bom = db.query(models.MasterBOM).filter(
-                models.MasterBOM.parent_item_id == parent_id,
-                models.MasterBOM.revision == revision,
-                models.MasterBOM.is_active == True
-            ).first()
-            
-            # Get all revisions for this parent
-            all_revisions = db.query(models.MasterBOM.revision).filter(
-                models.MasterBOM.parent_item_id == parent_id,
-                models.MasterBOM.is_active == True
-            ).distinct().all()
-            revision_list = sorted([r[0] for r in all_revisions], reverse=True)
-            
-            result.append({
-                "id": parent.id,
-                "item_code": parent.item_code,
-                "item_name": parent.item_name,
-                "item_type": parent.item_type.value if hasattr(parent.item_type, 'value') else str(parent.item_type),
-                "bom_type": first_bom.bom_type if first_bom else None,
-                "component_count": component_count,
-                "is_template": first_bom.is_template if first_bom else True,
-                "revision": revision,
-                "revision_date": revision_date,
-                "status": status.value if hasattr(status, 'value') else str(status) if status else "ACTIVE",
-                "all_revisions": revision_list
-            })
+    query = query.order_by(models.MasterItem.item_code, revisions.c.revision.desc())
+    if limit:
+        query = query.limit(limit)
     
-    # Sort by item_code then revision (descending)
-    result.sort(key=lambda x: (x['item_code'], -x['revision']))
+    result = []
+    for (item_id, item_code, item_name, item_type, revision, bom_type, is_template, is_active,
+         component_count, bom_status, revision_date, revision_list) in query.all():
+        result.append({
+            "id": item_id,
+            "item_code": item_code,
+            "item_name": item_name,
+            "item_type": item_type.value if hasattr(item_type, 'value') else str(item_type),
+            "bom_type": bom_type if is_active else None,
+            "component_count": component_count or 0,
+            "is_template": is_template if is_active else True,
+            "revision": revision,
+            "revision_date": revision_date,
+            "status": bom_status.value if hasattr(bom_status, 'value') else str(bom_status) if bom_status else "ACTIVE",
+            "all_revisions": sorted(
+                (int(r) for r in revision_list.split(",")), reverse=True
+            ) if revision_list else []
+        })
     
     return result
 
@@ -350,6 +413,55 @@ def get_bom_by_parent(
     return [get_bom_line_dict(bom, db) for bom in boms]
 
 
+# ==================== LOW-LEVEL CODES ====================
+@router.get("/low-level-codes", response_model=dict)
+def get_low_level_codes(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_user)
+):
+    """Get the persisted low-level code (lowest BOM level) of every item"""
+    codes = low_level_code.get_low_level_codes(db)
+    return {
+        "max_low_level_code": max(codes.values(), default=0),
+        "codes": codes
+    }
+
+
+@router.post("/low-level-codes/rebuild", response_model=dict)
+def rebuild_low_level_codes(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_active_admin)
+):
+    """Recompute low-level codes for all items from the active BOM structure"""
+    bom_graph.lock_bom_structure(db)
+    summary = low_level_code.rebuild_low_level_codes(db)
+    db.commit()
+    return summary
+
+
+# ==================== WHERE-USED (IMPLOSION) ====================
+@router.get("/where-used/{item_id}", response_model=dict)
+def get_where_used(
+    item_id: int,
+    include_optional: bool = True,
+    include_byproducts: bool = False,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_user)
+):
+    """
+    Get every parent that uses an item, directly (single level) and
+    transitively up to the end items (multi level), with the cumulative
+    quantity of the item needed per unit of each parent.
+    """
+    item = db.query(models.MasterItem).filter(models.MasterItem.id == item_id).first()
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    return bom_where_used.where_used(
+        db, item, include_optional=include_optional, include_byproducts=include_byproducts
+    )
+
+
 # ==================== GET BOM LINE ====================
 @router.get("/{bom_id}", response_model=dict)
 def get_bom(
@@ -376,6 +488,8 @@ def create_bom(
     if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
         raise HTTPException(status_code=403, detail="Only Admin/Manager can create BOMs")
     
+    graph = bom_graph.lock_bom_structure(db)
+    
     # Validate parent item
     parent = db.query(models.MasterItem).filter(models.MasterItem.id == bom_data.parent_item_id).first()
     if not parent:
@@ -389,6 +503,8 @@ def create_bom(
     # Check for circular reference
     if bom_data.parent_item_id == bom_data.child_item_id:
         raise HTTPException(status_code=400, detail="Parent and child cannot be the same item")
+    if bom_data.status == 'ACTIVE':
+        check_no_cycle(graph, bom_data.parent_item_id, [bom_data.child_item_id])
     
     # Validate locations if provided
     if bom_data.production_location_id:
@@ -448,7 +564,8 @@ def create_bom(
     )
     
     db.add(db_bom)
-    db.commit()
+    changed_items = {db_bom.parent_item_id, db_bom.child_item_id}
+    commit_bom_change(db, changed_items)
     db.refresh(db_bom)
     
     return get_bom_line_dict(db_bom, db)
@@ -466,6 +583,8 @@ def update_bom(
     if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
         raise HTTPException(status_code=403, detail="Only Admin/Manager can update BOMs")
     
+    graph = bom_graph.lock_bom_structure(db)
+    
     db_bom = db.query(models.MasterBOM).filter(models.MasterBOM.id == bom_id).first()
     if not db_bom:
         raise HTTPException(status_code=404, detail="BOM line not found")
@@ -477,10 +596,15 @@ def update_bom(
     if 'status' in update_data:
         update_data['status'] = models.BOMStatus(update_data['status'])
     
+    if update_data.get('status') == models.BOMStatus.ACTIVE and db_bom.status != models.BOMStatus.ACTIVE:
+        check_no_cycle(graph, db_bom.parent_item_id, [db_bom.child_item_id])
+    previous_children = active_child_ids(graph, db_bom.parent_item_id)
+    
     for field, value in update_data.items():
         setattr(db_bom, field, value)
     
-    db.commit()
+    changed_items = previous_children | {db_bom.parent_item_id, db_bom.child_item_id}
+    commit_bom_change(db, changed_items)
     db.refresh(db_bom)
     
     return get_bom_line_dict(db_bom, db)
@@ -503,6 +627,8 @@ def create_new_revision(
     if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
         raise HTTPException(status_code=403, detail="Only Admin/Manager can create revisions")
     
+    graph = bom_graph.lock_bom_structure(db)
+    
     parent = db.query(models.MasterItem).filter(models.MasterItem.id == parent_item_id).first()
     if not parent:
         raise HTTPException(status_code=404, detail="Parent item not found")
@@ -515,6 +641,8 @@ def create_new_revision(
     
     new_revision = max_rev + 1
     
+    previous_children = active_child_ids(graph, parent_item_id)
+    
     # If copying from existing revision
     if source_revision:
         source_boms = db.query(models.MasterBOM).filter(
@@ -526,6 +654,8 @@ def create_new_revision(
         if not source_boms:
             raise HTTPException(status_code=404, detail=f"Source revision {source_revision} not found")
         
+        check_no_cycle(graph, parent_item_id, [source.child_item_id for source in source_boms])
+        
         # Copy BOM lines to new revision
         for source in source_boms:
             new_bom = models.MasterBOM(
@@ -576,7 +706,8 @@ def create_new_revision(
             models.MasterBOM.revision.in_(old_revisions)
         ).update({"is_active": False}, synchronize_session=False)
     
-    db.commit()
+    changed_items = previous_children | {parent_item_id}
+    commit_bom_change(db, changed_items)
     
     return {
         "message": f"Created revision {new_revision} for {parent.item_code}",
@@ -620,6 +751,8 @@ def set_revision_status(
     if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
         raise HTTPException(status_code=403, detail="Only Admin/Manager can change revision status")
     
+    graph = bom_graph.lock_bom_structure(db)
+    
     if new_status not in ['ACTIVE', 'INACTIVE']:
         raise HTTPException(status_code=400, detail="Status must be ACTIVE or INACTIVE")
     
@@ -632,8 +765,11 @@ def set_revision_status(
     if not boms:
         raise HTTPException(status_code=404, detail="Revision not found")
     
+    previous_children = active_child_ids(graph, parent_item_id)
+    
     # If activating, deactivate other revisions
     if new_status == 'ACTIVE':
+        check_no_cycle(graph, parent_item_id, [bom.child_item_id for bom in boms])
         db.query(models.MasterBOM).filter(
             models.MasterBOM.parent_item_id == parent_item_id,
             models.MasterBOM.revision != revision,
@@ -652,7 +788,8 @@ def set_revision_status(
         else:
             bom.inactive_date = inactive_date or date.today()
     
-    db.commit()
+    changed_items = previous_children | {parent_item_id}
+    commit_bom_change(db, changed_items)
     
     return {
         "message": f"Revision {revision} set to {new_status}",
@@ -673,12 +810,15 @@ def delete_bom(
     if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
         raise HTTPException(status_code=403, detail="Only Admin/Manager can delete BOMs")
     
+    bom_graph.lock_bom_structure(db)
+    
     db_bom = db.query(models.MasterBOM).filter(models.MasterBOM.id == bom_id).first()
     if not db_bom:
         raise HTTPException(status_code=404, detail="BOM line not found")
     
     db_bom.is_active = False
-    db.commit()
+    changed_items = {db_bom.parent_item_id, db_bom.child_item_id}
+    commit_bom_change(db, changed_items)
     
     return {"message": "BOM line deleted successfully"}
 
@@ -695,6 +835,8 @@ def delete_entire_bom(
     if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
         raise HTTPException(status_code=403, detail="Only Admin/Manager can delete BOMs")
     
+    bom_graph.lock_bom_structure(db)
+    
     query = db.query(models.MasterBOM).filter(
         models.MasterBOM.parent_item_id == parent_item_id,
         models.MasterBOM.is_active == True
@@ -713,7 +855,8 @@ def delete_entire_bom(
         bom.is_active = False
         count += 1
     
-    db.commit()
+    changed_items = {bom.child_item_id for bom in boms} | {parent_item_id}
+    commit_bom_change(db, changed_items)
     
     msg = f"Deleted {count} BOM lines"
     if revision:
@@ -735,6 +878,8 @@ def copy_bom(
     if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
         raise HTTPException(status_code=403, detail="Only Admin/Manager can copy BOMs")
     
+    graph = bom_graph.lock_bom_structure(db)
+    
     # Get source BOMs
     query = db.query(models.MasterBOM).filter(
         models.MasterBOM.parent_item_id == source_parent_id,
@@ -769,6 +914,8 @@ def copy_bom(
     if existing_bom:
         raise HTTPException(status_code=400, detail="Target item already has a BOM. Delete it first.")
     
+    check_no_cycle(graph, target_parent_id, [source.child_item_id for source in source_boms])
+    
     # Copy BOM lines
     count = 0
     for source in source_boms:
@@ -797,84 +944,121 @@ def copy_bom(
         db.add(new_bom)
         count += 1
     
-    db.commit()
+    commit_bom_change(db, [target_parent_id])
     
     return {"message": f"Copied {count} BOM lines to {target_item.item_code}"}
 
 
 # ==================== EXPORT BOMs ====================
+# Rows fetched per round trip and written per streamed CSV chunk
+EXPORT_CHUNK_ROWS = 500
+
+EXPORT_HEADER = [
+    'Parent Item Code', 'Parent Item Name', 'Child Item Code', 'Child Item Name',
+    'BOM Type', 'Quantity', 'UOM', 'Percentage', 'Scrap Factor', 'Is Optional',
+    'Is Byproduct', 'Production Location', 'Storage Location', 'Remark',
+    'Revision', 'Revision Date', 'Status', 'Active Date', 'Inactive Date'
+]
+
+
 @router.post("/export")
 def export_boms(
     request: schemas.BOMExportRequest,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth_utils.get_current_user)
 ):
-    """Export BOMs to CSV"""
-    query = db.query(models.MasterBOM)
-    
+    """Export BOMs to CSV (streamed in chunks from a single joined query)"""
+    B = models.MasterBOM
+    Parent = aliased(models.MasterItem)
+    Child = aliased(models.MasterItem)
+    ProdLoc = aliased(models.LocationMaster)
+    StorLoc = aliased(models.LocationMaster)
+    
+    filters = []
     if not request.include_inactive:
-        query = query.filter(models.MasterBOM.is_active == True)
-    
+        filters.append(B.is_active == True)
     if request.parent_item_ids:
-        query = query.filter(models.MasterBOM.parent_item_id.in_(request.parent_item_ids))
+        filters.append(B.parent_item_id.in_(request.parent_item_ids))
+    
+    query = db.query(
+        Parent.item_code, Parent.item_name, Child.item_code, Child.item_name,
+        B.bom_type, B.quantity, Child.unit_of_measure, B.percentage, B.scrap_factor,
+        B.is_optional, B.is_byproduct, ProdLoc.location_code, StorLoc.location_code,
+        B.remark, B.revision, B.revision_date, B.status, B.active_date, B.inactive_date
+    ).select_from(B).outerjoin(
+        Parent, Parent.id == B.parent_item_id
+    ).outerjoin(
+        Child, Child.id == B.child_item_id
+    ).outerjoin(
+        ProdLoc, ProdLoc.id == B.production_location_id
+    ).outerjoin(
+        StorLoc, StorLoc.id == B.storage_location_id
+    ).filter(*filters)
     
     if not request.include_all_revisions:
-        # Only get latest active revision per parent
-        # This is simplified - in production, use a subquery
-        pass
-    
-    boms = query.order_by(
-        models.MasterBOM.parent_item_id,
-        models.MasterBOM.revision.desc(),
-        models.MasterBOM.sequence_order
-    ).all()
-    
-    # Create CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
+        # Latest ACTIVE revision per parent (latest revision if none is active)
+        latest = db.query(
+            B.parent_item_id.label("parent_item_id"),
+            func.coalesce(
+                func.max(case((B.status == models.BOMStatus.ACTIVE, B.revision))),
+                func.max(B.revision)
+            ).label("revision")
+        ).filter(*filters).group_by(B.parent_item_id).subquery()
+        
+        query = query.join(
+            latest,
+            and_(latest.c.parent_item_id == B.parent_item_id, latest.c.revision == B.revision)
+        )
     
-    # Header
-    writer.writerow([
-        'Parent Item Code', 'Parent Item Name', 'Child Item Code', 'Child Item Name',
-        'BOM Type', 'Quantity', 'UOM', 'Percentage', 'Scrap Factor', 'Is Optional',
-        'Is Byproduct', 'Production Location', 'Storage Location', 'Remark',
-        'Revision', 'Revision Date', 'Status', 'Active Date', 'Inactive Date'
-    ])
+    query = query.order_by(
+        B.parent_item_id,
+        B.revision.desc(),
+        B.sequence_order
+    ).yield_per(EXPORT_CHUNK_ROWS)
     
-    # Data
-    for bom in boms:
-        parent = db.query(models.MasterItem).filter(models.MasterItem.id == bom.parent_item_id).first()
-        child = db.query(models.MasterItem).filter(models.MasterItem.id == bom.child_item_id).first()
-        prod_loc = db.query(models.LocationMaster).filter(models.LocationMaster.id == bom.production_location_id).first() if bom.production_location_id else None
-        stor_loc = db.query(models.LocationMaster).filter(models.LocationMaster.id == bom.storage_location_id).first() if bom.storage_location_id else None
+    def generate_csv():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(EXPORT_HEADER)
+        
+        rows_in_chunk = 0
+        for (parent_code, parent_name, child_code, child_name, bom_type, quantity, uom,
+             percentage, scrap_factor, is_optional, is_byproduct, prod_loc_code, stor_loc_code,
+             remark, revision, revision_date, bom_status, active_date, inactive_date) in query:
+            writer.writerow([
+                parent_code or '',
+                parent_name or '',
+                child_code or '',
+                child_name or '',
+                bom_type,
+                float(quantity),
+                uom or '',
+                float(percentage) if percentage else '',
+                float(scrap_factor) if scrap_factor else 0,
+                'Yes' if is_optional else 'No',
+                'Yes' if is_byproduct else 'No',
+                prod_loc_code or '',
+                stor_loc_code or '',
+                remark or '',
+                revision,
+                revision_date.strftime('%Y-%m-%d %H:%M') if revision_date else '',
+                bom_status.value if hasattr(bom_status, 'value') else str(bom_status) if bom_status else 'ACTIVE',
+                active_date.strftime('%Y-%m-%d') if active_date else '',
+                inactive_date.strftime('%Y-%m-%d') if inactive_date else ''
+            ])
+            rows_in_chunk += 1
+            
+            if rows_in_chunk >= EXPORT_CHUNK_ROWS:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate(0)
+                rows_in_chunk = 0
         
-        writer.writerow([
-            parent.item_code if parent else '',
-            parent.item_name if parent else '',
-            child.item_code if child else '',
-            child.item_name if child else '',
-            bom.bom_type,
-            float(bom.quantity),
-            child.unit_of_measure if child else '',
-            float(bom.percentage) if bom.percentage else '',
-            float(bom.scrap_factor) if bom.scrap_factor else 0,
-            'Yes' if bom.is_optional else 'No',
-            'Yes' if bom.is_byproduct else 'No',
-            prod_loc.location_code if prod_loc else '',
-            stor_loc.location_code if stor_loc else '',
-            bom.remark or '',
-            bom.revision,
-            bom.revision_date.strftime('%Y-%m-%d %H:%M') if bom.revision_date else '',
-            bom.status.value if hasattr(bom.status, 'value') else str(bom.status) if bom.status else 'ACTIVE',
-            bom.active_date.strftime('%Y-%m-%d') if bom.active_date else '',
-            bom.inactive_date.strftime('%Y-%m-%d') if bom.inactive_date else ''
-        ])
-    
-    output.seek(0)
+        yield output.getvalue()
     
     # Return as downloadable file
     return StreamingResponse(
-        iter([output.getvalue()]),
+        generate_csv(),
         media_type="text/csv",
         headers={
             "Content-Disposition": f"attachment; filename=bom_export_{get_utc_now().strftime('%Y%m%d_%H%M%S')}.csv"
@@ -903,169 +1087,47 @@ def get_locations_for_bom(
     } for loc in locations]
 
 
-# ==================== BOM EXPLOSION ALGORITHM ====================
-def _explode_bom_recursive(
-    db: Session,
-    parent_item_id: int,
-    quantity: Decimal,
-    revision: Optional[int],
-    include_optional: bool,
-    include_byproducts: bool,
-    max_levels: int,
-    current_level: int,
-    visited_items: set,
-    results: list
-) -> None:
-    """
-    Recursive BOM explosion helper function.
-    
-    Args:
-        db: Database session
-        parent_item_id: ID of the parent item to explode
-        quantity: Quantity to produce
-        revision: Specific revision to use (None = active revision)
-        include_optional: Whether to include optional components
-        include_byproducts: Whether to include by-products
-        max_levels: Maximum recursion depth
-        current_level: Current level in the BOM tree
-        visited_items: Set of item IDs already visited (circular reference detection)
-        results: List to accumulate explosion results
-    """
-    # Check max depth
-    if current_level > max_levels:
-        return
-    
-    # Check for circular reference
-    if parent_item_id in visited_items:
-        return
-    
-    # Add to visited set for this branch
-    visited_items.add(parent_item_id)
-    
-    # Get parent item info
-    parent_item = db.query(models.MasterItem).filter(
-        models.MasterItem.id == parent_item_id
-    ).first()
-    
-    if not parent_item:
-        visited_items.discard(parent_item_id)
-        return
-    
-    # Build query for BOM components
-    query = db.query(models.MasterBOM).filter(
-        models.MasterBOM.parent_item_id == parent_item_id,
-        models.MasterBOM.is_active == True
-    )
-    
-    # Filter by revision
-    if revision:
-        query = query.filter(models.MasterBOM.revision == revision)
-    else:
-        # Get active revision only
-        query = query.filter(models.MasterBOM.status == models.BOMStatus.ACTIVE)
-    
-    # Filter optional items
-    if not include_optional:
-        query = query.filter(models.MasterBOM.is_optional == False)
+# ==================== BOM EXPLOSION ====================
+def build_explosion_response(parent_item, quantity, revision, results, has_bom):
+    """Build the explosion result (statistics and consolidated views) for one parent"""
+    # Calculate statistics
+    total_levels = max([r["level"] for r in results], default=0)
+    total_components = len(results)
     
-    # Filter by-products
-    if not include_byproducts:
-        query = query.filter(models.MasterBOM.is_byproduct == False)
+    # Find raw materials (items that don't have their own BOMs)
+    raw_materials = [r for r in results if r["item_id"] not in has_bom]
     
-    # Order by sequence
-    bom_lines = query.order_by(models.MasterBOM.sequence_order).all()
+    has_optional = any(r["is_optional"] for r in results)
+    has_byproducts = any(r["is_byproduct"] for r in results)
     
-    for bom in bom_lines:
-        # Get child item info
-        child_item = db.query(models.MasterItem).filter(
-            models.MasterItem.id == bom.child_item_id
-        ).first()
-        
-        if not child_item:
-            continue
-        
-        # Calculate quantities based on BOM type
-        if bom.bom_type == 'FORMULA' and bom.percentage:
-            # Formula: percentage-based calculation
-            bom_qty = Decimal(str(bom.percentage)) / Decimal("100")
-            required_qty = quantity * bom_qty
-        else:
-            # Assembly, Modular, Tailor-Made: fixed quantity
-            bom_qty = Decimal(str(bom.quantity))
-            required_qty = quantity * bom_qty
-        
-        # Calculate scrap
-        scrap_factor = Decimal(str(bom.scrap_factor)) if bom.scrap_factor else Decimal("0")
-        scrap_qty = required_qty * (scrap_factor / Decimal("100"))
-        total_qty = required_qty + scrap_qty
-        
-        # Get location info
-        prod_loc = None
-        stor_loc = None
-        if bom.production_location_id:
-            loc = db.query(models.LocationMaster).filter(
-                models.LocationMaster.id == bom.production_location_id
-            ).first()
-            prod_loc = loc.location_code if loc else None
-        if bom.storage_location_id:
-            loc = db.query(models.LocationMaster).filter(
-                models.LocationMaster.id == bom.storage_location_id
-            ).first()
-            stor_loc = loc.location_code if loc else None
-        
-        # Create explosion line
-        explosion_line = {
-            "level": current_level,
-            "item_id": child_item.id,
-            "item_code": child_item.item_code,
-            "item_name": child_item.item_name,
-            "item_type": child_item.item_type.value if hasattr(child_item.item_type, 'value') else str(child_item.item_type),
-            "unit_of_measure": child_item.unit_of_measure,
-            "bom_quantity": float(bom_qty),
-            "required_quantity": float(required_qty),
-            "scrap_factor": float(scrap_factor),
-            "scrap_quantity": float(scrap_qty),
-            "total_quantity": float(total_qty),
-            "bom_type": bom.bom_type,
-            "is_optional": bom.is_optional,
-            "is_byproduct": bom.is_byproduct,
-            "sequence_order": bom.sequence_order,
-            "percentage": float(bom.percentage) if bom.percentage else None,
-            "production_location": prod_loc,
-            "storage_location": stor_loc,
-            "parent_item_id": parent_item_id,
-            "parent_item_code": parent_item.item_code,
-            "bom_id": bom.id,
-            "revision": bom.revision,
-            "remark": bom.remark
-        }
-        
-        results.append(explosion_line)
-        
-        # Check if child item has its own BOM (sub-assembly)
-        # Only recurse if item is WIP or FINISHED_GOOD (can have sub-BOMs)
-        child_has_bom = db.query(models.MasterBOM).filter(
-            models.MasterBOM.parent_item_id == child_item.id,
-            models.MasterBOM.is_active == True
-        ).first()
-        
-        if child_has_bom and child_item.id not in visited_items:
-            # Recursively explode this component
-            _explode_bom_recursive(
-                db=db,
-                parent_item_id=child_item.id,
-                quantity=total_qty,  # Use total qty (including scrap) for sub-explosion
-                revision=None,  # Use active revision for sub-components
-                include_optional=include_optional,
-                include_byproducts=include_byproducts,
-                max_levels=max_levels,
-                current_level=current_level + 1,
-                visited_items=visited_items.copy(),  # Copy to allow different branches
-                results=results
-            )
+    # Create consolidated view (sum quantities for same items)
+    consolidated_list = bom_explosion.consolidate_lines(results, has_bom)
     
-    # Remove from visited set after processing this branch
-    visited_items.discard(parent_item_id)
+    return {
+        "parent_item_id": parent_item.id,
+        "parent_item_code": parent_item.item_code,
+        "parent_item_name": parent_item.item_name,
+        "requested_quantity": float(quantity),
+        "revision": revision,
+        "explosion_date": get_utc_now(),
+        "total_levels": total_levels,
+        "total_components": total_components,
+        "total_raw_materials": len(raw_materials),
+        "has_optional_items": has_optional,
+        "has_byproducts": has_byproducts,
+        "lines": results,
+        "consolidated": consolidated_list,
+        "raw_materials_only": [
+            {
+                "item_id": c["item_id"],
+                "item_code": c["item_code"],
+                "item_name": c["item_name"],
+                "unit_of_measure": c["unit_of_measure"],
+                "total_quantity": c["total_quantity"]
+            }
+            for c in consolidated_list if c["is_raw_material"]
+        ]
+    }
 
 
 @router.post("/explode", response_model=dict)
@@ -1079,7 +1141,7 @@ def explode_bom(
     
     This algorithm:
     1. Takes a parent item and desired quantity
-    2. Recursively traverses the BOM tree
+    2. Walks the cached BOM graph level by level
     3. Calculates total quantities needed (with scrap factors)
     4. Handles different BOM types (Assembly, Formula, Modular, Tailor-Made)
     5. Returns flat list of all materials needed
@@ -1103,12 +1165,9 @@ def explode_bom(
         )
     
     # Check if parent item has a BOM
-    bom_exists = db.query(models.MasterBOM).filter(
-        models.MasterBOM.parent_item_id == request.parent_item_id,
-        models.MasterBOM.is_active == True
-    ).first()
+    graph = bom_graph.get_bom_graph(db)
     
-    if not bom_exists:
+    if request.parent_item_id not in graph.has_bom:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"No BOM found for item {parent_item.item_code}"
@@ -1118,91 +1177,160 @@ def explode_bom(
     revision = request.revision
     if not revision:
         # Get active revision
-        active_bom = db.query(models.MasterBOM).filter(
-            models.MasterBOM.parent_item_id == request.parent_item_id,
-            models.MasterBOM.is_active == True,
-            models.MasterBOM.status == models.BOMStatus.ACTIVE
-        ).first()
-        revision = active_bom.revision if active_bom else 1
+        revision = graph.active_revision.get(request.parent_item_id, 1)
+    
+    # Run explosion engine (in memory over the cached BOM graph)
+    try:
+        results, has_bom = bom_explosion.explode_bom_lines(
+            db=db,
+            parent_item=parent_item,
+            quantity=request.quantity,
+            revision=revision,
+            include_optional=request.include_optional,
+            include_byproducts=request.include_byproducts,
+            max_levels=request.max_levels
+        )
+    except low_level_code.BOMCycleError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
-    # Run explosion algorithm
-    results = []
-    visited = set()
+    return build_explosion_response(parent_item, request.quantity, revision, results, has_bom)
+
+
+@router.post("/explode/batch", response_model=dict)
+def explode_bom_batch(
+    request: schemas.BOMBatchExplosionRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_user)
+):
+    """
+    Explode many parents in one request.
     
-    _explode_bom_recursive(
-        db=db,
-        parent_item_id=request.parent_item_id,
-        quantity=request.quantity,
-        revision=revision,
-        include_optional=request.include_optional,
-        include_byproducts=request.include_byproducts,
-        max_levels=request.max_levels,
-        current_level=1,
-        visited_items=visited,
-        results=results
-    )
+    Returns the same result as POST /explode for every requested parent,
+    plus a grand consolidated list over the whole batch. The BOM graph,
+    cached per-unit explosions and item/location master data are shared
+    by all parents.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="At least one parent item is required")
     
-    # Calculate statistics
-    total_levels = max([r["level"] for r in results], default=0)
-    total_components = len(results)
+    parent_ids = {line.parent_item_id for line in request.items}
+    parent_items = {
+        item.id: item for item in db.query(models.MasterItem).filter(
+            models.MasterItem.id.in_(parent_ids)
+        ).all()
+    }
+    missing = sorted(parent_ids - parent_items.keys())
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Parent items not found: {missing}"
+        )
     
-    # Find raw materials (items that don't have their own BOMs)
-    raw_materials = []
-    for r in results:
-        child_bom = db.query(models.MasterBOM).filter(
-            models.MasterBOM.parent_item_id == r["item_id"],
-            models.MasterBOM.is_active == True
-        ).first()
-        if not child_bom:
-            raw_materials.append(r)
+    graph = bom_graph.get_bom_graph(db)
+    without_bom = sorted(parent_items[i].item_code for i in parent_ids if i not in graph.has_bom)
+    if without_bom:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No BOM found for items: {without_bom}"
+        )
     
-    has_optional = any(r["is_optional"] for r in results)
-    has_byproducts = any(r["is_byproduct"] for r in results)
+    parents = [
+        (
+            parent_items[line.parent_item_id],
+            line.quantity,
+            line.revision or graph.active_revision.get(line.parent_item_id, 1)
+        )
+        for line in request.items
+    ]
+    
+    try:
+        results, has_bom = bom_explosion.explode_bom_batch_lines(
+            db=db,
+            parents=parents,
+            include_optional=request.include_optional,
+            include_byproducts=request.include_byproducts,
+            max_levels=request.max_levels
+        )
+    except low_level_code.BOMCycleError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
-    # Create consolidated view (sum quantities for same items)
-    consolidated = {}
-    for r in results:
-        item_key = r["item_id"]
-        if item_key in consolidated:
-            consolidated[item_key]["total_quantity"] += r["total_quantity"]
-            consolidated[item_key]["required_quantity"] += r["required_quantity"]
-            consolidated[item_key]["scrap_quantity"] += r["scrap_quantity"]
-            consolidated[item_key]["occurrences"] += 1
-        else:
-            consolidated[item_key] = {
-                "item_id": r["item_id"],
-                "item_code": r["item_code"],
-                "item_name": r["item_name"],
-                "item_type": r["item_type"],
-                "unit_of_measure": r["unit_of_measure"],
-                "total_quantity": r["total_quantity"],
-                "required_quantity": r["required_quantity"],
-                "scrap_quantity": r["scrap_quantity"],
-                "occurrences": 1,
-                "is_raw_material": not db.query(models.MasterBOM).filter(
-                    models.MasterBOM.parent_item_id == r["item_id"],
-                    models.MasterBOM.is_active == True
-                ).first()
+    grand_consolidated = bom_explosion.consolidate_lines(
+        [line for lines in results for line in lines], has_bom
+    )
+    
+    return {
+        "explosion_date": get_utc_now(),
+        "total_parents": len(parents),
+        "results": [
+            build_explosion_response(parent_item, quantity, revision, lines, has_bom)
+            for (parent_item, quantity, revision), lines in zip(parents, results)
+        ],
+        "consolidated": grand_consolidated,
+        "raw_materials_only": [
+            {
+                "item_id": c["item_id"],
+                "item_code": c["item_code"],
+                "item_name": c["item_name"],
+                "unit_of_measure": c["unit_of_measure"],
+                "total_quantity": c["total_quantity"]
             }
+            for c in grand_consolidated if c["is_raw_material"]
+        ]
+    }
+
+
+@router.post("/explode/total-requirements", response_model=dict)
+def get_total_requirements(
+    request: schemas.BOMTotalRequirementsRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_user)
+):
+    """
+    Total component requirements for many end items at once.
     
-    consolidated_list = sorted(
-        consolidated.values(),
-        key=lambda x: (not x["is_raw_material"], x["item_code"])
-    )
+    Solves (I - A)x = d over the direct-requirements (Gozinto) matrix of the
+    active BOM structure instead of exploding each end item separately.
+    Scrap factors and FORMULA percentages are part of the matrix.
+    """
+    if not request.demands:
+        raise HTTPException(status_code=400, detail="At least one demand line is required")
+    
+    demand = {}
+    for line in request.demands:
+        if line.quantity <= 0:
+            raise HTTPException(status_code=400, detail=f"Quantity for item {line.item_id} must be positive")
+        demand[line.item_id] = demand.get(line.item_id, 0.0) + float(line.quantity)
+    
+    found_ids = {row[0] for row in db.query(models.MasterItem.id).filter(
+        models.MasterItem.id.in_(demand.keys())
+    ).all()}
+    missing = sorted(set(demand) - found_ids)
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Items not found: {missing}"
+        )
+    
+    try:
+        consolidated_list, has_bom = bom_gozinto.total_requirements(
+            db,
+            demand,
+            include_optional=request.include_optional,
+            include_byproducts=request.include_byproducts
+        )
+    except low_level_code.BOMCycleError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    raw_materials = [c for c in consolidated_list if c["is_raw_material"]]
     
     return {
-        "parent_item_id": parent_item.id,
-        "parent_item_code": parent_item.item_code,
-        "parent_item_name": parent_item.item_name,
-        "requested_quantity": float(request.quantity),
-        "revision": revision,
+        "demand": [
+            {"item_id": item_id, "quantity": qty, "has_bom": item_id in has_bom}
+            for item_id, qty in demand.items()
+        ],
         "explosion_date": get_utc_now(),
-        "total_levels": total_levels,
-        "total_components": total_components,
+        "total_components": len(consolidated_list),
         "total_raw_materials": len(raw_materials),
-        "has_optional_items": has_optional,
-        "has_byproducts": has_byproducts,
-        "lines": results,
         "consolidated": consolidated_list,
         "raw_materials_only": [
             {
@@ -1212,7 +1340,7 @@ def explode_bom(
                 "unit_of_measure": c["unit_of_measure"],
                 "total_quantity": c["total_quantity"]
             }
-            for c in consolidated_list if c["is_raw_material"]
+            for c in raw_materials
         ]
     }
 
@@ -1235,3 +1363,106 @@ def explode_bom_simple(
         include_optional=include_optional
     )
     return explode_bom(request, db, current_user)
+
+
+@router.get("/cache/stats", response_model=dict)
+def get_explosion_cache_stats(
+    current_user: models.User = Depends(auth_utils.get_current_user)
+):
+    """Get hit/miss counters of the per-unit BOM explosion cache"""
+    return bom_explosion.explosion_cache.stats()
+
+
+# ==================== STANDARD COST ROLL-UP ====================
+def cost_estimate_dict(estimate: dict) -> dict:
+    """Serialize one cost estimate"""
+    return {
+        **estimate,
+        "current_standard_cost": float(estimate["current_standard_cost"]),
+        "estimated_cost": float(estimate["estimated_cost"]),
+        "cost_difference": float(estimate["cost_difference"])
+    }
+
+
+@router.post("/cost-rollup", response_model=dict)
+def run_cost_rollup(
+    simulate: bool = True,
+    update_standard_costs: bool = False,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_user)
+):
+    """
+    Roll up material cost of all manufactured items through their BOMs.
+    
+    - simulate=true: return estimates only, nothing is written
+    - simulate=false: save estimates as a roll-up run
+    - update_standard_costs=true (with simulate=false): also copy the
+      estimates into the items' standard cost
+    """
+    if current_user.role not in [models.UserRole.ADMIN, models.UserRole.MANAGER]:
+        raise HTTPException(status_code=403, detail="Only Admin/Manager can run cost roll-up")
+    
+    if simulate and update_standard_costs:
+        raise HTTPException(status_code=400, detail="Cannot update standard costs in a simulation")
+    
+    try:
+        rollup = cost_rollup.compute_cost_rollup(db)
+    except low_level_code.BOMCycleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    run_id = None
+    if not simulate:
+        run = cost_rollup.save_cost_rollup(
+            db, rollup, current_user.id, update_standard_costs=update_standard_costs
+        )
+        run_id = run.id
+    
+    estimates = rollup["estimates"]
+    return {
+        "run_id": run_id,
+        "simulated": simulate,
+        "standards_updated": update_standard_costs,
+        "bom_version": rollup["bom_version"],
+        "item_count": len(estimates),
+        "changed_count": sum(1 for e in estimates if e["cost_difference"] != 0),
+        "estimates": [cost_estimate_dict(e) for e in estimates]
+    }
+
+
+@router.get("/cost-rollup/{run_id}", response_model=dict)
+def get_cost_rollup(
+    run_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_user)
+):
+    """Get a saved cost roll-up run with its estimates"""
+    run = db.query(models.CostRollupRun).filter(models.CostRollupRun.id == run_id).first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Cost roll-up run not found")
+    
+    rows = db.query(models.CostEstimate, models.MasterItem.item_code, models.MasterItem.item_name).join(
+        models.MasterItem, models.MasterItem.id == models.CostEstimate.item_id
+    ).filter(
+        models.CostEstimate.run_id == run_id
+    ).order_by(models.CostEstimate.low_level_code, models.MasterItem.item_code).all()
+    
+    return {
+        "run_id": run.id,
+        "bom_version": run.bom_version,
+        "standards_updated": run.standards_updated,
+        "created_at": run.created_at,
+        "created_by": run.created_by,
+        "item_count": run.item_count,
+        "estimates": [
+            cost_estimate_dict({
+                "item_id": estimate.item_id,
+                "item_code": item_code,
+                "item_name": item_name,
+                "low_level_code": estimate.low_level_code,
+                "current_standard_cost": estimate.current_standard_cost,
+                "estimated_cost": estimate.estimated_cost,
+                "cost_difference": estimate.cost_difference
+            })
+            for estimate, item_code, item_name in rows
+        ]
+    }
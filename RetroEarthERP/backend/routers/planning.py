@@ -3,9 +3,10 @@ Production Planning & MRP Engine
 Implements the planning calculation logic to generate PRs and Work Orders
 """
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
+from sqlalchemy import insert, update
+from typing import List, Optional
 from datetime import datetime, date, timedelta, timezone
 from decimal import Decimal
 from utils.datetime_utils import get_utc_now
@@ -13,6 +14,23 @@ import models
 import schemas
 from database import get_db
 from routers.auth import get_current_active_user
+from services import document_numbers, mrp_scenario, planning_jobs
+from services.bom_graph import get_bom_graph
+from services.demand_forecast import ForecastError, generate_forecast_items
+from services.bom_gozinto import get_gozinto_matrix
+from services.low_level_code import BOMCycleError
+from services.lot_sizing import POLICIES
+from services.mrp_engine import BUCKET_DAYS, MRPHorizon, result_cells, result_values, run_mrp_partitioned
+from services.mrp_pegging import build_pegging, load_end_demand, load_open_po_lines, purchase_order_impact
+from services.mrp_net_change import SOURCE_LOT_SIZING, SOURCE_PURCHASE_ORDER, get_dirty_items, mark_items_dirty
+from services.planning_snapshot import load_planning_snapshot, plan_demand
+from services.vendor_sourcing import VENDOR_TYPES, load_sourcing_index, order_quantity
+
+# calculate_plan modes: full regeneration or net-change
+CALCULATION_MODES = ["FULL", "NET_CHANGE"]
+
+# Rows between progress reports of calculate/process runs
+PROGRESS_EVERY = 500
 
 router = APIRouter(
     prefix="/api/planning",
@@ -92,142 +110,211 @@ def add_plan_items(
     return db_plan
 
 
+@router.post("/{plan_id}/forecast", response_model=dict)
+def forecast_plan(
+    plan_id: int,
+    period_days: int = 7,
+    history_periods: int = 52,
+    horizon_periods: int = 12,
+    method: str = "AUTO",
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Replace the items of a DRAFT FORECAST plan with a statistical forecast.
+    
+    Fitted per item on delivery and issue history (exponential smoothing,
+    or Croston for intermittent demand); one plan item per future period.
+    """
+    db_plan = db.query(models.ProductionPlan).filter(models.ProductionPlan.id == plan_id).first()
+    if not db_plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    
+    try:
+        summary = generate_forecast_items(db, db_plan, period_days, history_periods, horizon_periods, method)
+    except ForecastError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    db.commit()
+    return summary
+
+
+def _no_progress(percent: int) -> None:
+    """Progress callback of synchronous (request) runs"""
+
+
+def _validate_calculation_options(bucket: str, mode: str):
+    """Reject unknown bucket/mode values before any work is done"""
+    if bucket not in BUCKET_DAYS:
+        raise HTTPException(status_code=400, detail=f"Invalid bucket. Must be one of: {list(BUCKET_DAYS)}")
+    
+    if mode not in CALCULATION_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Must be one of: {CALCULATION_MODES}")
+
+
 @router.post("/{plan_id}/calculate", response_model=schemas.ProductionPlanResponse)
 def calculate_plan(
     plan_id: int,
+    bucket: str = "DAY",
+    mode: str = "FULL",
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """
     Pre-Calculation: Run MRP Calculation for a specific plan.
     Generates MRP Results (Material Availability Report) but does NOT create PRs/WOs.
+    
+    Time-phased, multi-level MRP: demand is netted per DAY or WEEK bucket
+    against on-hand stock and open POs, planned orders are offset by lead
+    time and exploded into component demand level by level. Open POs are
+    scheduled receipts on their delivery date.
+    
+    Modes:
+    - FULL: regenerate all results of a DRAFT plan
+    - NET_CHANGE: re-plan a CALCULATED plan only for items whose inputs
+      changed since its last calculation (and their BOM components),
+      updating their MRP results in place
     """
+    _validate_calculation_options(bucket, mode)
+    result = _calculate_plan(db, plan_id, bucket, mode)
+    db.commit()
+    return result
+
+
+def _calculate_plan(db: Session, plan_id: int, bucket: str, mode: str, progress=_no_progress) -> dict:
+    """MRP calculation shared by the calculate endpoint and background jobs (the caller commits)"""
     db_plan = db.query(models.ProductionPlan).filter(models.ProductionPlan.id == plan_id).first()
     if not db_plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     
-    if db_plan.status != 'DRAFT':
+    net_change = mode == 'NET_CHANGE'
+    if net_change:
+        if db_plan.status != 'CALCULATED':
+            raise HTTPException(status_code=400, detail="Net-change requires a calculated (not yet processed) plan")
+    elif db_plan.status != 'DRAFT':
         raise HTTPException(status_code=400, detail="Plan already calculated")
     
-    # Clear existing results if any (though status check prevents this)
-    db.query(models.MRPResult).filter(models.MRPResult.plan_id == plan_id).delete()
-    
-    # Step 1: Get Demand
-    demands = []
-    
-    if db_plan.source_type == 'ACTUAL':
-        # Get from Confirmed Sales Orders
-        sales_orders = db.query(models.TrnSalesOrderHead).filter(
-            models.TrnSalesOrderHead.status.in_(['CONFIRMED', 'PARTIAL_DELIVERED'])
-        ).all()
-        
-        for so in sales_orders:
-            for detail in so.details:
-                remaining_qty = detail.qty_ordered - detail.qty_delivered
-                if remaining_qty > 0:
-                    demands.append({
-                        'item_id': detail.item_id,
-                        'required_qty': remaining_qty,
-                        'required_date': so.delivery_date or so.so_date
-                    })
-                    
-    elif db_plan.source_type == 'MANUAL' or db_plan.source_type == 'FORECAST':
-        # Get from Plan Items
-        for item in db_plan.items:
-            demands.append({
-                'item_id': item.item_id,
-                'required_qty': item.quantity,
-                'required_date': item.delivery_date
-            })
+    run_started = get_utc_now()
+    
+    # FORECAST plans without items are forecast from demand history first
+    if db_plan.source_type == 'FORECAST' and not net_change and not db_plan.items:
+        generate_forecast_items(db, db_plan)
+    
+    # Step 1: Load planning snapshot (supply, demand, item data)
+    snapshot = load_planning_snapshot(db)
+    progress(10)
+    
+    # Step 2: Get Demand
+    demand_by_item = plan_demand(db_plan, snapshot)
+    
+    # Step 3: Time-phased MRP
+    try:
+        matrix = get_gozinto_matrix(db)
+    except BOMCycleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    progress(20)
+    
+    changed_items = None
+    compute_items = None
+    if net_change:
+        # Re-plan changed items and everything below them; their parents are
+        # netted too (not written) so dependent demand stays complete
+        graph = get_bom_graph(db)
+        dirty = get_dirty_items(db, since=db_plan.calculated_date)
+        changed_items = dirty | graph.descendants(dirty)
+        compute_items = changed_items | graph.ancestors(changed_items)
+    
+    horizon = MRPHorizon.covering(demand_by_item, bucket)
+    mrp = run_mrp_partitioned(
+        matrix, horizon, demand_by_item, snapshot.on_hand, snapshot.open_po, snapshot.lead_times(),
+        restrict_to=compute_items, lot_sizing=snapshot.lot_sizing
+    )
+    progress(50)
+    
+    # Step 4: One MRP result per item and bucket with requirements
+    if net_change:
+        existing = {
+            (item_id, required_date): result_id
+            for result_id, item_id, required_date in db.query(
+                models.MRPResult.id, models.MRPResult.item_id, models.MRPResult.required_date
+            ).filter(
+                models.MRPResult.plan_id == plan_id,
+                models.MRPResult.item_id.in_(changed_items)
+            ).all()
+        } if changed_items else {}
+    else:
+        db.query(models.MRPResult).filter(models.MRPResult.plan_id == plan_id).delete()
+        existing = {}
+    
+    inserts = []
+    updates = []
+    temp_work_orders = []
+    temp_purchase_reqs = []
     
-    # Step 2: Calculate Net Requirements
-    for demand in demands:
-        item = db.query(models.MasterItem).filter(
-            models.MasterItem.id == demand['item_id']
-        ).first()
-        
-        if not item:
+    rows, buckets = result_cells(mrp)
+    for position, (row, t) in enumerate(zip(rows, buckets)):
+        if position % PROGRESS_EVERY == 0:
+            progress(50 + 35 * position // len(rows))
+        item_id = int(mrp.item_ids[row])
+        if net_change and item_id not in changed_items:
             continue
         
-        # Get current inventory (all warehouses)
-        on_hand = db.query(func.sum(models.InventoryBalance.qty_on_hand)).filter(
-            models.InventoryBalance.item_id == demand['item_id']
-        ).scalar() or Decimal(0)
-        
-        # Get incoming PO qty (not yet received)
-        incoming_po = db.query(func.sum(models.TrnPurchaseOrderDetail.qty_ordered - models.TrnPurchaseOrderDetail.qty_received)).filter(
-            models.TrnPurchaseOrderDetail.item_id == demand['item_id'],
-            models.TrnPurchaseOrderDetail.qty_ordered > models.TrnPurchaseOrderDetail.qty_received
-        ).scalar() or Decimal(0)
+        required_date = horizon.bucket_date(t)
+        values = result_values(mrp, row, t)
+        action = values["suggested_action"]
         
-        # Net Requirement
-        net_requirement = demand['required_qty'] - (on_hand + incoming_po)
-        
-        if net_requirement > 0:
-            # Check if item is produced or purchased
-            has_bom = db.query(models.MasterBOM).filter(
-                models.MasterBOM.parent_item_id == demand['item_id'],
-                models.MasterBOM.is_active == True
-            ).first()
-            
-            action = models.SuggestedAction.MAKE if has_bom else models.SuggestedAction.BUY
-            
-            # Create MRP Result
-            mrp_result = models.MRPResult(
-                plan_id=db_plan.id,
-                item_id=demand['item_id'],
-                required_date=demand['required_date'],
-                gross_requirement=demand['required_qty'],
-                on_hand_qty=on_hand,
-                open_po_qty=incoming_po,
-                net_requirement=net_requirement,
-                suggested_action=action,
-                suggested_qty=net_requirement
-            )
-            db.add(mrp_result)
+        result_id = existing.pop((item_id, required_date), None)
+        if result_id is not None:
+            updates.append({"id": result_id, **values})
         else:
-            # Requirement met
-            mrp_result = models.MRPResult(
-                plan_id=db_plan.id,
-                item_id=demand['item_id'],
-                required_date=demand['required_date'],
-                gross_requirement=demand['required_qty'],
-                on_hand_qty=on_hand,
-                open_po_qty=incoming_po,
-                net_requirement=Decimal(0),
-                suggested_action=models.SuggestedAction.NONE,
-                suggested_qty=Decimal(0)
-            )
-            db.add(mrp_result)
-            
+            inserts.append({"plan_id": db_plan.id, "item_id": item_id, "required_date": required_date, **values})
+        
+        if action != models.SuggestedAction.NONE:
+            item = snapshot.items.get(item_id)
+            entry = {
+                'item_code': item.item_code if item else f'Item-{item_id}',
+                'item_name': item.item_name if item else '',
+                'quantity': float(values["suggested_qty"]),
+                'required_date': required_date.isoformat()
+            }
+            if action == models.SuggestedAction.MAKE:
+                temp_work_orders.append(entry)
+            else:
+                temp_purchase_reqs.append(entry)
+    
+    # One multi-row statement per kind of change
+    if inserts:
+        db.execute(insert(models.MRPResult), inserts)
+    if updates:
+        db.execute(update(models.MRPResult), updates)
+    if existing:
+        # Results of changed items that no longer have requirements
+        db.query(models.MRPResult).filter(
+            models.MRPResult.id.in_(list(existing.values()))
+        ).delete(synchronize_session=False)
+    progress(90)
+    
+    # Step 5: Demand-to-supply pegging of the same run
+    pegging = build_pegging(
+        db_plan.id, mrp, matrix, load_end_demand(db, db_plan, snapshot), load_open_po_lines(db)
+    )
+    stale_pegging = db.query(models.MRPPegging).filter(models.MRPPegging.plan_id == plan_id)
+    if net_change:
+        stale_pegging = stale_pegging.filter(models.MRPPegging.item_id.in_(changed_items))
+        pegging = [peg for peg in pegging if peg["item_id"] in changed_items]
+    stale_pegging.delete(synchronize_session=False)
+    if pegging:
+        db.execute(insert(models.MRPPegging), pegging)
+    
+    progress(95)
+    
     # Update plan status
     db_plan.status = 'CALCULATED'
-    db_plan.calculated_date = get_utc_now()
+    db_plan.calculated_date = run_started
     
-    db.commit()
+    db.flush()
     db.refresh(db_plan)
     
-    # Prepare temp WOs and PRs for response
-    temp_work_orders = []
-    temp_purchase_reqs = []
-    
-    for result in db_plan.mrp_results:
-        item = db.query(models.MasterItem).filter(models.MasterItem.id == result.item_id).first()
-        if result.suggested_action == models.SuggestedAction.MAKE:
-            temp_work_orders.append({
-                'item_code': item.item_code if item else f'Item-{result.item_id}',
-                'item_name': item.item_name if item else '',
-                'quantity': float(result.suggested_qty),
-                'required_date': result.required_date.isoformat() if result.required_date else None
-            })
-        elif result.suggested_action == models.SuggestedAction.BUY:
-            temp_purchase_reqs.append({
-                'item_code': item.item_code if item else f'Item-{result.item_id}',
-                'item_name': item.item_name if item else '',
-                'quantity': float(result.suggested_qty),
-                'required_date': result.required_date.isoformat() if result.required_date else None
-            })
-    
     return {
         **schemas.ProductionPlanResponse.from_orm(db_plan).dict(),
         'temp_work_orders': temp_work_orders,
@@ -244,6 +331,13 @@ def process_plan(
     """
     Post-Calculation: Process MRP Results to create PRs and WOs.
     """
+    result = _process_plan(db, plan_id, current_user.id)
+    db.commit()
+    return result
+
+
+def _process_plan(db: Session, plan_id: int, user_id: int, progress=_no_progress) -> dict:
+    """PR/WO creation shared by the process endpoint and background jobs (the caller commits)"""
     db_plan = db.query(models.ProductionPlan).filter(models.ProductionPlan.id == plan_id).first()
     if not db_plan:
         raise HTTPException(status_code=404, detail="Plan not found")
@@ -251,110 +345,457 @@ def process_plan(
     if db_plan.status != 'CALCULATED':
         raise HTTPException(status_code=400, detail="Plan must be calculated first")
     
-    results = db.query(models.MRPResult).filter(
+    results = db.query(
+        models.MRPResult.item_id,
+        models.MRPResult.required_date,
+        models.MRPResult.suggested_action,
+        models.MRPResult.suggested_qty
+    ).filter(
         models.MRPResult.plan_id == plan_id,
         models.MRPResult.suggested_action.in_([models.SuggestedAction.BUY, models.SuggestedAction.MAKE])
-    ).all()
+    ).order_by(models.MRPResult.id).all()
+    
+    snapshot = load_planning_snapshot(db)
+    today = date.today()
+    
+    # Lookups shared by all lines: item-vendor sourcing and default warehouse (Main)
+    sourcing = load_sourcing_index(db)
     
-    pr_counter = 1
-    wo_counter = 1
+    warehouse = db.query(models.MasterWarehouse).filter(models.MasterWarehouse.warehouse_type == 'Main').first()
+    warehouse_id = warehouse.id if warehouse else 1
     
-    for result in results:
+    # Work order numbers are reserved as one block; PR numbers are scoped to the plan
+    doc_date = get_utc_now().strftime('%Y%m%d')
+    job_nos = document_numbers.allocate_document_numbers(
+        db, "WO", sum(1 for result in results if result.suggested_action == models.SuggestedAction.MAKE)
+    )
+    progress(10)
+    
+    pr_rows = []
+    wo_rows = []
+    
+    for position, result in enumerate(results):
+        if position % PROGRESS_EVERY == 0:
+            progress(10 + 70 * position // len(results))
         if result.suggested_action == models.SuggestedAction.BUY:
-            # Create Draft PR
-            vendor = db.query(models.MasterBusinessPartner).filter(
-                models.MasterBusinessPartner.partner_type.in_(['VENDOR', 'BOTH']),
-                models.MasterBusinessPartner.is_active == True
-            ).first()
-            
-            if vendor:
-                total_lead_time = (vendor.lead_time_production_days or 0) + (vendor.lead_time_transit_days or 0)
-                suggested_order_date = result.required_date - timedelta(days=int(total_lead_time))
-                
-                pr_no = f"PR-{get_utc_now().strftime('%Y%m%d')}-{db_plan.id}-{pr_counter:04d}"
-                db_pr = models.DraftPurchaseRequisition(
-                    pr_no=pr_no,
-                    plan_id=db_plan.id,
-                    vendor_id=vendor.id,
-                    item_id=result.item_id,
-                    required_qty=result.suggested_qty,
-                    required_date=result.required_date,
-                    suggested_order_date=suggested_order_date,
-                    status='DRAFT'
-                )
-                db.add(db_pr)
-                pr_counter += 1
+            # Draft PR from the item's preferred vendor
+            source = sourcing.source_for(result.item_id, result.suggested_qty)
+            if source:
+                pr_rows.append({
+                    'pr_no': f"PR-{doc_date}-{db_plan.id}-{len(pr_rows) + 1:04d}",
+                    'plan_id': db_plan.id,
+                    'vendor_id': source.vendor_id,
+                    'item_id': result.item_id,
+                    'required_qty': order_quantity(source, result.suggested_qty),
+                    'required_date': result.required_date,
+                    'suggested_order_date': result.required_date - timedelta(days=source.lead_time_days),
+                    'status': 'DRAFT'
+                })
                 
         elif result.suggested_action == models.SuggestedAction.MAKE:
-            # Create Planned Work Order
-            # Generate Job No
-            job_count = db.query(func.count(models.TrnJobOrderHead.id)).scalar()
-            job_no = f"WO-{get_utc_now().strftime('%Y%m%d')}-{job_count + wo_counter:05d}"
-            
-            # Default warehouse (Main)
-            warehouse = db.query(models.MasterWarehouse).filter(models.MasterWarehouse.warehouse_type == 'Main').first()
-            warehouse_id = warehouse.id if warehouse else 1
-            
-            wo = models.TrnJobOrderHead(
-                job_no=job_no,
-                item_id=result.item_id,
-                qty_planned=result.suggested_qty,
-                qty_produced=Decimal(0),
-                start_date=date.today(), # Should be calculated based on lead time
-                end_date=result.required_date,
-                status=models.JobStatus.PLANNED,
-                warehouse_id=warehouse_id,
-                created_by=current_user.id
-            )
-            db.add(wo)
-            wo_counter += 1
-            
+            # Planned Work Order
+            wo_rows.append({
+                'job_no': job_nos[len(wo_rows)],
+                'item_id': result.item_id,
+                'qty_planned': result.suggested_qty,
+                'qty_produced': Decimal(0),
+                'start_date': max(today, result.required_date - timedelta(days=snapshot.lead_time_days(result.item_id))),
+                'end_date': result.required_date,
+                'due_date': result.required_date,
+                'status': models.JobStatus.PLANNED,
+                'warehouse_id': warehouse_id,
+                'created_by': user_id
+            })
+    
+    # One multi-row insert per table
+    if pr_rows:
+        db.execute(insert(models.DraftPurchaseRequisition), pr_rows)
+    if wo_rows:
+        db.execute(insert(models.TrnJobOrderHead), wo_rows)
+    progress(95)
+    
     # Update plan status
     db_plan.status = 'PROCESSED'
     
-    db.commit()
+    db.flush()
     db.refresh(db_plan)
     
-    # Prepare created WOs and PRs for response
-    created_work_orders = []
-    created_purchase_reqs = []
-    
-    # Get the PRs and WOs that were just created
-    prs = db.query(models.DraftPurchaseRequisition).filter(
-        models.DraftPurchaseRequisition.plan_id == plan_id
-    ).all()
-    
-    wos = db.query(models.TrnJobOrderHead).filter(
-        models.TrnJobOrderHead.status == models.JobStatus.PLANNED
-    ).order_by(models.TrnJobOrderHead.id.desc()).limit(wo_counter).all()
-    
-    for pr in prs:
-        item = db.query(models.MasterItem).filter(models.MasterItem.id == pr.item_id).first()
-        created_purchase_reqs.append({
-            'pr_no': pr.pr_no,
-            'item_code': item.item_code if item else f'Item-{pr.item_id}',
-            'item_name': item.item_name if item else '',
-            'quantity': float(pr.quantity),
-            'required_date': pr.required_date.isoformat() if pr.required_date else None
-        })
-    
-    for wo in wos:
-        item = db.query(models.MasterItem).filter(models.MasterItem.id == wo.item_id).first()
-        created_work_orders.append({
-            'job_no': wo.job_no,
-            'item_code': item.item_code if item else f'Item-{wo.item_id}',
+    # Response from the rows just inserted
+    def created(row, number_field, quantity_field, date_field):
+        item = snapshot.items.get(row['item_id'])
+        return {
+            number_field: row[number_field],
+            'item_code': item.item_code if item else f"Item-{row['item_id']}",
             'item_name': item.item_name if item else '',
-            'quantity': float(wo.qty_planned),
-            'required_date': wo.end_date.isoformat() if wo.end_date else None
-        })
+            'quantity': float(row[quantity_field]),
+            'required_date': row[date_field].isoformat() if row[date_field] else None
+        }
     
     return {
         **schemas.ProductionPlanResponse.from_orm(db_plan).dict(),
-        'work_orders_created': created_work_orders,
-        'prs_created': created_purchase_reqs
+        'work_orders_created': [created(row, 'job_no', 'qty_planned', 'end_date') for row in wo_rows],
+        'prs_created': [created(row, 'pr_no', 'required_qty', 'required_date') for row in pr_rows]
     }
 
 
+# ==================== BACKGROUND JOBS ====================
+def _plan_job_task(run, *args) -> planning_jobs.JobTask:
+    """Wrap a calculate/process run as a job task returning the endpoint's JSON payload"""
+    def task(db: Session, progress) -> dict:
+        result = run(db, *args, progress=progress)
+        return jsonable_encoder(schemas.ProductionPlanResponse(**result))
+    return task
+
+
+def _submit_plan_job(db: Session, plan_id: int, job_type: str, parameters: dict, user_id: int, task):
+    if not db.query(models.ProductionPlan.id).filter(models.ProductionPlan.id == plan_id).first():
+        raise HTTPException(status_code=404, detail="Plan not found")
+    try:
+        return planning_jobs.submit_job(db, plan_id, job_type, parameters, user_id, task)
+    except planning_jobs.JobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post(
+    "/{plan_id}/calculate/jobs",
+    response_model=schemas.PlanningJobResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+def submit_calculate_job(
+    plan_id: int,
+    bucket: str = "DAY",
+    mode: str = "FULL",
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Run the MRP calculation of a plan as a background job.
+    Same parameters and result as POST /{plan_id}/calculate; poll GET /jobs/{job_id}.
+    """
+    _validate_calculation_options(bucket, mode)
+    return _submit_plan_job(
+        db, plan_id, 'CALCULATE', {"bucket": bucket, "mode": mode}, current_user.id,
+        _plan_job_task(_calculate_plan, plan_id, bucket, mode)
+    )
+
+
+@router.post(
+    "/{plan_id}/process/jobs",
+    response_model=schemas.PlanningJobResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+def submit_process_job(
+    plan_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Create the PRs and WOs of a calculated plan as a background job.
+    Same result as POST /{plan_id}/process; poll GET /jobs/{job_id}.
+    """
+    return _submit_plan_job(
+        db, plan_id, 'PROCESS', {}, current_user.id,
+        _plan_job_task(_process_plan, plan_id, current_user.id)
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.PlanningJobResponse)
+def get_planning_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Status, progress and (when completed) result of a planning job"""
+    job = planning_jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=schemas.PlanningJobResponse)
+def cancel_planning_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Cancel a queued or running planning job; its changes are rolled back"""
+    try:
+        job = planning_jobs.cancel_job(db, job_id)
+    except planning_jobs.JobNotCancellableError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# ==================== LOT SIZING ====================
+@router.get("/lot-sizing", response_model=List[schemas.ItemLotSizingResponse])
+def list_lot_sizing(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Items with an explicit MRP lot-sizing policy"""
+    return db.query(models.ItemLotSizing).order_by(models.ItemLotSizing.item_id).all()
+
+
+@router.put("/lot-sizing/{item_id}", response_model=schemas.ItemLotSizingResponse)
+def set_lot_sizing(
+    item_id: int,
+    settings: schemas.ItemLotSizingUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Set the lot-sizing policy of an item (Manager/Admin only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    if settings.policy not in POLICIES:
+        raise HTTPException(status_code=400, detail=f"Invalid policy. Must be one of: {list(POLICIES)}")
+    
+    if not db.query(models.MasterItem.id).filter(models.MasterItem.id == item_id).first():
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    db_settings = db.query(models.ItemLotSizing).filter(models.ItemLotSizing.item_id == item_id).first()
+    if not db_settings:
+        db_settings = models.ItemLotSizing(item_id=item_id)
+        db.add(db_settings)
+    
+    for field, value in settings.dict().items():
+        setattr(db_settings, field, value)
+    
+    mark_items_dirty(db, [item_id], SOURCE_LOT_SIZING)
+    db.commit()
+    db.refresh(db_settings)
+    return db_settings
+
+
+@router.delete("/lot-sizing/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_lot_sizing(
+    item_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Remove an item's lot-sizing policy (back to its reorder quantity or lot-for-lot)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    db_settings = db.query(models.ItemLotSizing).filter(models.ItemLotSizing.item_id == item_id).first()
+    if not db_settings:
+        raise HTTPException(status_code=404, detail="Lot-sizing policy not found")
+    
+    db.delete(db_settings)
+    mark_items_dirty(db, [item_id], SOURCE_LOT_SIZING)
+    db.commit()
+    return None
+
+
+# ==================== VENDOR SOURCING ====================
+@router.get("/sourcing", response_model=List[schemas.ItemVendorSourceResponse])
+def list_vendor_sources(
+    item_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Item-vendor sourcing rows, preferred vendors first"""
+    query = db.query(models.ItemVendorSource)
+    if item_id is not None:
+        query = query.filter(models.ItemVendorSource.item_id == item_id)
+    return query.order_by(models.ItemVendorSource.item_id, models.ItemVendorSource.priority).all()
+
+
+@router.put("/sourcing/{item_id}/{vendor_id}", response_model=schemas.ItemVendorSourceResponse)
+def set_vendor_source(
+    item_id: int,
+    vendor_id: int,
+    source: schemas.ItemVendorSourceUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Create or update how an item is bought from a vendor (Manager/Admin only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    if not db.query(models.MasterItem.id).filter(models.MasterItem.id == item_id).first():
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    vendor = db.query(models.MasterBusinessPartner.partner_type).filter(
+        models.MasterBusinessPartner.id == vendor_id
+    ).first()
+    if not vendor:
+        raise HTTPException(status_code=404, detail="Vendor not found")
+    if vendor.partner_type not in VENDOR_TYPES:
+        raise HTTPException(status_code=400, detail="Partner is not a vendor")
+    
+    if source.min_order_qty < 0 or (source.lead_time_days is not None and source.lead_time_days < 0):
+        raise HTTPException(status_code=400, detail="Minimum order quantity and lead time cannot be negative")
+    
+    db_source = db.query(models.ItemVendorSource).filter(
+        models.ItemVendorSource.item_id == item_id,
+        models.ItemVendorSource.vendor_id == vendor_id
+    ).first()
+    if not db_source:
+        db_source = models.ItemVendorSource(item_id=item_id, vendor_id=vendor_id)
+        db.add(db_source)
+    
+    for field, value in source.dict().items():
+        setattr(db_source, field, value)
+    
+    db.commit()
+    db.refresh(db_source)
+    return db_source
+
+
+@router.delete("/sourcing/{item_id}/{vendor_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_vendor_source(
+    item_id: int,
+    vendor_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Stop sourcing an item from a vendor (Manager/Admin only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    db_source = db.query(models.ItemVendorSource).filter(
+        models.ItemVendorSource.item_id == item_id,
+        models.ItemVendorSource.vendor_id == vendor_id
+    ).first()
+    if not db_source:
+        raise HTTPException(status_code=404, detail="Vendor source not found")
+    
+    db.delete(db_source)
+    db.commit()
+    return None
+
+
+# ==================== WHAT-IF SCENARIOS ====================
+def _run_scenario(db: Session, scenario: models.MRPScenario):
+    try:
+        mrp_scenario.run_scenario(db, scenario)
+    except BOMCycleError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    db.refresh(scenario)
+    return scenario
+
+
+@router.post("/scenarios", response_model=schemas.MRPScenarioResponse, status_code=status.HTTP_201_CREATED)
+def create_scenario(
+    scenario: schemas.MRPScenarioCreate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Create and run a what-if MRP scenario.
+    
+    Deltas are overlaid on the live planning data (demand of the base plan,
+    or open sales orders without one; stock; BOM lines) for this run only.
+    Nothing live is changed: results go to the scenario, not to MRPResult.
+    """
+    if scenario.bucket not in BUCKET_DAYS:
+        raise HTTPException(status_code=400, detail=f"Invalid bucket. Must be one of: {list(BUCKET_DAYS)}")
+    
+    if scenario.plan_id is not None and not db.query(models.ProductionPlan.id).filter(
+        models.ProductionPlan.id == scenario.plan_id
+    ).first():
+        raise HTTPException(status_code=404, detail="Plan not found")
+    
+    try:
+        mrp_scenario.validate_deltas(db, scenario.deltas)
+    except mrp_scenario.ScenarioError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    db_scenario = models.MRPScenario(
+        scenario_name=scenario.scenario_name,
+        plan_id=scenario.plan_id,
+        bucket=scenario.bucket,
+        description=scenario.description,
+        run_by=current_user.id,
+        status=models.MRPStatus.RUNNING,
+        deltas=[models.MRPScenarioDelta(**delta.dict()) for delta in scenario.deltas]
+    )
+    db.add(db_scenario)
+    db.flush()
+    
+    return _run_scenario(db, db_scenario)
+
+
+@router.get("/scenarios", response_model=List[schemas.MRPScenarioResponse])
+def list_scenarios(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """List what-if scenarios (newest first)"""
+    return db.query(models.MRPScenario).order_by(models.MRPScenario.id.desc()).all()
+
+
+@router.get("/scenarios/compare", response_model=dict)
+def compare_scenarios(
+    base_id: int,
+    other_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Compare net requirements and planned quantities of two scenarios (other - base)"""
+    found = {
+        row[0] for row in db.query(models.MRPScenario.id).filter(
+            models.MRPScenario.id.in_([base_id, other_id])
+        ).all()
+    }
+    if base_id not in found or other_id not in found:
+        raise HTTPException(status_code=404, detail="Scenario not found")
+    
+    return mrp_scenario.compare_scenarios(db, base_id, other_id)
+
+
+@router.get("/scenarios/{scenario_id}", response_model=schemas.MRPScenarioDetailResponse)
+def get_scenario(
+    scenario_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Scenario with its deltas and MRP results"""
+    scenario = db.query(models.MRPScenario).filter(models.MRPScenario.id == scenario_id).first()
+    if not scenario:
+        raise HTTPException(status_code=404, detail="Scenario not found")
+    return scenario
+
+
+@router.post("/scenarios/{scenario_id}/run", response_model=schemas.MRPScenarioResponse)
+def rerun_scenario(
+    scenario_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Run a scenario again against the current live data"""
+    scenario = db.query(models.MRPScenario).filter(models.MRPScenario.id == scenario_id).first()
+    if not scenario:
+        raise HTTPException(status_code=404, detail="Scenario not found")
+    
+    scenario.run_by = current_user.id
+    return _run_scenario(db, scenario)
+
+
+@router.delete("/scenarios/{scenario_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_scenario(
+    scenario_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Delete a scenario with its deltas and results"""
+    scenario = db.query(models.MRPScenario).filter(models.MRPScenario.id == scenario_id).first()
+    if not scenario:
+        raise HTTPException(status_code=404, detail="Scenario not found")
+    
+    db.query(models.MRPScenarioResult).filter(
+        models.MRPScenarioResult.scenario_id == scenario_id
+    ).delete(synchronize_session=False)
+    db.delete(scenario)
+    db.commit()
+    return None
+
+
 @router.get("/plans", response_model=List[schemas.ProductionPlanResponse])
 def get_production_plans(
     db: Session = Depends(get_db),
@@ -391,6 +832,69 @@ def get_plan_prs(
     return prs
 
 
+@router.get("/plans/{plan_id}/pegging", response_model=List[schemas.MRPPeggingResponse])
+def get_plan_pegging(
+    plan_id: int,
+    item_id: Optional[int] = None,
+    supply_type: Optional[str] = None,
+    demand_type: Optional[str] = None,
+    demand_ref_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 1000,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Get the demand-to-supply pegging of a calculated plan"""
+    query = db.query(models.MRPPegging).filter(models.MRPPegging.plan_id == plan_id)
+    if item_id is not None:
+        query = query.filter(models.MRPPegging.item_id == item_id)
+    if supply_type:
+        query = query.filter(models.MRPPegging.supply_type == supply_type)
+    if demand_type:
+        query = query.filter(models.MRPPegging.demand_type == demand_type)
+    if demand_ref_id is not None:
+        query = query.filter(models.MRPPegging.demand_ref_id == demand_ref_id)
+    return query.order_by(
+        models.MRPPegging.item_id, models.MRPPegging.requirement_date, models.MRPPegging.id
+    ).offset(skip).limit(limit).all()
+
+
+@router.get("/prs/{pr_id}/pegging", response_model=List[schemas.MRPPeggingResponse])
+def get_pr_pegging(
+    pr_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Get the demand a draft PR's planned order is pegged to"""
+    pr = db.query(models.DraftPurchaseRequisition).filter(
+        models.DraftPurchaseRequisition.id == pr_id
+    ).first()
+    if not pr:
+        raise HTTPException(status_code=404, detail="PR not found")
+    
+    return db.query(models.MRPPegging).filter(
+        models.MRPPegging.plan_id == pr.plan_id,
+        models.MRPPegging.item_id == pr.item_id,
+        models.MRPPegging.supply_date == pr.required_date,
+        models.MRPPegging.supply_type == 'PLANNED_ORDER'
+    ).order_by(models.MRPPegging.requirement_date, models.MRPPegging.id).all()
+
+
+@router.get("/pegging/po-lines/{po_detail_id}", response_model=List[schemas.MRPPeggingImpactResponse])
+def get_po_line_impact(
+    po_detail_id: int,
+    slip_to: Optional[date] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    What breaks if a PO line slips: the requirements and end demands pegged to it.
+
+    With slip_to, requirements due before the new date are flagged late.
+    """
+    return purchase_order_impact(db, po_detail_id, slip_to)
+
+
 @router.delete("/plans/{plan_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_production_plan(
     plan_id: int,
@@ -405,6 +909,7 @@ def delete_production_plan(
     # Only allow deleting DRAFT plans or check logic
     # For now, allow deleting any plan, cascading delete handles items/results
     
+    db.query(models.MRPPegging).filter(models.MRPPegging.plan_id == plan_id).delete(synchronize_session=False)
     db.delete(db_plan)
     db.commit()
     return None
@@ -457,7 +962,7 @@ def convert_pr_to_po(
         raise HTTPException(status_code=400, detail="PR must be approved first")
     
     # Create PO
-    po_no = f"PO-{get_utc_now().strftime('%Y%m%d')}-{db.query(func.count(models.TrnPurchaseOrderHead.id)).scalar() + 1:04d}"
+    po_no = document_numbers.next_document_number(db, "PO")
     
     db_po = models.TrnPurchaseOrderHead(
         po_no=po_no,
@@ -470,9 +975,16 @@ def convert_pr_to_po(
     db.add(db_po)
     db.flush()
     
-    # Get item cost
-    item = db.query(models.MasterItem).filter(models.MasterItem.id == pr.item_id).first()
-    unit_price = item.standard_cost if item else Decimal(0)
+    # Last price from the vendor, else item cost
+    source = db.query(models.ItemVendorSource.last_price).filter(
+        models.ItemVendorSource.item_id == pr.item_id,
+        models.ItemVendorSource.vendor_id == pr.vendor_id
+    ).first()
+    if source and source.last_price is not None:
+        unit_price = source.last_price
+    else:
+        item = db.query(models.MasterItem).filter(models.MasterItem.id == pr.item_id).first()
+        unit_price = item.standard_cost if item else Decimal(0)
     
     # Create PO Detail
     db_po_detail = models.TrnPurchaseOrderDetail(
@@ -487,6 +999,7 @@ def convert_pr_to_po(
     # Update PR status
     pr.status = 'CONVERTED_TO_PO'
     
+    mark_items_dirty(db, [pr.item_id], SOURCE_PURCHASE_ORDER)
     db.commit()
     
     return {"message": "PR converted to PO successfully", "po_no": po_no}
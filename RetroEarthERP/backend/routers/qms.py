@@ -12,6 +12,7 @@ import models
 import schemas
 from database import get_db
 from routers.auth import get_current_active_user
+from services import document_numbers
 
 router = APIRouter(
     prefix="/api/qms",
@@ -35,8 +36,7 @@ def create_inspection(
     - OUTGOING: Delivery Order (DO) creation
     """
     # Generate QC number
-    count = db.query(models.QualityInspectionHeader).count()
-    qc_no = f"QC-{get_utc_now().strftime('%Y%m%d')}-{count + 1:04d}"
+    qc_no = document_numbers.next_document_number(db, "QC")
     
     db_inspection = models.QualityInspectionHeader(
         qc_no=qc_no,
@@ -223,8 +223,7 @@ def trigger_incoming_qc(
         return {"message": "QC already exists", "qc_no": existing.qc_no}
     
     # Create QC
-    count = db.query(models.QualityInspectionHeader).count()
-    qc_no = f"QC-INC-{get_utc_now().strftime('%Y%m%d')}-{count + 1:04d}"
+    qc_no = document_numbers.next_document_number(db, "QC-INC")
     
     db_inspection = models.QualityInspectionHeader(
         qc_no=qc_no,
@@ -4,15 +4,14 @@ Implements Quotation → SO → DO → Tax Invoice workflow
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from typing import List, Optional
 from datetime import date, timedelta
 from decimal import Decimal
-from utils.datetime_utils import get_utc_now
 import models
 import schemas
 from database import get_db
 from routers.auth import get_current_active_user
+from services import document_numbers, mrp_net_change
 
 router = APIRouter(
     prefix="/api/sales",
@@ -46,8 +45,7 @@ def create_quotation(
         raise HTTPException(status_code=404, detail="Customer not found")
     
     # Generate quotation number
-    count = db.query(func.count(models.TrnQuotationHead.id)).scalar()
-    quotation_no = f"QT-{get_utc_now().strftime('%Y%m%d')}-{count + 1:05d}"
+    quotation_no = document_numbers.next_document_number(db, "QT")
     
     # Create quotation header
     quotation = models.TrnQuotationHead(
@@ -247,8 +245,7 @@ def convert_quotation_to_so(
         raise HTTPException(status_code=400, detail="Quotation already converted to SO")
     
     # Generate SO number
-    count = db.query(func.count(models.TrnSalesOrderHead.id)).scalar()
-    so_no = f"SO-{get_utc_now().strftime('%Y%m%d')}-{count + 1:05d}"
+    so_no = document_numbers.next_document_number(db, "SO")
     
     # Create SO Header
     sales_order = models.TrnSalesOrderHead(
@@ -282,6 +279,9 @@ def convert_quotation_to_so(
     # Update quotation status
     quotation.status = 'CONVERTED'
     
+    mrp_net_change.mark_items_dirty(
+        db, [qt_detail.item_id for qt_detail in qt_details], mrp_net_change.SOURCE_SALES_ORDER
+    )
     db.commit()
     
     return {
@@ -333,8 +333,7 @@ def create_invoice_from_do(
         raise HTTPException(status_code=404, detail="Sales Order not found")
     
     # Generate invoice number
-    count = db.query(func.count(models.TrnTaxInvoiceHead.id)).scalar()
-    invoice_no = f"INV-{get_utc_now().strftime('%Y%m%d')}-{count + 1:05d}"
+    invoice_no = document_numbers.next_document_number(db, "INV")
     
     # Get customer payment terms
     customer = db.query(models.MasterBusinessPartner).filter(
@@ -14,6 +14,7 @@ from database import get_db
 import models
 import schemas
 import auth as auth_utils
+from services import bom_graph, capacity_scheduler, document_numbers, inventory_balance, mrp_net_change
 
 router = APIRouter()
 
@@ -21,9 +22,7 @@ router = APIRouter()
 # ==================== HELPER FUNCTIONS ====================
 def _generate_job_no(db: Session) -> str:
     """Generate unique job number"""
-    count = db.query(models.TrnJobOrderHead).count()
-    now = get_utc_now()
-    return f"WO-{now.strftime('%Y%m%d')}-{count + 1:05d}"
+    return document_numbers.next_document_number(db, "WO")
 
 
 def _get_work_order_response(db: Session, wo: models.TrnJobOrderHead) -> dict:
@@ -89,6 +88,7 @@ def _get_work_order_response(db: Session, wo: models.TrnJobOrderHead) -> dict:
         "qty_produced": float(wo.qty_produced),
         "start_date": wo.start_date,
         "end_date": wo.end_date,
+        "due_date": wo.due_date,
         "status": wo.status.value if hasattr(wo.status, 'value') else str(wo.status),
         "warehouse_id": wo.warehouse_id,
         "warehouse_code": warehouse.warehouse_code if warehouse else "",
@@ -142,10 +142,7 @@ def generate_work_order_from_bom(
         )
     
     # Check if item has a BOM
-    bom_exists = db.query(models.MasterBOM).filter(
-        models.MasterBOM.parent_item_id == request.item_id,
-        models.MasterBOM.is_active == True
-    ).first()
+    bom_exists = request.item_id in bom_graph.get_bom_graph(db).has_bom
     
     if not bom_exists and request.auto_generate_material_lines:
         raise HTTPException(
@@ -163,6 +160,7 @@ def generate_work_order_from_bom(
         qty_produced=Decimal("0"),
         start_date=request.start_date,
         end_date=request.end_date,
+        due_date=request.end_date,
         status=models.JobStatus.PLANNED,
         warehouse_id=request.warehouse_id,
         created_by=current_user.id
@@ -499,30 +497,13 @@ def complete_work_order(
         )
         db.add(fg_txn)
         
-        # Update Balance
-        balance = db.query(models.InventoryBalance).filter(
-            models.InventoryBalance.item_id == wo.item_id,
-            models.InventoryBalance.warehouse_id == wo.warehouse_id,
-            models.InventoryBalance.lot_number == wo.lot_number
-        ).first()
-        
-        if not balance:
-            balance = models.InventoryBalance(
-                item_id=wo.item_id,
-                warehouse_id=wo.warehouse_id,
-                lot_number=wo.lot_number,
-                qty_on_hand=0,
-                avg_cost=0
-            )
-            db.add(balance)
-            
-        # Update balance and cost layer (standard cost)
+        # Update balance (atomic upsert, moving average) and cost layer (standard cost)
         item = db.query(models.MasterItem).filter(models.MasterItem.id == wo.item_id).first()
         unit_cost = item.standard_cost or Decimal(0)
         
-        balance.qty_on_hand += wo.qty_produced
-        # Simplified avg cost update
-        balance.avg_cost = unit_cost 
+        inventory_balance.receive_stock(
+            db, wo.item_id, wo.warehouse_id, None, wo.lot_number, wo.qty_produced, unit_cost
+        )
         
         # Create Cost Layer
         cost_layer = models.InventoryCostLayer(
@@ -535,6 +516,8 @@ def complete_work_order(
             lot_number=wo.lot_number
         )
         db.add(cost_layer)
+        
+        mrp_net_change.mark_items_dirty(db, [wo.item_id], mrp_net_change.SOURCE_INVENTORY)
     
     db.commit()
     
@@ -588,3 +571,45 @@ def get_work_order_stats(
         "overdue": overdue
     }
 
+
+# ==================== CAPACITY SCHEDULING ====================
+@router.post("/schedule", response_model=dict)
+def schedule_work_orders(
+    direction: str = "FORWARD",
+    start_date: Optional[date] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_active_manager)
+):
+    """
+    Schedule open Work Orders onto machine capacity (Manager/Admin only).
+    
+    Machine hours come from the BOM routing (machine and capacity per hour);
+    orders are dispatched by earliest due date, FORWARD (as soon as possible)
+    or BACKWARD (as late as the due date allows). Planned orders get new
+    start/end dates.
+    """
+    try:
+        summary = capacity_scheduler.schedule_work_orders(db, direction.upper(), start_date)
+    except capacity_scheduler.SchedulingError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    db.commit()
+    return summary
+
+
+@router.get("/schedule/load", response_model=List[dict])
+def get_machine_load(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    bucket: str = "DAY",
+    machine_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth_utils.get_current_user)
+):
+    """Scheduled machine load against capacity per day or week (default: next 4 weeks)"""
+    date_from = date_from or date.today()
+    date_to = date_to or date_from + timedelta(days=27)
+    try:
+        return capacity_scheduler.machine_load_buckets(db, date_from, date_to, bucket.upper(), machine_id)
+    except capacity_scheduler.SchedulingError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
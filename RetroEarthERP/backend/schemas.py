@@ -229,6 +229,7 @@ class MachineBase(BaseModel):
     maintenance_vendor_id: Optional[int] = None
     maintenance_interval_days: int = 30
     status: str = "ACTIVE"
+    hours_per_day: Decimal = Decimal(8)
     is_active: bool = True
 
 class MachineCreate(MachineBase):
@@ -402,6 +403,126 @@ class ProductionPlanResponse(BaseModel):
         from_attributes = True
 
 
+class MRPPeggingResponse(BaseModel):
+    id: int
+    plan_id: int
+    item_id: int
+    level: int
+    parent_item_id: Optional[int] = None
+    requirement_date: date
+    quantity: Decimal
+    supply_type: str
+    supply_ref_id: Optional[int] = None
+    supply_date: Optional[date] = None
+    demand_type: str
+    demand_ref_id: Optional[int] = None
+    demand_item_id: Optional[int] = None
+    demand_date: Optional[date] = None
+    
+    class Config:
+        from_attributes = True
+
+class MRPPeggingImpactResponse(MRPPeggingResponse):
+    late: bool = False
+
+class MRPScenarioDeltaBase(BaseModel):
+    delta_type: str  # DEMAND, INVENTORY, BOM
+    item_id: int  # BOM: parent item
+    child_item_id: Optional[int] = None  # BOM only
+    delta_date: Optional[date] = None  # DEMAND only
+    quantity: Decimal  # DEMAND/INVENTORY: +/- change, BOM: new qty per parent (0 = remove line)
+
+class MRPScenarioDeltaResponse(MRPScenarioDeltaBase):
+    id: int
+    
+    class Config:
+        from_attributes = True
+
+class MRPScenarioCreate(BaseModel):
+    scenario_name: str
+    plan_id: Optional[int] = None  # Base demand; None = open sales orders
+    bucket: str = "DAY"
+    description: Optional[str] = None
+    deltas: List[MRPScenarioDeltaBase] = []
+
+class MRPScenarioResultResponse(MRPResultBase):
+    id: int
+    
+    class Config:
+        from_attributes = True
+
+class MRPScenarioResponse(BaseModel):
+    id: int
+    scenario_name: str
+    plan_id: Optional[int] = None
+    bucket: Optional[str] = None
+    description: Optional[str] = None
+    status: str
+    run_date: Optional[datetime] = None
+    run_by: int
+    deltas: List[MRPScenarioDeltaResponse] = []
+    
+    class Config:
+        from_attributes = True
+
+class MRPScenarioDetailResponse(MRPScenarioResponse):
+    results: List[MRPScenarioResultResponse] = []
+
+
+class ItemLotSizingUpdate(BaseModel):
+    policy: str = "L4L"  # L4L, FOQ, EOQ, POQ, MIN_MAX
+    order_quantity: Optional[Decimal] = None
+    periods: Optional[int] = None
+    min_qty: Optional[Decimal] = None
+    max_qty: Optional[Decimal] = None
+    ordering_cost: Decimal = Decimal(0)
+    holding_cost_rate: Decimal = Decimal(0)
+
+class ItemLotSizingResponse(ItemLotSizingUpdate):
+    item_id: int
+    updated_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class ItemVendorSourceUpdate(BaseModel):
+    priority: int = 1
+    lead_time_days: Optional[int] = None
+    min_order_qty: Decimal = Decimal(0)
+    last_price: Optional[Decimal] = None
+    is_active: bool = True
+
+class ItemVendorSourceResponse(ItemVendorSourceUpdate):
+    id: int
+    item_id: int
+    vendor_id: int
+    updated_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class PlanningJobResponse(BaseModel):
+    id: int
+    plan_id: int
+    job_type: str
+    parameters: Optional[dict] = None
+    status: str
+    progress: int
+    cancel_requested: bool
+    error: Optional[str] = None
+    result: Optional[dict] = None
+    worker_id: Optional[str] = None
+    heartbeat_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
 # Purchase Requisition Schemas
 class DraftPRCreate(BaseModel):
     vendor_id: int
@@ -612,6 +733,34 @@ class BOMExplosionResponse(BaseModel):
         from_attributes = True
 
 
+class BOMBatchExplosionItem(BaseModel):
+    """One parent in a batch explosion"""
+    parent_item_id: int
+    quantity: Decimal = Decimal("1.0")
+    revision: Optional[int] = None  # Specific revision, or None for active
+
+
+class BOMBatchExplosionRequest(BaseModel):
+    """Request for exploding several parents at once"""
+    items: List[BOMBatchExplosionItem]
+    include_optional: bool = False
+    include_byproducts: bool = False
+    max_levels: int = 10
+
+
+class BOMDemandLine(BaseModel):
+    """Independent demand for one end item"""
+    item_id: int
+    quantity: Decimal
+
+
+class BOMTotalRequirementsRequest(BaseModel):
+    """Request for total component requirements of a demand vector"""
+    demands: List[BOMDemandLine]
+    include_optional: bool = False  # Include optional components
+    include_byproducts: bool = False  # Include by-products in output
+
+
 # Packaging Schemas
 class PackagingBOMCreate(BaseModel):
     fg_item_id: int
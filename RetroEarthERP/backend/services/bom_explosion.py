@@ -0,0 +1,413 @@
+"""
+BOM Explosion Engine
+Level-by-level explosion of multi-level Bills of Materials over the cached BOM graph
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from sqlalchemy.orm import Session
+from decimal import Decimal
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+import models
+from services import bom_graph
+from services.low_level_code import BOMCycleError
+
+
+# Maximum per-unit explosion results kept in memory
+EXPLOSION_CACHE_SIZE = 512
+
+
+def _collect_reachable(
+    graph: bom_graph.BOMGraph,
+    parent_item_id: int,
+    revision: Optional[int],
+    include_optional: bool,
+    include_byproducts: bool,
+    max_levels: int
+) -> Dict[int, Tuple[bom_graph.BOMEdge, ...]]:
+    """
+    Walk the cached graph breadth-first and pick the lines of every parent
+    reachable within max_levels (each sub-assembly is visited once).
+    """
+    lines_by_parent: Dict[int, Tuple[bom_graph.BOMEdge, ...]] = {}
+
+    frontier = {parent_item_id}
+    level_revision = revision
+    level = 1
+
+    while frontier and level <= max_levels:
+        next_frontier = set()
+        for parent_id in frontier:
+            lines = tuple(
+                edge for edge in graph.lines(parent_id, level_revision)
+                if (include_optional or not edge.is_optional)
+                and (include_byproducts or not edge.is_byproduct)
+            )
+            lines_by_parent[parent_id] = lines
+            for edge in lines:
+                if edge.child_item_id in graph.has_bom and edge.child_item_id not in lines_by_parent:
+                    next_frontier.add(edge.child_item_id)
+
+        frontier = next_frontier - lines_by_parent.keys()
+        level_revision = None  # Use active revision for sub-components
+        level += 1
+
+    return lines_by_parent
+
+
+# One exploded BOM line for a single unit of the top-level item
+ExplosionEntry = namedtuple("ExplosionEntry", [
+    "level",
+    "parent_item_id",
+    "edge",
+    "bom_quantity",
+    "scrap_factor",
+    "required_quantity",
+    "scrap_quantity",
+    "total_quantity",
+])
+
+# Cached per-unit explosion: the entries and their (required, scrap, total)
+# quantities as one read-only float array, so scaling is a single multiply
+PerUnitExplosion = namedtuple("PerUnitExplosion", [
+    "entries",      # tuple of ExplosionEntry
+    "quantities",   # np.ndarray (entries x 3)
+])
+
+
+class ExplosionCache:
+    """
+    Bounded LRU cache of per-unit explosion results.
+
+    Explosion output is linear in the requested quantity, so one entry per
+    (parent, revision, include_optional, include_byproducts, max_levels)
+    serves every quantity. All entries are dropped when the BOM graph
+    version changes.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, version: int):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, version: int, value) -> None:
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "bom_version": self._version
+            }
+
+
+explosion_cache = ExplosionCache(EXPLOSION_CACHE_SIZE)
+
+
+def _explode_per_unit(
+    graph: bom_graph.BOMGraph,
+    parent_item_id: int,
+    revision: Optional[int],
+    include_optional: bool,
+    include_byproducts: bool,
+    max_levels: int
+) -> Tuple[ExplosionEntry, ...]:
+    """Explode one unit of a parent item, depth-first, entirely in memory"""
+    lines_by_parent = _collect_reachable(
+        graph, parent_item_id, revision, include_optional, include_byproducts, max_levels
+    )
+    entries = []
+
+    def walk(parent_id: int, qty: Decimal, level: int, path: frozenset):
+        for edge in lines_by_parent.get(parent_id, ()):
+            # Calculate quantities based on BOM type
+            if edge.bom_type == 'FORMULA' and edge.percentage:
+                # Formula: percentage-based calculation
+                bom_qty = Decimal(str(edge.percentage)) / Decimal("100")
+            else:
+                # Assembly, Modular, Tailor-Made: fixed quantity
+                bom_qty = Decimal(str(edge.quantity))
+            required_qty = qty * bom_qty
+
+            # Calculate scrap
+            scrap_factor = Decimal(str(edge.scrap_factor)) if edge.scrap_factor else Decimal("0")
+            scrap_qty = required_qty * (scrap_factor / Decimal("100"))
+            total_qty = required_qty + scrap_qty
+
+            entries.append(ExplosionEntry(
+                level, parent_id, edge, bom_qty, scrap_factor, required_qty, scrap_qty, total_qty
+            ))
+
+            # Recurse into sub-assemblies
+            child_id = edge.child_item_id
+            if child_id in path:
+                raise BOMCycleError(
+                    f"Circular BOM reference: item {child_id} is a component of itself "
+                    f"(via item {parent_id})"
+                )
+            if child_id in graph.has_bom and level < max_levels:
+                # Use total qty (including scrap) for sub-explosion
+                walk(child_id, total_qty, level + 1, path | {child_id})
+
+    walk(parent_item_id, Decimal("1"), 1, frozenset({parent_item_id}))
+    return tuple(entries)
+
+
+def _get_per_unit_entries(
+    graph: bom_graph.BOMGraph,
+    parent_item_id: int,
+    revision: Optional[int],
+    include_optional: bool,
+    include_byproducts: bool,
+    max_levels: int
+) -> PerUnitExplosion:
+    """Get the per-unit explosion from the cache, computing it on a miss"""
+    cache_key = (parent_item_id, revision, include_optional, include_byproducts, max_levels)
+    explosion = explosion_cache.get(cache_key, graph.version)
+    if explosion is None:
+        entries = _explode_per_unit(
+            graph, parent_item_id, revision, include_optional, include_byproducts, max_levels
+        )
+        quantities = np.array(
+            [(entry.required_quantity, entry.scrap_quantity, entry.total_quantity) for entry in entries],
+            dtype=np.float64
+        ).reshape(len(entries), 3)
+        quantities.setflags(write=False)
+        explosion = PerUnitExplosion(entries, quantities)
+        explosion_cache.put(cache_key, graph.version, explosion)
+    return explosion
+
+
+def _load_line_master_data(
+    db: Session,
+    explosions: List[PerUnitExplosion],
+    items: Dict[int, models.MasterItem]
+) -> Dict[int, str]:
+    """
+    Load items and location codes referenced by explosion entries with one
+    batched query each. Items are added to the given dict in place.
+    """
+    item_ids = set()
+    location_ids = set()
+    for explosion in explosions:
+        for entry in explosion.entries:
+            item_ids.add(entry.edge.child_item_id)
+            if entry.edge.production_location_id:
+                location_ids.add(entry.edge.production_location_id)
+            if entry.edge.storage_location_id:
+                location_ids.add(entry.edge.storage_location_id)
+
+    item_ids -= items.keys()
+    if item_ids:
+        items.update({
+            item.id: item for item in db.query(models.MasterItem).filter(
+                models.MasterItem.id.in_(item_ids)
+            ).all()
+        })
+
+    location_codes = {}
+    if location_ids:
+        location_codes = dict(db.query(
+            models.LocationMaster.id, models.LocationMaster.location_code
+        ).filter(models.LocationMaster.id.in_(location_ids)).all())
+    return location_codes
+
+
+def _scale_entries(
+    explosion: PerUnitExplosion,
+    quantity: Decimal,
+    items: Dict[int, models.MasterItem],
+    location_codes: Dict[int, str]
+) -> List[dict]:
+    """Scale a per-unit explosion to the requested quantity (one array multiply) and build its lines"""
+    scaled = (explosion.quantities * float(quantity)).tolist()
+    results = []
+    for entry, (required_qty, scrap_qty, total_qty) in zip(explosion.entries, scaled):
+        edge = entry.edge
+        child_item = items.get(edge.child_item_id)
+        if not child_item:
+            continue
+
+        results.append({
+            "level": entry.level,
+            "item_id": child_item.id,
+            "item_code": child_item.item_code,
+            "item_name": child_item.item_name,
+            "item_type": child_item.item_type.value if hasattr(child_item.item_type, 'value') else str(child_item.item_type),
+            "unit_of_measure": child_item.unit_of_measure,
+            "bom_quantity": float(entry.bom_quantity),
+            "required_quantity": required_qty,
+            "scrap_factor": float(entry.scrap_factor),
+            "scrap_quantity": scrap_qty,
+            "total_quantity": total_qty,
+            "bom_type": edge.bom_type,
+            "is_optional": edge.is_optional,
+            "is_byproduct": edge.is_byproduct,
+            "sequence_order": edge.sequence_order,
+            "percentage": float(edge.percentage) if edge.percentage else None,
+            "production_location": location_codes.get(edge.production_location_id),
+            "storage_location": location_codes.get(edge.storage_location_id),
+            "parent_item_id": entry.parent_item_id,
+            "parent_item_code": items[entry.parent_item_id].item_code if entry.parent_item_id in items else None,
+            "bom_id": edge.bom_id,
+            "revision": edge.revision,
+            "remark": edge.remark
+        })
+
+    return results
+
+
+def explode_bom_lines(
+    db: Session,
+    parent_item: models.MasterItem,
+    quantity: Decimal,
+    revision: Optional[int],
+    include_optional: bool,
+    include_byproducts: bool,
+    max_levels: int
+) -> Tuple[List[dict], Set[int]]:
+    """
+    Explode a BOM into a flat, depth-first ordered list of explosion lines.
+
+    The per-unit explosion is taken from the explosion cache (or computed
+    over the cached BOM graph) and scaled to the requested quantity with
+    one multiply of its quantity array. Item and location master data for the lines is read with
+    one batched query each.
+
+    Args:
+        db: Database session
+        parent_item: Top-level item to explode
+        quantity: Quantity to produce
+        revision: Revision for the top level (None = active revision)
+        include_optional: Whether to include optional components
+        include_byproducts: Whether to include by-products
+        max_levels: Maximum depth to explode
+
+    Returns:
+        tuple: (explosion lines, IDs of items that have a BOM)
+
+    Raises:
+        BOMCycleError: If the structure below parent_item is circular
+    """
+    results, has_bom = explode_bom_batch_lines(
+        db, [(parent_item, quantity, revision)], include_optional, include_byproducts, max_levels
+    )
+    return results[0], has_bom
+
+
+def explode_bom_batch_lines(
+    db: Session,
+    parents: List[Tuple[models.MasterItem, Decimal, Optional[int]]],
+    include_optional: bool,
+    include_byproducts: bool,
+    max_levels: int
+) -> Tuple[List[List[dict]], Set[int]]:
+    """
+    Explode several parents in one pass.
+
+    All parents share one BOM graph snapshot, the per-unit explosion cache
+    (a parent requested twice is exploded once) and a single batched load of
+    item and location master data for the whole batch.
+
+    Args:
+        db: Database session
+        parents: (parent item, quantity, top-level revision) per request
+        include_optional: Whether to include optional components
+        include_byproducts: Whether to include by-products
+        max_levels: Maximum depth to explode
+
+    Returns:
+        tuple: (explosion lines per parent in request order, IDs of items that have a BOM)
+
+    Raises:
+        BOMCycleError: If the structure below a parent is circular
+    """
+    graph = bom_graph.get_bom_graph(db)
+
+    explosions = [
+        _get_per_unit_entries(
+            graph, parent_item.id, revision, include_optional, include_byproducts, max_levels
+        )
+        for parent_item, _, revision in parents
+    ]
+
+    items = {parent_item.id: parent_item for parent_item, _, _ in parents}
+    location_codes = _load_line_master_data(db, explosions, items)
+
+    results = [
+        _scale_entries(explosion, quantity, items, location_codes)
+        for explosion, (_, quantity, _) in zip(explosions, parents)
+    ]
+    return results, graph.has_bom
+
+
+def consolidate_lines(lines: List[dict], has_bom: Set[int]) -> List[dict]:
+    """
+    Sum explosion lines per item.
+
+    Args:
+        lines: Explosion lines
+        has_bom: IDs of items that have a BOM (everything else is raw material)
+
+    Returns:
+        list: Consolidated lines, raw materials first, then by item code
+    """
+    consolidated = {}
+    for r in lines:
+        item_key = r["item_id"]
+        if item_key in consolidated:
+            consolidated[item_key]["total_quantity"] += r["total_quantity"]
+            consolidated[item_key]["required_quantity"] += r["required_quantity"]
+            consolidated[item_key]["scrap_quantity"] += r["scrap_quantity"]
+            consolidated[item_key]["occurrences"] += 1
+        else:
+            consolidated[item_key] = {
+                "item_id": r["item_id"],
+                "item_code": r["item_code"],
+                "item_name": r["item_name"],
+                "item_type": r["item_type"],
+                "unit_of_measure": r["unit_of_measure"],
+                "total_quantity": r["total_quantity"],
+                "required_quantity": r["required_quantity"],
+                "scrap_quantity": r["scrap_quantity"],
+                "occurrences": 1,
+                "is_raw_material": item_key not in has_bom
+            }
+
+    return sorted(
+        consolidated.values(),
+        key=lambda x: (not x["is_raw_material"], x["item_code"])
+    )
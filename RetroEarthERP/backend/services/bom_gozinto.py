@@ -0,0 +1,291 @@
+"""
+Gozinto Total-Requirements Solver
+Total component requirements x = (I - A)^-1 d for a whole demand vector, using
+the direct-requirements matrix A of the active BOM structure
+"""
+import threading
+from collections import namedtuple
+from sqlalchemy.orm import Session
+from typing import Dict, List, Set, Tuple
+import numpy as np
+import models
+from services import bom_graph
+from services.low_level_code import BOMCycleError, compute_low_level_codes
+
+
+# Sparse direct-requirements matrix in coordinate form, edges sorted by the
+# low-level code of their parent so that one pass per level solves (I - A)x = d
+GozintoMatrix = namedtuple("GozintoMatrix", [
+    "version",
+    "item_ids",        # np.ndarray: matrix index -> item ID
+    "index",           # dict: item ID -> matrix index
+    "low_level_codes", # np.ndarray: low-level code per matrix index
+    "parent_idx",      # np.ndarray: parent index per edge
+    "child_idx",       # np.ndarray: child index per edge
+    "bom_qty",         # np.ndarray: quantity per parent (FORMULA percentage / 100)
+    "scrap_rate",      # np.ndarray: scrap_factor / 100
+    "level_bounds",    # list of (start, end) edge slices, one per parent level
+])
+
+_matrices: Dict[Tuple[bool, bool], GozintoMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def _level_bounds(parent_levels: np.ndarray) -> List[Tuple[int, int]]:
+    """Edge slices with the same parent level, for edges sorted by parent level"""
+    if not len(parent_levels):
+        return []
+    starts = np.flatnonzero(np.diff(parent_levels)) + 1
+    bounds = np.concatenate(([0], starts, [len(parent_levels)]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _build_matrix(graph: bom_graph.BOMGraph, include_optional: bool, include_byproducts: bool) -> GozintoMatrix:
+    """Build the direct-requirements matrix from the active BOM lines"""
+    llc, cycle_items = compute_low_level_codes(graph)
+    if cycle_items:
+        raise BOMCycleError(
+            f"Circular BOM reference between items {sorted(cycle_items)[:10]}"
+        )
+
+    edges = [
+        edge for lines in graph.children.values() for edge in lines
+        if (include_optional or not edge.is_optional)
+        and (include_byproducts or not edge.is_byproduct)
+    ]
+    edges.sort(key=lambda e: llc.get(e.parent_item_id, 0))
+
+    item_ids = np.array(sorted(llc.keys()), dtype=np.int64)
+    index = {int(item_id): i for i, item_id in enumerate(item_ids)}
+    low_level_codes = np.fromiter((llc[int(item_id)] for item_id in item_ids), dtype=np.int64, count=len(item_ids))
+
+    parent_idx = np.fromiter((index[e.parent_item_id] for e in edges), dtype=np.int64, count=len(edges))
+    child_idx = np.fromiter((index[e.child_item_id] for e in edges), dtype=np.int64, count=len(edges))
+    bom_qty = np.fromiter(
+        (
+            float(e.percentage) / 100.0 if e.bom_type == 'FORMULA' and e.percentage else float(e.quantity)
+            for e in edges
+        ),
+        dtype=np.float64, count=len(edges)
+    )
+    scrap_rate = np.fromiter(
+        (float(e.scrap_factor) / 100.0 if e.scrap_factor else 0.0 for e in edges),
+        dtype=np.float64, count=len(edges)
+    )
+
+    parent_levels = np.fromiter(
+        (llc.get(e.parent_item_id, 0) for e in edges), dtype=np.int64, count=len(edges)
+    )
+    level_bounds = _level_bounds(parent_levels)
+
+    return GozintoMatrix(
+        graph.version, item_ids, index, low_level_codes, parent_idx, child_idx, bom_qty, scrap_rate, level_bounds
+    )
+
+
+def build_matrix(graph: bom_graph.BOMGraph, include_optional: bool = False,
+                 include_byproducts: bool = False) -> GozintoMatrix:
+    """
+    Build an uncached matrix for a graph other than the live one (e.g. a what-if structure).
+
+    Raises:
+        BOMCycleError: If the structure is circular
+    """
+    return _build_matrix(graph, include_optional, include_byproducts)
+
+
+def get_gozinto_matrix(db: Session, include_optional: bool = False, include_byproducts: bool = False) -> GozintoMatrix:
+    """
+    Get the direct-requirements matrix for the current BOM graph version.
+
+    Args:
+        db: Database session
+        include_optional: Whether optional components are part of the matrix
+        include_byproducts: Whether by-products are part of the matrix
+
+    Returns:
+        GozintoMatrix: Cached matrix (rebuilt when the BOM graph changes)
+
+    Raises:
+        BOMCycleError: If the active BOM structure is circular
+    """
+    graph = bom_graph.get_bom_graph(db)
+    key = (include_optional, include_byproducts)
+
+    matrix = _matrices.get(key)
+    if matrix is not None and matrix.version == graph.version:
+        return matrix
+
+    with _matrices_lock:
+        matrix = _matrices.get(key)
+        if matrix is None or matrix.version != graph.version:
+            matrix = _build_matrix(graph, include_optional, include_byproducts)
+            _matrices[key] = matrix
+        return matrix
+
+
+def connected_components(matrix: GozintoMatrix) -> List[np.ndarray]:
+    """
+    Split the BOM structure into families that share no items.
+
+    Args:
+        matrix: Direct-requirements matrix
+
+    Returns:
+        list: Sorted matrix indices of each connected component (items
+              without BOM lines are single-item components)
+    """
+    # Min-label propagation along the edges with pointer jumping (a few rounds)
+    size = len(matrix.item_ids)
+    labels = np.arange(size)
+    while True:
+        low = np.minimum(labels[matrix.parent_idx], labels[matrix.child_idx])
+        updated = labels.copy()
+        np.minimum.at(updated, matrix.parent_idx, low)
+        np.minimum.at(updated, matrix.child_idx, low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+
+    order = np.argsort(labels, kind="stable")
+    splits = np.flatnonzero(np.diff(labels[order])) + 1
+    return np.split(order, splits) if size else []
+
+
+def sub_matrix(matrix: GozintoMatrix, rows: np.ndarray) -> GozintoMatrix:
+    """
+    Restrict the matrix to a set of items closed under BOM edges (e.g. whole components).
+
+    Edges keep their order, so the sub-matrix solves exactly like the full one.
+
+    Args:
+        matrix: Direct-requirements matrix
+        rows: Sorted matrix indices to keep
+
+    Returns:
+        GozintoMatrix: Matrix over the kept items only
+    """
+    local = np.full(len(matrix.item_ids), -1, dtype=np.int64)
+    local[rows] = np.arange(len(rows))
+    edges = np.flatnonzero(local[matrix.parent_idx] >= 0)
+
+    item_ids = matrix.item_ids[rows]
+    parent_idx = local[matrix.parent_idx[edges]]
+    low_level_codes = matrix.low_level_codes[rows]
+    return GozintoMatrix(
+        matrix.version,
+        item_ids,
+        {int(item_id): i for i, item_id in enumerate(item_ids.tolist())},
+        low_level_codes,
+        parent_idx,
+        local[matrix.child_idx[edges]],
+        matrix.bom_qty[edges],
+        matrix.scrap_rate[edges],
+        _level_bounds(low_level_codes[parent_idx])
+    )
+
+
+def solve_total_requirements(
+    matrix: GozintoMatrix,
+    demand: Dict[int, float]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Solve (I - A)x = d level by level.
+
+    Because edges are ordered by the low-level code of their parent, the
+    requirement of every parent is final before its edges are applied, so
+    one vectorized scatter-add per level is an exact triangular solve.
+
+    Args:
+        matrix: Direct-requirements matrix
+        demand: Independent demand by item ID
+
+    Returns:
+        tuple: (required, scrap, occurrences) arrays of dependent requirements
+               per matrix index; occurrences counts BOM paths like explosion lines
+    """
+    size = len(matrix.item_ids)
+    gross = np.zeros(size, dtype=np.float64)
+    paths = np.zeros(size, dtype=np.float64)
+    occurrences = np.zeros(size, dtype=np.float64)
+    required = np.zeros(size, dtype=np.float64)
+    scrap = np.zeros(size, dtype=np.float64)
+
+    for item_id, qty in demand.items():
+        i = matrix.index.get(item_id)
+        if i is not None:
+            gross[i] += qty
+            paths[i] += 1
+
+    for start, end in matrix.level_bounds:
+        parents = matrix.parent_idx[start:end]
+        children = matrix.child_idx[start:end]
+        edge_required = gross[parents] * matrix.bom_qty[start:end]
+        edge_scrap = edge_required * matrix.scrap_rate[start:end]
+        np.add.at(required, children, edge_required)
+        np.add.at(scrap, children, edge_scrap)
+        np.add.at(gross, children, edge_required + edge_scrap)
+        edge_paths = paths[parents]
+        np.add.at(occurrences, children, edge_paths)
+        np.add.at(paths, children, edge_paths)
+
+    return required, scrap, occurrences
+
+
+def total_requirements(
+    db: Session,
+    demand: Dict[int, float],
+    include_optional: bool = False,
+    include_byproducts: bool = False
+) -> Tuple[List[dict], Set[int]]:
+    """
+    Compute consolidated component requirements for a whole demand vector.
+
+    Args:
+        db: Database session
+        demand: Quantity by end item ID
+        include_optional: Whether to include optional components
+        include_byproducts: Whether to include by-products
+
+    Returns:
+        tuple: (consolidated lines as returned by BOM explosion, IDs of items that have a BOM)
+
+    Raises:
+        BOMCycleError: If the active BOM structure is circular
+    """
+    graph = bom_graph.get_bom_graph(db)
+    matrix = get_gozinto_matrix(db, include_optional, include_byproducts)
+    required, scrap, occurrences = solve_total_requirements(matrix, demand)
+
+    component_idx = np.flatnonzero(occurrences > 0)
+    component_ids = matrix.item_ids[component_idx].tolist()
+
+    items = {}
+    if component_ids:
+        items = {
+            item.id: item for item in db.query(models.MasterItem).filter(
+                models.MasterItem.id.in_(component_ids)
+            ).all()
+        }
+
+    consolidated = []
+    for i, item_id in zip(component_idx.tolist(), component_ids):
+        item = items.get(item_id)
+        if not item:
+            continue
+        consolidated.append({
+            "item_id": item.id,
+            "item_code": item.item_code,
+            "item_name": item.item_name,
+            "item_type": item.item_type.value if hasattr(item.item_type, 'value') else str(item.item_type),
+            "unit_of_measure": item.unit_of_measure,
+            "total_quantity": float(required[i] + scrap[i]),
+            "required_quantity": float(required[i]),
+            "scrap_quantity": float(scrap[i]),
+            "occurrences": int(occurrences[i]),
+            "is_raw_material": item.id not in graph.has_bom
+        })
+
+    consolidated.sort(key=lambda x: (not x["is_raw_material"], x["item_code"]))
+    return consolidated, graph.has_bom
@@ -0,0 +1,232 @@
+"""
+BOM Graph Cache
+Process-wide, immutable adjacency-list snapshot of the product structure.
+Invalidated through a version counter in the database so that every
+uvicorn worker rebuilds after a BOM write, not only the one that made it.
+"""
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+from typing import Iterable, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+import models
+
+
+BOM_GRAPH_CACHE_KEY = "bom_graph"
+
+# One active BOM line (immutable)
+BOMEdge = namedtuple("BOMEdge", [
+    "bom_id",
+    "parent_item_id",
+    "child_item_id",
+    "bom_type",
+    "sequence_order",
+    "quantity",
+    "percentage",
+    "is_optional",
+    "is_byproduct",
+    "scrap_factor",
+    "production_location_id",
+    "storage_location_id",
+    "machine_id",
+    "production_lead_time_days",
+    "capacity_per_hour",
+    "remark",
+    "revision",
+    "is_active_revision",
+])
+
+
+class BOMGraph:
+    """
+    Immutable snapshot of all non-deleted BOM lines, keyed by parent item.
+
+    - children: lines of the ACTIVE revision(s) per parent
+    - parents: the same lines keyed by child item (reverse adjacency)
+    - revisions: lines per parent and revision number (any status)
+    - active_revision: revision used when none is requested
+    - has_bom: items that have at least one BOM line
+    """
+
+    __slots__ = ("version", "children", "parents", "revisions", "active_revision", "has_bom")
+
+    def __init__(self, version: int, edges):
+        children = {}
+        parents = {}
+        revisions = {}
+        active_revision = {}
+        first_active_id = {}
+
+        for edge in edges:
+            revisions.setdefault(edge.parent_item_id, {}).setdefault(edge.revision, []).append(edge)
+            if edge.is_active_revision:
+                children.setdefault(edge.parent_item_id, []).append(edge)
+                parents.setdefault(edge.child_item_id, []).append(edge)
+                if edge.bom_id < first_active_id.get(edge.parent_item_id, edge.bom_id + 1):
+                    first_active_id[edge.parent_item_id] = edge.bom_id
+                    active_revision[edge.parent_item_id] = edge.revision
+
+        self.version = version
+        self.children = MappingProxyType({k: tuple(v) for k, v in children.items()})
+        self.parents = MappingProxyType({k: tuple(v) for k, v in parents.items()})
+        self.revisions = MappingProxyType({
+            parent_id: MappingProxyType({rev: tuple(lines) for rev, lines in by_rev.items()})
+            for parent_id, by_rev in revisions.items()
+        })
+        self.active_revision = MappingProxyType(active_revision)
+        self.has_bom = frozenset(revisions.keys())
+
+    def lines(self, parent_item_id: int, revision: Optional[int] = None) -> Tuple[BOMEdge, ...]:
+        """Get the BOM lines of a parent (specific revision, or the active one)"""
+        if revision:
+            return self.revisions.get(parent_item_id, {}).get(revision, ())
+        return self.children.get(parent_item_id, ())
+
+    def descendants(self, item_ids: Iterable[int]) -> Set[int]:
+        """All components below the given items in the active structure"""
+        return self._closure(item_ids, self.children, "child_item_id")
+
+    def ancestors(self, item_ids: Iterable[int]) -> Set[int]:
+        """All parents above the given items in the active structure"""
+        return self._closure(item_ids, self.parents, "parent_item_id")
+
+    @staticmethod
+    def _closure(item_ids, adjacency, field) -> Set[int]:
+        """Items reachable from item_ids over adjacency (excluding the start items unless reached again)"""
+        found = set()
+        stack = list(item_ids)
+        while stack:
+            for edge in adjacency.get(stack.pop(), ()):
+                item_id = getattr(edge, field)
+                if item_id not in found:
+                    found.add(item_id)
+                    stack.append(item_id)
+        return found
+
+
+_graph: Optional[BOMGraph] = None
+_graph_lock = threading.Lock()
+
+
+def get_bom_version(db: Session) -> int:
+    """
+    Read the current BOM structure version from the database.
+
+    Args:
+        db: Database session
+
+    Returns:
+        int: Version counter (0 if no BOM write has been recorded yet)
+    """
+    version = db.query(models.CacheVersion.version).filter(
+        models.CacheVersion.cache_key == BOM_GRAPH_CACHE_KEY
+    ).scalar()
+    return version or 0
+
+
+def bump_bom_version(db: Session) -> None:
+    """
+    Increment the BOM structure version inside the caller's transaction.
+
+    Must be called by every write to master_bom before committing, so the
+    new version becomes visible together with the changed lines.
+
+    Args:
+        db: Database session
+    """
+    updated = db.query(models.CacheVersion).filter(
+        models.CacheVersion.cache_key == BOM_GRAPH_CACHE_KEY
+    ).update(
+        {"version": models.CacheVersion.version + 1},
+        synchronize_session=False
+    )
+    if not updated:
+        db.add(models.CacheVersion(cache_key=BOM_GRAPH_CACHE_KEY, version=1))
+
+
+def _build_bom_graph(db: Session, version: int) -> BOMGraph:
+    """Load every non-deleted BOM line with a single query"""
+    B = models.MasterBOM
+    rows = db.query(
+        B.id, B.parent_item_id, B.child_item_id, B.bom_type, B.sequence_order,
+        B.quantity, B.percentage, B.is_optional, B.is_byproduct, B.scrap_factor,
+        B.production_location_id, B.storage_location_id, B.machine_id,
+        B.production_lead_time_days, B.capacity_per_hour, B.remark,
+        B.revision, B.status
+    ).filter(
+        B.is_active == True
+    ).order_by(B.parent_item_id, B.sequence_order, B.id).all()
+
+    edges = [
+        BOMEdge(*row[:-1], is_active_revision=(row[-1] == models.BOMStatus.ACTIVE))
+        for row in rows
+    ]
+    return BOMGraph(version, edges)
+
+
+def get_bom_graph(db: Session) -> BOMGraph:
+    """
+    Get the cached BOM graph, rebuilding it if another writer bumped the version.
+
+    Args:
+        db: Database session
+
+    Returns:
+        BOMGraph: Current immutable snapshot
+    """
+    global _graph
+
+    version = get_bom_version(db)
+    graph = _graph
+    if graph is not None and graph.version >= version:
+        return graph
+
+    with _graph_lock:
+        if _graph is None or _graph.version < version:
+            _graph = _build_bom_graph(db, version)
+        return _graph
+
+
+def load_bom_graph(db: Session) -> BOMGraph:
+    """
+    Build a graph from the session's own view of the BOM lines, bypassing the cache.
+
+    For use inside a BOM write before it commits: the graph includes the
+    session's uncommitted changes (pending ones are flushed first), so it
+    must not be shared with other requests.
+
+    Args:
+        db: Database session
+
+    Returns:
+        BOMGraph: Snapshot of this session's view
+    """
+    db.flush()
+    return _build_bom_graph(db, get_bom_version(db))
+
+
+def lock_bom_structure(db: Session) -> BOMGraph:
+    """
+    Start a BOM write: bump the version and load the structure being changed.
+
+    The version UPDATE locks the version row (the whole database on SQLite)
+    until the transaction ends, so BOM writers run one at a time and each
+    sees the lines the previous one committed. Checks made against the
+    returned graph (cycles, low-level codes) therefore still hold at commit.
+    Call it before reading any BOM lines the write depends on.
+
+    Args:
+        db: Database session
+
+    Returns:
+        BOMGraph: The session's view of the structure (see load_bom_graph)
+    """
+    bump_bom_version(db)
+    return load_bom_graph(db)
+
+
+def invalidate_bom_graph() -> None:
+    """Drop this process's cached graph (next read rebuilds it)"""
+    global _graph
+    with _graph_lock:
+        _graph = None
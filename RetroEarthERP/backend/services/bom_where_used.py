@@ -0,0 +1,131 @@
+"""
+BOM Where-Used (Implosion) Service
+Single- and multi-level where-used over the reverse adjacency of the cached BOM graph
+"""
+from collections import deque
+from sqlalchemy.orm import Session
+from decimal import Decimal
+from typing import Dict
+import models
+from services import bom_graph
+
+
+def _edge_quantity(edge: bom_graph.BOMEdge) -> Decimal:
+    """Quantity of the child consumed per unit of the parent, including scrap"""
+    if edge.bom_type == 'FORMULA' and edge.percentage:
+        bom_qty = Decimal(str(edge.percentage)) / Decimal("100")
+    else:
+        bom_qty = Decimal(str(edge.quantity))
+    scrap_factor = Decimal(str(edge.scrap_factor)) if edge.scrap_factor else Decimal("0")
+    return bom_qty * (Decimal("1") + scrap_factor / Decimal("100"))
+
+
+def where_used(
+    db: Session,
+    item: models.MasterItem,
+    include_optional: bool = True,
+    include_byproducts: bool = False
+) -> dict:
+    """
+    Implode an item through the active BOM structure.
+
+    Every ancestor is visited once, in reverse topological order, so its
+    cumulative quantity-per (summed over all paths) is final when visited.
+
+    Args:
+        db: Database session
+        item: Component to implode
+        include_optional: Whether optional BOM lines count as usage
+        include_byproducts: Whether by-product lines count as usage
+
+    Returns:
+        dict: Direct parents (single level) and all ancestors (multi level)
+    """
+    graph = bom_graph.get_bom_graph(db)
+
+    def usages(item_id):
+        return [
+            edge for edge in graph.parents.get(item_id, ())
+            if (include_optional or not edge.is_optional)
+            and (include_byproducts or not edge.is_byproduct)
+        ]
+
+    # Collect ancestors and count the edges each one has into the set
+    pending: Dict[int, int] = {}
+    stack = [item.id]
+    seen = {item.id}
+    while stack:
+        node = stack.pop()
+        for edge in usages(node):
+            parent_id = edge.parent_item_id
+            pending[parent_id] = pending.get(parent_id, 0) + 1
+            if parent_id not in seen:
+                seen.add(parent_id)
+                stack.append(parent_id)
+
+    qty_per = {item.id: Decimal("1")}
+    level = {item.id: 0}
+    queue = deque([item.id])
+    while queue:
+        node = queue.popleft()
+        for edge in usages(node):
+            parent_id = edge.parent_item_id
+            qty_per[parent_id] = qty_per.get(parent_id, Decimal("0")) + qty_per[node] * _edge_quantity(edge)
+            level[parent_id] = min(level.get(parent_id, level[node] + 1), level[node] + 1)
+            pending[parent_id] -= 1
+            if pending[parent_id] == 0:
+                queue.append(parent_id)
+
+    direct_edges = usages(item.id)
+    ancestor_ids = set(qty_per) - {item.id}
+    items = {}
+    if ancestor_ids:
+        items = {
+            i.id: i for i in db.query(models.MasterItem).filter(
+                models.MasterItem.id.in_(ancestor_ids)
+            ).all()
+        }
+
+    single_level = []
+    for edge in direct_edges:
+        parent = items.get(edge.parent_item_id)
+        if not parent:
+            continue
+        single_level.append({
+            "bom_id": edge.bom_id,
+            "parent_item_id": parent.id,
+            "parent_item_code": parent.item_code,
+            "parent_item_name": parent.item_name,
+            "revision": edge.revision,
+            "bom_type": edge.bom_type,
+            "bom_quantity": float(edge.quantity),
+            "percentage": float(edge.percentage) if edge.percentage else None,
+            "scrap_factor": float(edge.scrap_factor) if edge.scrap_factor else 0.0,
+            "quantity_per": float(_edge_quantity(edge)),
+            "is_optional": edge.is_optional,
+            "is_byproduct": edge.is_byproduct
+        })
+
+    multi_level = []
+    for ancestor_id in ancestor_ids:
+        ancestor = items.get(ancestor_id)
+        if not ancestor:
+            continue
+        multi_level.append({
+            "item_id": ancestor.id,
+            "item_code": ancestor.item_code,
+            "item_name": ancestor.item_name,
+            "level": level[ancestor_id],
+            "quantity_per": float(qty_per[ancestor_id]),
+            "is_end_item": not usages(ancestor_id)
+        })
+    multi_level.sort(key=lambda x: (x["level"], x["item_code"]))
+
+    return {
+        "item_id": item.id,
+        "item_code": item.item_code,
+        "item_name": item.item_name,
+        "single_level": single_level,
+        "multi_level": multi_level,
+        "end_items": [a for a in multi_level if a["is_end_item"]]
+    }
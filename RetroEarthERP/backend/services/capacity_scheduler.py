@@ -0,0 +1,393 @@
+"""
+Finite-Capacity Scheduler
+Schedules open work orders onto machine calendars (earliest due date first, forward or backward)
+"""
+import heapq
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Tuple
+import models
+from services import bom_graph
+
+
+DIRECTIONS = ("FORWARD", "BACKWARD")
+LOAD_BUCKETS = ("DAY", "WEEK")
+
+# Working weekdays of every machine (Monday = 0)
+WORKING_WEEKDAYS = frozenset(range(5))
+
+# Calendar days kept free after the latest due date for late orders
+HORIZON_SLACK_DAYS = 365
+
+# Hours below this count as no load
+HOUR_EPSILON = 1e-6
+
+OPEN_STATUSES = (models.JobStatus.PLANNED, models.JobStatus.IN_PROGRESS)
+
+
+# Step of an item's routing: parent units per hour on one machine
+Operation = namedtuple("Operation", ["sequence", "machine_id", "capacity_per_hour"])
+
+
+class SchedulingError(ValueError):
+    """Raised for invalid scheduling parameters"""
+
+
+def routing_of(graph: bom_graph.BOMGraph, item_id: int) -> List[Operation]:
+    """
+    Routing of an item from its active BOM lines.
+
+    Each machine on the item's BOM lines is one operation, in BOM sequence
+    order; when several lines use the same machine, the lowest capacity
+    (the bottleneck) applies. Lines without a machine or capacity are not
+    operations.
+    """
+    steps: Dict[int, Tuple[int, float]] = {}
+    for edge in graph.children.get(item_id, ()):
+        capacity = float(edge.capacity_per_hour or 0)
+        if not edge.machine_id or capacity <= 0:
+            continue
+        sequence = edge.sequence_order or 0
+        if edge.machine_id in steps:
+            known_sequence, known_capacity = steps[edge.machine_id]
+            sequence, capacity = min(sequence, known_sequence), min(capacity, known_capacity)
+        steps[edge.machine_id] = (sequence, capacity)
+    return sorted(Operation(sequence, machine_id, capacity) for machine_id, (sequence, capacity) in steps.items())
+
+
+class MachineCalendar:
+    """
+    Remaining hours per day of one machine.
+
+    Days without capacity left are skipped with path-compressed pointers
+    (one chain towards later days, one towards earlier days), so finding
+    the next free day is amortized O(1) however full the calendar gets.
+    """
+
+    def __init__(self, start: date, days: int, hours_per_day: float, blocked=()):
+        self.start = start
+        self.days = days
+        blocked = set(blocked)
+        self.free = [
+            hours_per_day if day.weekday() in WORKING_WEEKDAYS and day not in blocked else 0.0
+            for day in (start + timedelta(days=offset) for offset in range(days))
+        ]
+        # _later[d]: free day >= d (days = none); _earlier[d + 1]: free day <= d (0 = none)
+        self._later = [d if self.free[d] > 0 else d + 1 for d in range(days)] + [days]
+        self._earlier = [0] + [d + 1 if self.free[d] > 0 else d for d in range(days)]
+
+    @staticmethod
+    def _find(links: List[int], index: int) -> int:
+        root = index
+        while links[root] != root:
+            root = links[root]
+        while links[index] != root:
+            links[index], index = root, links[index]
+        return root
+
+    def next_free(self, day: int) -> int:
+        """First day >= day with capacity left (days if none)"""
+        return self._find(self._later, max(day, 0)) if day < self.days else self.days
+
+    def previous_free(self, day: int) -> int:
+        """Last day <= day with capacity left (-1 if none)"""
+        return self._find(self._earlier, min(day, self.days - 1) + 1) - 1 if day >= 0 else -1
+
+    def plan_forward(self, earliest: int, hours: float) -> Optional[List[Tuple[int, float]]]:
+        """Hours per day filling free capacity from a day onwards; None if the horizon runs out"""
+        slots = []
+        day = self.next_free(earliest)
+        while hours > HOUR_EPSILON:
+            if day >= self.days:
+                return None
+            taken = min(hours, self.free[day])
+            slots.append((day, taken))
+            hours -= taken
+            day = self.next_free(day + 1)
+        return slots
+
+    def plan_backward(self, latest: int, hours: float) -> Optional[List[Tuple[int, float]]]:
+        """Hours per day filling free capacity up to a day, latest first; None if it runs out"""
+        slots = []
+        day = self.previous_free(latest)
+        while hours > HOUR_EPSILON:
+            if day < 0:
+                return None
+            taken = min(hours, self.free[day])
+            slots.append((day, taken))
+            hours -= taken
+            day = self.previous_free(day - 1)
+        slots.reverse()
+        return slots
+
+    def book(self, slots: List[Tuple[int, float]]) -> None:
+        """Take the capacity of planned slots"""
+        for day, hours in slots:
+            self.free[day] -= hours
+            if self.free[day] <= HOUR_EPSILON:
+                self.free[day] = 0.0
+                self._later[day] = day + 1
+                self._earlier[day + 1] = day
+
+
+def _plan_order(
+    calendars: Dict[int, MachineCalendar],
+    routing: List[Operation],
+    quantity: float,
+    latest: Optional[int] = None
+) -> Optional[List[Tuple[Operation, List[Tuple[int, float]]]]]:
+    """
+    Slots of every operation of one order, without booking them.
+
+    Forward (latest None): operations in sequence from the first day, each
+    starting on the day the previous one ends. Backward: operations in
+    reverse sequence ending by the latest day. None if any operation does
+    not fit.
+    """
+    planned = []
+    if latest is None:
+        day = 0
+        for operation in routing:
+            slots = calendars[operation.machine_id].plan_forward(day, quantity / operation.capacity_per_hour)
+            if slots is None:
+                return None
+            planned.append((operation, slots))
+            if slots:
+                day = slots[-1][0]
+        return planned
+
+    day = latest
+    for operation in reversed(routing):
+        slots = calendars[operation.machine_id].plan_backward(day, quantity / operation.capacity_per_hour)
+        if slots is None:
+            return None
+        planned.append((operation, slots))
+        if slots:
+            day = slots[0][0]
+    planned.reverse()
+    return planned
+
+
+def machine_calendar(machine: models.MasterMachine, start: date, days: int) -> MachineCalendar:
+    """Empty calendar of a machine; inactive machines have no capacity, maintenance days are blocked"""
+    hours = 0.0
+    if machine.is_active and machine.status != models.MachineStatus.INACTIVE:
+        hours = float(machine.hours_per_day if machine.hours_per_day is not None else 8)
+    blocked = [machine.next_maintenance_date] if machine.next_maintenance_date else []
+    return MachineCalendar(start, days, hours, blocked)
+
+
+def schedule_work_orders(db: Session, direction: str = "FORWARD", start_date: Optional[date] = None) -> dict:
+    """
+    Schedule all open work orders onto machine capacity (the caller commits).
+
+    In-progress orders are loaded first, forward from the start date with
+    their remaining quantity, and keep their dates. Planned orders are then
+    dispatched from a heap by earliest due date: FORWARD starts each as soon
+    as capacity allows; BACKWARD loads the latest due date first and
+    finishes each as close to its due date as possible, falling back to
+    forward (late) when there is not enough capacity before it. Start/end
+    dates of planned orders are written back (the due date is kept, so
+    rescheduling does not drift) and the machine_load table is rebuilt.
+
+    Orders whose item has no routing (no machine with a capacity on its
+    BOM) are not capacity constrained and keep their dates.
+
+    Args:
+        db: Database session
+        direction: FORWARD or BACKWARD
+        start_date: First schedulable day (default: today)
+
+    Returns:
+        dict: Summary with scheduled, late and unscheduled orders
+
+    Raises:
+        SchedulingError: If the direction is unknown
+    """
+    if direction not in DIRECTIONS:
+        raise SchedulingError(f"Invalid direction. Must be one of: {list(DIRECTIONS)}")
+
+    start_date = start_date or date.today()
+    J = models.TrnJobOrderHead
+    orders = db.query(
+        J.id, J.job_no, J.item_id, J.qty_planned, J.qty_produced, J.start_date,
+        func.coalesce(J.due_date, J.end_date, J.start_date).label("due_date"), J.status
+    ).filter(J.status.in_(OPEN_STATUSES)).all()
+
+    graph = bom_graph.get_bom_graph(db)
+    routings: Dict[int, List[Operation]] = {}
+    for order in orders:
+        if order.item_id not in routings:
+            routings[order.item_id] = routing_of(graph, order.item_id)
+
+    latest_due = max((order.due_date for order in orders if routings[order.item_id]), default=start_date)
+    days = max((latest_due - start_date).days, 0) + HORIZON_SLACK_DAYS
+    machine_ids = {operation.machine_id for routing in routings.values() for operation in routing}
+    calendars = {
+        machine.id: machine_calendar(machine, start_date, days)
+        for machine in db.query(models.MasterMachine).filter(models.MasterMachine.id.in_(machine_ids)).all()
+    } if machine_ids else {}
+
+    # Operations on unknown machines are dropped
+    for item_id, routing in routings.items():
+        routings[item_id] = [operation for operation in routing if operation.machine_id in calendars]
+    routed = [order for order in orders if routings[order.item_id]]
+
+    loads = []
+    dates = []
+    late = []
+    unscheduled = []
+
+    def book(order, planned):
+        for operation, slots in planned:
+            calendars[operation.machine_id].book(slots)
+            for day, hours in slots:
+                loads.append({
+                    "machine_id": operation.machine_id,
+                    "job_id": order.id,
+                    "operation_seq": operation.sequence,
+                    "load_date": start_date + timedelta(days=day),
+                    "hours": Decimal(str(round(hours, 4)))
+                })
+        days_used = [day for _, slots in planned for day, _ in slots]
+        if not days_used:
+            return None
+        return start_date + timedelta(days=min(days_used)), start_date + timedelta(days=max(days_used))
+
+    # In-progress work holds its capacity first
+    in_progress = sorted(
+        (order for order in orders if order.status == models.JobStatus.IN_PROGRESS and routings[order.item_id]),
+        key=lambda order: (order.due_date, order.id)
+    )
+    for order in in_progress:
+        remaining = float(order.qty_planned or 0) - float(order.qty_produced or 0)
+        if remaining <= 0:
+            continue
+        planned = _plan_order(calendars, routings[order.item_id], remaining)
+        if planned is None:
+            unscheduled.append(order.job_no)
+        else:
+            book(order, planned)
+
+    # Planned orders by earliest due date (backward: latest due date first)
+    heap = []
+    for order in orders:
+        if order.status != models.JobStatus.PLANNED or not routings[order.item_id]:
+            continue
+        due = order.due_date.toordinal()
+        heapq.heappush(heap, (due, order.id, order) if direction == "FORWARD" else (-due, -order.id, order))
+
+    scheduled = 0
+    while heap:
+        order = heapq.heappop(heap)[2]
+        quantity = float(order.qty_planned or 0)
+        due = (order.due_date - start_date).days
+        planned = None
+        if direction == "BACKWARD" and due >= 0:
+            planned = _plan_order(calendars, routings[order.item_id], quantity, due)
+        if planned is None:
+            planned = _plan_order(calendars, routings[order.item_id], quantity)
+        if planned is None:
+            unscheduled.append(order.job_no)
+            continue
+
+        span = book(order, planned)
+        if span is None:
+            continue
+        scheduled += 1
+        dates.append({"id": order.id, "start_date": span[0], "end_date": span[1], "due_date": order.due_date})
+        if span[1] > order.due_date:
+            late.append(order.job_no)
+
+    if dates:
+        db.execute(update(models.TrnJobOrderHead), dates)
+    db.query(models.MachineLoad).delete(synchronize_session=False)
+    if loads:
+        db.execute(insert(models.MachineLoad), loads)
+
+    return {
+        "direction": direction,
+        "start_date": start_date,
+        "orders": len(orders),
+        "scheduled": scheduled,
+        "unrouted": len(orders) - len(routed),
+        "machines": len(calendars),
+        "late": late,
+        "unscheduled": unscheduled
+    }
+
+
+def machine_load_buckets(
+    db: Session,
+    date_from: date,
+    date_to: date,
+    bucket: str = "DAY",
+    machine_id: Optional[int] = None
+) -> List[dict]:
+    """
+    Scheduled load against capacity per machine and day/week.
+
+    Args:
+        db: Database session
+        date_from: First day (inclusive)
+        date_to: Last day (inclusive)
+        bucket: DAY or WEEK (weeks start on Monday)
+        machine_id: Only this machine
+
+    Returns:
+        list: Load, capacity and utilization per machine and bucket
+
+    Raises:
+        SchedulingError: If the bucket is unknown or the range is empty
+    """
+    if bucket not in LOAD_BUCKETS:
+        raise SchedulingError(f"Invalid bucket. Must be one of: {list(LOAD_BUCKETS)}")
+    if date_to < date_from:
+        raise SchedulingError("date_to must not be before date_from")
+
+    def bucket_start(day: date) -> date:
+        return day - timedelta(days=day.weekday()) if bucket == "WEEK" else day
+
+    L = models.MachineLoad
+    query = db.query(
+        L.machine_id, L.load_date, func.sum(L.hours)
+    ).join(
+        models.TrnJobOrderHead, models.TrnJobOrderHead.id == L.job_id
+    ).filter(
+        models.TrnJobOrderHead.status.in_(OPEN_STATUSES),
+        L.load_date >= date_from,
+        L.load_date <= date_to
+    )
+    machines = db.query(models.MasterMachine)
+    if machine_id is not None:
+        query = query.filter(L.machine_id == machine_id)
+        machines = machines.filter(models.MasterMachine.id == machine_id)
+
+    load: Dict[Tuple[int, date], float] = {}
+    for load_machine_id, load_date, hours in query.group_by(L.machine_id, L.load_date).all():
+        key = (load_machine_id, bucket_start(load_date))
+        load[key] = load.get(key, 0.0) + float(hours or 0)
+
+    span = (date_to - date_from).days + 1
+    result = []
+    for machine in machines.order_by(models.MasterMachine.machine_code).all():
+        calendar = machine_calendar(machine, date_from, span)
+        capacity: Dict[date, float] = {}
+        for offset, hours in enumerate(calendar.free):
+            key = bucket_start(date_from + timedelta(days=offset))
+            capacity[key] = capacity.get(key, 0.0) + hours
+
+        for start, capacity_hours in capacity.items():
+            hours = load.get((machine.id, start), 0.0)
+            result.append({
+                "machine_id": machine.id,
+                "machine_code": machine.machine_code,
+                "bucket_start": start,
+                "load_hours": round(hours, 4),
+                "capacity_hours": round(capacity_hours, 4),
+                "utilization": round(hours / capacity_hours, 4) if capacity_hours else None
+            })
+    return result
@@ -0,0 +1,136 @@
+"""
+Standard Cost Roll-up Service
+Multi-level material cost roll-up in low-level-code order over the Gozinto matrix
+"""
+from sqlalchemy.orm import Session
+from decimal import Decimal
+from typing import List
+import numpy as np
+import models
+from services import bom_gozinto
+
+
+def _to_decimal(value: float) -> Decimal:
+    """Round a float cost to the precision of the cost columns"""
+    return Decimal(str(round(float(value), 4)))
+
+
+def compute_cost_rollup(db: Session) -> dict:
+    """
+    Roll up material cost for every manufactured item.
+
+    Purchased items (no active BOM lines) contribute their standard cost.
+    Parents are processed from the deepest low-level code upwards, so the
+    cost of every child is final before it is added to its parents:
+    cost(parent) = sum(cost(child) * quantity * (1 + scrap)).
+    Each level is one vectorized scatter-add over the BOM edges.
+
+    Args:
+        db: Database session
+
+    Returns:
+        dict: BOM version and one estimate per manufactured item
+
+    Raises:
+        BOMCycleError: If the active BOM structure is circular
+    """
+    matrix = bom_gozinto.get_gozinto_matrix(db)
+
+    items = {
+        row.id: row for row in db.query(
+            models.MasterItem.id,
+            models.MasterItem.item_code,
+            models.MasterItem.item_name,
+            models.MasterItem.standard_cost
+        ).all()
+    }
+
+    size = len(matrix.item_ids)
+    standard = np.fromiter(
+        (
+            float(items[int(item_id)].standard_cost or 0) if int(item_id) in items else 0.0
+            for item_id in matrix.item_ids
+        ),
+        dtype=np.float64, count=size
+    )
+
+    is_manufactured = np.zeros(size, dtype=bool)
+    is_manufactured[matrix.parent_idx] = True
+
+    cost = np.where(is_manufactured, 0.0, standard)
+    coefficient = matrix.bom_qty * (1.0 + matrix.scrap_rate)
+    for start, end in reversed(matrix.level_bounds):
+        children = matrix.child_idx[start:end]
+        np.add.at(cost, matrix.parent_idx[start:end], cost[children] * coefficient[start:end])
+
+    estimates = []
+    for i in np.flatnonzero(is_manufactured).tolist():
+        item = items.get(int(matrix.item_ids[i]))
+        if not item:
+            continue
+        current = _to_decimal(standard[i])
+        estimated = _to_decimal(cost[i])
+        estimates.append({
+            "item_id": item.id,
+            "item_code": item.item_code,
+            "item_name": item.item_name,
+            "low_level_code": int(matrix.low_level_codes[i]),
+            "current_standard_cost": current,
+            "estimated_cost": estimated,
+            "cost_difference": estimated - current
+        })
+
+    estimates.sort(key=lambda e: (e["low_level_code"], e["item_code"]))
+    return {"bom_version": matrix.version, "estimates": estimates}
+
+
+def save_cost_rollup(
+    db: Session,
+    rollup: dict,
+    user_id: int,
+    update_standard_costs: bool = False
+) -> models.CostRollupRun:
+    """
+    Persist a computed roll-up as cost estimates (and optionally release it).
+
+    Args:
+        db: Database session
+        rollup: Result of compute_cost_rollup
+        user_id: User running the roll-up
+        update_standard_costs: Whether to copy estimated costs into MasterItem.standard_cost
+
+    Returns:
+        CostRollupRun: The saved run
+    """
+    estimates: List[dict] = rollup["estimates"]
+
+    run = models.CostRollupRun(
+        bom_version=rollup["bom_version"],
+        item_count=len(estimates),
+        standards_updated=update_standard_costs,
+        created_by=user_id
+    )
+    db.add(run)
+    db.flush()
+
+    db.bulk_insert_mappings(models.CostEstimate, [
+        {
+            "run_id": run.id,
+            "item_id": e["item_id"],
+            "low_level_code": e["low_level_code"],
+            "current_standard_cost": e["current_standard_cost"],
+            "estimated_cost": e["estimated_cost"],
+            "cost_difference": e["cost_difference"]
+        }
+        for e in estimates
+    ])
+
+    if update_standard_costs:
+        db.bulk_update_mappings(models.MasterItem, [
+            {"id": e["item_id"], "standard_cost": e["estimated_cost"]}
+            for e in estimates if e["cost_difference"] != 0
+        ])
+
+    db.commit()
+    db.refresh(run)
+    return run
@@ -0,0 +1,290 @@
+"""
+Demand Forecasting
+Exponential smoothing and Croston forecasts fitted for all items at once on delivery and issue history
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+from sqlalchemy import Date, func, insert, or_, select, union_all
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import models
+from services import bom_graph
+from services.mrp_engine import to_quantity
+
+
+METHODS = ("AUTO", "SES", "CROSTON")
+
+# Average demand interval (periods) above which demand is intermittent (Syntetos-Boylan cut-off)
+INTERMITTENT_ADI = 1.32
+
+# Smoothing constants tried for every item; the lowest one-step-ahead MSE wins
+ALPHAS = (0.05, 0.1, 0.2, 0.3, 0.5)
+
+# Forecasts below this (per period) are not written as plan items
+MIN_FORECAST_QTY = 0.0001
+
+
+# Fitted forecast; arrays are per item
+Forecast = namedtuple("Forecast", [
+    "item_ids",    # np.ndarray: item IDs with history
+    "croston",     # np.ndarray[bool]: Croston (else simple exponential smoothing)
+    "alpha",       # np.ndarray: chosen smoothing constant
+    "per_period",  # np.ndarray: forecast demand per future period
+])
+
+
+class ForecastError(ValueError):
+    """Raised for invalid forecast parameters or plans"""
+
+
+def load_demand_history(db: Session, start: date, end: date) -> List[Tuple[int, date, float]]:
+    """
+    Demand history of all items with one aggregated query.
+
+    Demand is posted delivery order lines plus stock issues; issues whose
+    reference is a delivery order number are skipped so a delivery booked
+    both ways counts once.
+
+    Args:
+        db: Database session
+        start: First day of history (inclusive)
+        end: Last day of history (exclusive)
+
+    Returns:
+        list: (item_id, day, qty) per item and day
+    """
+    DOH = models.TrnDeliveryOrderHead
+    DOD = models.TrnDeliveryOrderDetail
+    IT = models.InventoryTransaction
+
+    deliveries = select(
+        DOD.item_id.label("item_id"),
+        DOH.do_date.label("day"),
+        DOD.qty_delivered.label("qty")
+    ).join(
+        DOH, DOH.id == DOD.do_id
+    ).where(
+        DOH.status == models.DocumentStatus.POSTED,
+        DOH.do_date >= start,
+        DOH.do_date < end
+    )
+
+    issue_day = func.date(IT.transaction_date, type_=Date)
+    issues = select(
+        IT.item_id,
+        issue_day,
+        IT.qty
+    ).where(
+        IT.transaction_type == 'issue',
+        IT.transaction_date >= start,
+        IT.transaction_date < end,
+        or_(IT.reference_no.is_(None), IT.reference_no.notin_(select(DOH.do_no)))
+    )
+
+    demand = union_all(deliveries, issues).subquery()
+    rows = db.execute(
+        select(demand.c.item_id, demand.c.day, func.sum(demand.c.qty)).group_by(demand.c.item_id, demand.c.day)
+    ).all()
+    return [(item_id, day, float(qty)) for item_id, day, qty in rows if qty and qty > 0]
+
+
+def history_matrix(
+    rows: Iterable[Tuple[int, date, float]],
+    start: date,
+    period_days: int,
+    periods: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Spread daily demand into an (items x periods) array.
+
+    Returns:
+        tuple: (item IDs, history array)
+    """
+    rows = list(rows)
+    item_ids = np.array(sorted({item_id for item_id, _, _ in rows}), dtype=np.int64)
+    index = {item_id: row for row, item_id in enumerate(item_ids.tolist())}
+
+    history = np.zeros((len(item_ids), periods), dtype=np.float64)
+    if rows:
+        item_rows = np.fromiter((index[item_id] for item_id, _, _ in rows), dtype=np.int64, count=len(rows))
+        days = np.fromiter(((day - start).days for _, day, _ in rows), dtype=np.int64, count=len(rows))
+        quantities = np.fromiter((qty for _, _, qty in rows), dtype=np.float64, count=len(rows))
+        np.add.at(history, (item_rows, np.clip(days // period_days, 0, periods - 1)), quantities)
+    return item_ids, history
+
+
+def _ses(history: np.ndarray, alpha: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Simple exponential smoothing of every row: (next-period forecast, one-step MSE)"""
+    periods = history.shape[1]
+    level = history[:, :min(periods, 4)].mean(axis=1)
+    squared = np.zeros(len(history))
+    for t in range(periods):
+        error = history[:, t] - level
+        squared += error * error
+        level = level + alpha * error
+    return level, squared / periods
+
+
+def _croston(history: np.ndarray, alpha: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Croston's method (SBA bias correction) of every row: (per-period forecast, one-step MSE)"""
+    periods = history.shape[1]
+    demand = history > 0
+    count = np.maximum(demand.sum(axis=1), 1)
+
+    # Start from the average demand size and interval of the history
+    size = history.sum(axis=1) / count
+    interval = periods / count
+    since_last = np.ones(len(history))
+    correction = 1.0 - alpha / 2.0
+
+    squared = np.zeros(len(history))
+    for t in range(periods):
+        forecast = correction * size / interval
+        error = history[:, t] - forecast
+        squared += error * error
+
+        hit = demand[:, t]
+        size = np.where(hit, size + alpha * (history[:, t] - size), size)
+        interval = np.where(hit, interval + alpha * (since_last - interval), interval)
+        since_last = np.where(hit, 1.0, since_last + 1.0)
+
+    return correction * size / interval, squared / periods
+
+
+def _best_fit(history: np.ndarray, model) -> Tuple[np.ndarray, np.ndarray]:
+    """Fit a model with every smoothing constant and keep, per row, the one with the lowest MSE"""
+    best_forecast = np.zeros(len(history))
+    best_alpha = np.zeros(len(history))
+    best_error = np.full(len(history), np.inf)
+    for alpha in ALPHAS:
+        forecast, error = model(history, alpha)
+        better = error < best_error
+        best_forecast = np.where(better, forecast, best_forecast)
+        best_alpha = np.where(better, alpha, best_alpha)
+        best_error = np.where(better, error, best_error)
+    return best_forecast, best_alpha
+
+
+def fit_forecast(item_ids: np.ndarray, history: np.ndarray, method: str = "AUTO") -> Forecast:
+    """
+    Fit a forecast for every item, vectorized across items.
+
+    AUTO uses Croston for intermittent items (average interval between
+    non-zero periods above INTERMITTENT_ADI) and simple exponential
+    smoothing for the rest.
+
+    Args:
+        item_ids: Item ID per history row
+        history: Demand per item and period, oldest first
+        method: AUTO, SES or CROSTON
+
+    Returns:
+        Forecast: Method, smoothing constant and per-period forecast by item
+
+    Raises:
+        ForecastError: If the method is unknown
+    """
+    if method not in METHODS:
+        raise ForecastError(f"Invalid method. Must be one of: {list(METHODS)}")
+
+    periods = history.shape[1]
+    nonzero = (history > 0).sum(axis=1)
+    if method == "AUTO":
+        croston = periods / np.maximum(nonzero, 1) > INTERMITTENT_ADI
+    else:
+        croston = np.full(len(item_ids), method == "CROSTON")
+
+    per_period = np.zeros(len(item_ids))
+    alpha = np.zeros(len(item_ids))
+    for use_croston, model in ((False, _ses), (True, _croston)):
+        rows = np.flatnonzero(croston == use_croston)
+        if len(rows):
+            per_period[rows], alpha[rows] = _best_fit(history[rows], model)
+
+    return Forecast(item_ids, croston, alpha, np.maximum(per_period, 0.0))
+
+
+def independent_items(db: Session, item_ids: np.ndarray) -> np.ndarray:
+    """Mask of items that are not components of an active BOM (their demand comes from MRP explosion)"""
+    parents: Dict[int, list] = bom_graph.get_bom_graph(db).parents
+    return np.fromiter((int(item_id) not in parents for item_id in item_ids), dtype=bool, count=len(item_ids))
+
+
+def generate_forecast_items(
+    db: Session,
+    plan: models.ProductionPlan,
+    period_days: int = 7,
+    history_periods: int = 52,
+    horizon_periods: int = 12,
+    method: str = "AUTO",
+    start_date: Optional[date] = None
+) -> dict:
+    """
+    Replace the items of a FORECAST plan with a statistical forecast (the caller commits).
+
+    Every item with demand history that is not itself a BOM component gets
+    one plan item per future period.
+
+    Args:
+        db: Database session
+        plan: DRAFT plan with source_type FORECAST
+        period_days: Length of a forecast period in days
+        history_periods: Periods of history to fit on
+        horizon_periods: Future periods to forecast
+        method: AUTO, SES or CROSTON
+        start_date: First forecast day (default: today)
+
+    Returns:
+        dict: Summary of the forecast run
+
+    Raises:
+        ForecastError: If the plan or parameters are invalid
+    """
+    if plan.source_type != 'FORECAST':
+        raise ForecastError("Only FORECAST plans can be forecast")
+    if plan.status != 'DRAFT':
+        raise ForecastError("Cannot forecast a calculated/processed plan")
+    if period_days < 1 or history_periods < 2 or horizon_periods < 1:
+        raise ForecastError("period_days and horizon_periods must be at least 1, history_periods at least 2")
+
+    start_date = start_date or date.today()
+    history_start = start_date - timedelta(days=period_days * history_periods)
+
+    rows = load_demand_history(db, history_start, start_date)
+    item_ids, history = history_matrix(rows, history_start, period_days, history_periods)
+    keep = independent_items(db, item_ids)
+    forecast = fit_forecast(item_ids[keep], history[keep], method)
+
+    writes = forecast.per_period >= MIN_FORECAST_QTY
+    plan_items = []
+    for item_id, quantity in zip(forecast.item_ids[writes].tolist(), forecast.per_period[writes].tolist()):
+        quantity = to_quantity(quantity)
+        for period in range(horizon_periods):
+            plan_items.append({
+                "plan_id": plan.id,
+                "item_id": item_id,
+                "quantity": quantity,
+                "delivery_date": start_date + timedelta(days=period * period_days)
+            })
+
+    db.query(models.ProductionPlanItem).filter(
+        models.ProductionPlanItem.plan_id == plan.id
+    ).delete(synchronize_session=False)
+    if plan_items:
+        db.execute(insert(models.ProductionPlanItem), plan_items)
+    db.expire(plan, ["items"])
+
+    croston_count = int(forecast.croston[writes].sum())
+    return {
+        "plan_id": plan.id,
+        "history_start": history_start,
+        "start_date": start_date,
+        "period_days": period_days,
+        "horizon_periods": horizon_periods,
+        "items_with_history": len(item_ids),
+        "items_forecast": int(writes.sum()),
+        "ses_items": int(writes.sum()) - croston_count,
+        "croston_items": croston_count,
+        "plan_items_created": len(plan_items)
+    }
@@ -8,6 +8,7 @@ from decimal import Decimal
 from datetime import date
 from typing import List, Dict, Optional
 import models
+from services.document_numbers import allocate
 from services.gl_determination import get_gl_account
 from services.thai_tax import calculate_vat, get_default_vat_group
 
@@ -25,16 +26,14 @@ def generate_journal_number(db: Session) -> str:
     today = date.today()
     prefix = f"JV-{today.year}-{str(today.month).zfill(2)}"
     
-    last_je = db.query(models.TrnJournalEntryHead).filter(
-        models.TrnJournalEntryHead.journal_no.like(f"{prefix}-%")
-    ).order_by(models.TrnJournalEntryHead.id.desc()).first()
-    
-    if last_je:
-        last_number = int(last_je.journal_no.split('-')[-1])
-        new_number = last_number + 1
-    else:
-        new_number = 1
+    def last_used() -> int:
+        # Month series first used after journals were numbered by scanning: continue from the last one
+        last_je = db.query(models.TrnJournalEntryHead).filter(
+            models.TrnJournalEntryHead.journal_no.like(f"{prefix}-%")
+        ).order_by(models.TrnJournalEntryHead.id.desc()).first()
+        return int(last_je.journal_no.split('-')[-1]) if last_je else 0
     
+    new_number = allocate(db, prefix, seed=last_used)
     return f"{prefix}-{str(new_number).zfill(4)}"
 
 
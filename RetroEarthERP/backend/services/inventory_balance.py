@@ -0,0 +1,300 @@
+"""
+Inventory Balance Updates
+Atomic, row-locked balance deltas keyed by item, warehouse, location and lot
+"""
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import and_, bindparam, case, delete, func, literal_column, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+import models
+
+
+# INSERT ... ON CONFLICT DO UPDATE of the supported databases
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+BALANCE_KEY_INDEX = "uq_inventory_balance_key"
+
+# Whether an index exists (expression indexes are not reflected by the SQLite inspector)
+INDEX_EXISTS_SQL = {
+    "postgresql": "SELECT 1 FROM pg_indexes WHERE indexname = :name",
+    "sqlite": "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name",
+}
+
+# Transaction-scoped lock serializing the one-time migration across workers (Postgres)
+BALANCE_KEY_LOCK_ID = 7301
+
+
+class InsufficientStockError(ValueError):
+    """Raised when an issue exceeds the quantity on hand"""
+
+    def __init__(self, available: Decimal, requested: Decimal):
+        super().__init__(f"Insufficient inventory. Available: {available}, Requested: {requested}")
+        self.available = available
+        self.requested = requested
+
+
+def _key_filter(item_id: int, warehouse_id: int, location_id: Optional[int], lot_number: Optional[str]):
+    """Filter on the balance key (NULL location / lot match NULL)"""
+    B = models.InventoryBalance
+    return (
+        B.item_id == item_id,
+        B.warehouse_id == warehouse_id,
+        B.location_id.is_(None) if location_id is None else B.location_id == location_id,
+        B.lot_number.is_(None) if lot_number is None else B.lot_number == lot_number,
+    )
+
+
+# Balance key: (item_id, warehouse_id, location_id, lot_number)
+BalanceKey = Tuple[int, int, Optional[int], Optional[str]]
+
+
+def _sort_key(key: BalanceKey) -> tuple:
+    """Key order in which batches lock balance rows (the same order everywhere avoids deadlocks)"""
+    item_id, warehouse_id, location_id, lot_number = key
+    return item_id, warehouse_id, location_id or 0, lot_number or ""
+
+
+def _receipt_upsert(db: Session):
+    """
+    INSERT ... ON CONFLICT DO UPDATE adding the inserted quantity to the balance of its key.
+
+    The inserted avg_cost is the unit cost of the receipt; on conflict the
+    moving average is recomputed in SQL from the row as locked by the statement.
+    """
+    B = models.InventoryBalance
+    statement = UPSERT_INSERTS[db.get_bind().dialect.name](B)
+    received = statement.excluded
+    new_qty = B.qty_on_hand + received.qty_on_hand
+    return statement.on_conflict_do_update(
+        index_elements=[
+            B.item_id,
+            B.warehouse_id,
+            func.coalesce(B.location_id, literal_column("0")),
+            func.coalesce(B.lot_number, literal_column("''"))
+        ],
+        set_={
+            "qty_on_hand": new_qty,
+            "avg_cost": case(
+                (new_qty > 0, (B.qty_on_hand * B.avg_cost + received.qty_on_hand * received.avg_cost) / new_qty),
+                else_=Decimal(0)
+            ),
+            "last_updated": func.now()
+        }
+    )
+
+
+def receive_stock(
+    db: Session,
+    item_id: int,
+    warehouse_id: int,
+    location_id: Optional[int],
+    lot_number: Optional[str],
+    qty: Decimal,
+    unit_cost: Decimal
+) -> Tuple[Decimal, Decimal]:
+    """
+    Add received stock to a balance, creating the balance if needed (the caller commits).
+
+    One INSERT ... ON CONFLICT DO UPDATE on the unique balance key: the
+    quantity and moving average cost are computed in SQL from the row as
+    locked by the statement, so concurrent receipts neither lose an update
+    nor create a second row for the same key.
+
+    Args:
+        db: Database session
+        item_id: Item received
+        warehouse_id: Receiving warehouse
+        location_id: Receiving location, or None
+        lot_number: Lot, or None
+        qty: Quantity received
+        unit_cost: Cost per unit of the receipt
+
+    Returns:
+        tuple: (qty_on_hand, avg_cost) after the receipt
+    """
+    B = models.InventoryBalance
+    return tuple(db.execute(
+        _receipt_upsert(db).returning(B.qty_on_hand, B.avg_cost),
+        {
+            "item_id": item_id,
+            "warehouse_id": warehouse_id,
+            "location_id": location_id,
+            "lot_number": lot_number,
+            "qty_on_hand": qty,
+            "avg_cost": unit_cost if qty > 0 else Decimal(0)
+        }
+    ).one())
+
+
+def receive_stock_batch(db: Session, receipts: Iterable[Tuple[BalanceKey, Decimal, Decimal]]) -> None:
+    """
+    Add many receipts to their balances with one executemany upsert (the caller commits).
+
+    Receipts of the same key are combined first (quantity summed, cost
+    quantity-weighted), which gives the same balance as adding them one by one.
+
+    Args:
+        db: Database session
+        receipts: (balance key, qty, unit cost) per receipt line
+    """
+    totals: Dict[BalanceKey, list] = {}
+    for key, qty, unit_cost in receipts:
+        total = totals.setdefault(key, [Decimal(0), Decimal(0)])
+        total[0] += qty
+        total[1] += qty * unit_cost
+    if not totals:
+        return
+
+    # render_nulls keeps keys without location / lot in the same executemany batch
+    db.execute(_receipt_upsert(db).execution_options(render_nulls=True), [
+        {
+            "item_id": item_id,
+            "warehouse_id": warehouse_id,
+            "location_id": location_id,
+            "lot_number": lot_number,
+            "qty_on_hand": qty,
+            "avg_cost": cost / qty if qty > 0 else Decimal(0)
+        }
+        for (item_id, warehouse_id, location_id, lot_number), (qty, cost) in sorted(
+            totals.items(), key=lambda entry: _sort_key(entry[0])
+        )
+    ])
+
+
+def issue_stock(
+    db: Session,
+    item_id: int,
+    warehouse_id: int,
+    location_id: Optional[int],
+    lot_number: Optional[str],
+    qty: Decimal
+) -> Decimal:
+    """
+    Take issued stock off a balance (the caller commits).
+
+    The availability check and the decrement are one conditional UPDATE,
+    so two concurrent issues cannot both pass the check on the same stock.
+
+    Args:
+        db: Database session
+        item_id: Item issued
+        warehouse_id: Issuing warehouse
+        location_id: Issuing location, or None
+        lot_number: Lot, or None
+        qty: Quantity issued
+
+    Returns:
+        Decimal: qty_on_hand after the issue
+
+    Raises:
+        InsufficientStockError: If the balance is missing or holds less than qty
+    """
+    B = models.InventoryBalance
+    key = _key_filter(item_id, warehouse_id, location_id, lot_number)
+    remaining = db.execute(
+        update(B).where(*key, B.qty_on_hand >= qty).values(
+            qty_on_hand=B.qty_on_hand - qty,
+            last_updated=func.now()
+        ).returning(B.qty_on_hand)
+    ).scalar()
+    if remaining is None:
+        available = db.query(B.qty_on_hand).filter(*key).scalar()
+        raise InsufficientStockError(available or Decimal(0), qty)
+    return remaining
+
+
+def issue_stock_batch(db: Session, issues: Iterable[Tuple[BalanceKey, Decimal]]) -> None:
+    """
+    Take many issues off their balances (the caller commits).
+
+    Issues of the same key are combined, then every key gets one
+    conditional delta UPDATE (see issue_stock), in the same key order as
+    receipts so concurrent batches lock rows in the same order. If a key is
+    short the error leaves the session to be rolled back, so the batch
+    issues everything or nothing.
+
+    Args:
+        db: Database session
+        issues: (balance key, qty) per issue line
+
+    Raises:
+        InsufficientStockError: If a balance is missing or holds less than its issues
+    """
+    totals: Dict[BalanceKey, Decimal] = {}
+    for key, qty in issues:
+        totals[key] = totals.get(key, Decimal(0)) + qty
+
+    for key in sorted(totals, key=_sort_key):
+        issue_stock(db, *key, totals[key])
+
+
+def ensure_balance_key(engine: Engine) -> int:
+    """
+    Create the unique balance key on a database created before it, merging duplicate rows first.
+
+    create_all does not add indexes to existing tables, and without the key
+    every receipt upsert fails. Rows sharing a key (possible before the key
+    existed) are merged into the oldest one: quantities summed, avg_cost
+    weighted by quantity. Runs once at startup in one transaction; on
+    Postgres an advisory lock keeps concurrent workers from both migrating.
+    Does nothing once the index exists.
+
+    Args:
+        engine: Database engine
+
+    Returns:
+        int: Number of duplicate rows merged away
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as connection:
+        if dialect == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": BALANCE_KEY_LOCK_ID})
+        if connection.execute(text(INDEX_EXISTS_SQL[dialect]), {"name": BALANCE_KEY_INDEX}).first():
+            return 0
+
+        B = models.InventoryBalance.__table__
+        key = (
+            B.c.item_id,
+            B.c.warehouse_id,
+            func.coalesce(B.c.location_id, 0).label("location_key"),
+            func.coalesce(B.c.lot_number, "").label("lot_key")
+        )
+        duplicates = select(*key).group_by(*key).having(func.count() > 1).subquery()
+        rows = connection.execute(
+            select(B.c.id, *key, B.c.qty_on_hand, B.c.avg_cost).join(duplicates, and_(
+                B.c.item_id == duplicates.c.item_id,
+                B.c.warehouse_id == duplicates.c.warehouse_id,
+                func.coalesce(B.c.location_id, 0) == duplicates.c.location_key,
+                func.coalesce(B.c.lot_number, "") == duplicates.c.lot_key
+            )).order_by(B.c.id)
+        ).all()
+
+        groups: Dict[tuple, list] = {}
+        for row in rows:
+            groups.setdefault((row.item_id, row.warehouse_id, row.location_key, row.lot_key), []).append(row)
+
+        merged, removed = [], []
+        for group in groups.values():
+            qty = sum((row.qty_on_hand or Decimal(0) for row in group), Decimal(0))
+            cost = sum(((row.qty_on_hand or Decimal(0)) * (row.avg_cost or Decimal(0)) for row in group), Decimal(0))
+            merged.append({"balance_id": group[0].id, "qty": qty, "cost": cost / qty if qty > 0 else Decimal(0)})
+            removed.extend(row.id for row in group[1:])
+
+        if merged:
+            connection.execute(
+                update(B).where(B.c.id == bindparam("balance_id")).values(
+                    qty_on_hand=bindparam("qty"), avg_cost=bindparam("cost")
+                ),
+                merged
+            )
+            connection.execute(delete(B).where(B.c.id.in_(removed)))
+
+        index = next(index for index in B.indexes if index.name == BALANCE_KEY_INDEX)
+        connection.execute(CreateIndex(index, if_not_exists=True))
+        return len(removed)
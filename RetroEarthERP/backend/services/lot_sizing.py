@@ -0,0 +1,148 @@
+"""
+MRP Lot Sizing
+Per-item order quantity policies applied as array operations over a whole MRP level
+"""
+from collections import namedtuple
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+
+# Policy codes used in the engine arrays
+L4L = 0      # Lot-for-lot: exactly the net requirement
+FOQ = 1      # Fixed order quantity: whole multiples of a fixed lot
+EOQ = 2      # Economic order quantity: whole multiples of sqrt(2DS/H)
+POQ = 3      # Period order quantity: cover the net requirements of the next P buckets
+MIN_MAX = 4  # Below the minimum, order up to the maximum
+
+POLICIES = {"L4L": L4L, "FOQ": FOQ, "EOQ": EOQ, "POQ": POQ, "MIN_MAX": MIN_MAX}
+
+# Tolerance when dividing a requirement into lots (avoids an extra lot from float noise)
+LOT_EPSILON = 1e-9
+
+
+# Lot-sizing rule of one item; quantities in stock units
+LotSizingRule = namedtuple("LotSizingRule", [
+    "policy",         # policy code
+    "quantity",       # FOQ lot size
+    "periods",        # POQ buckets per order (0 = derive from EOQ)
+    "minimum",        # MIN_MAX reorder level
+    "maximum",        # MIN_MAX order-up-to level
+    "safety_stock",   # projected balance kept in stock by every policy
+    "ordering_cost",  # EOQ/POQ cost per order
+    "holding_cost",   # EOQ/POQ cost per unit and year
+])
+
+
+def build_rule(item, settings=None) -> Optional[LotSizingRule]:
+    """
+    Lot-sizing rule of an item.
+
+    Without explicit settings the item master decides: a reorder quantity
+    means fixed order quantity, otherwise lot-for-lot. Safety stock always
+    comes from the item master.
+
+    Args:
+        item: Item planning data (lead_time_days, safety_stock, reorder_point,
+              reorder_quantity, standard_cost)
+        settings: ItemLotSizing row of the item, if any
+
+    Returns:
+        LotSizingRule: The rule, or None for plain lot-for-lot without safety stock
+    """
+    safety_stock = float(item.safety_stock or 0)
+    reorder_point = float(item.reorder_point or 0)
+    reorder_quantity = float(item.reorder_quantity or 0)
+
+    if settings is None:
+        if reorder_quantity > 0:
+            return LotSizingRule(FOQ, reorder_quantity, 0, 0.0, 0.0, safety_stock, 0.0, 0.0)
+        if safety_stock > 0:
+            return LotSizingRule(L4L, 0.0, 0, 0.0, 0.0, safety_stock, 0.0, 0.0)
+        return None
+
+    minimum = float(settings.min_qty) if settings.min_qty is not None else reorder_point
+    maximum = float(settings.max_qty) if settings.max_qty is not None else reorder_point + reorder_quantity
+    return LotSizingRule(
+        POLICIES[settings.policy],
+        float(settings.order_quantity) if settings.order_quantity is not None else reorder_quantity,
+        int(settings.periods or 0),
+        minimum,
+        maximum,
+        safety_stock,
+        float(settings.ordering_cost or 0),
+        float(item.standard_cost or 0) * float(settings.holding_cost_rate or 0) / 100.0
+    )
+
+
+class LotSizer:
+    """
+    Lot sizing for the rows of one MRP level.
+
+    Built once per level from the final gross requirements of its items, so
+    EOQ (annualized demand over the horizon) and POQ (net requirements of
+    the following buckets) are known before netting starts.
+    """
+
+    def __init__(self, rules: Dict[int, LotSizingRule], item_ids: np.ndarray,
+                 gross: np.ndarray, scheduled: np.ndarray, horizon_days: int):
+        size, buckets = gross.shape
+        policy = np.zeros(size, dtype=np.int64)
+        values = np.zeros((7, size), dtype=np.float64)
+        for row, item_id in enumerate(item_ids.tolist()):
+            rule = rules.get(item_id)
+            if rule is not None:
+                policy[row] = rule.policy
+                values[:, row] = rule[1:]
+        quantity, periods, minimum, maximum, safety_stock, ordering_cost, holding_cost = values
+
+        annual_demand = gross.sum(axis=1) * 365.0 / max(horizon_days, 1)
+        eoq = np.sqrt(np.divide(
+            2.0 * annual_demand * ordering_cost, holding_cost,
+            out=np.zeros(size), where=holding_cost > 0
+        ))
+
+        self.safety_stock = safety_stock
+        self.lot_size = np.where(policy == FOQ, quantity, np.where(policy == EOQ, eoq, 0.0))
+
+        self.poq = policy == POQ
+        if self.poq.any():
+            per_bucket = gross.sum(axis=1) / buckets
+            derived = np.rint(np.divide(eoq, per_bucket, out=np.ones(size), where=per_bucket > 0))
+            self.periods = np.maximum(np.where(periods > 0, periods, derived), 1).astype(np.int64)
+            self.cumulative = np.cumsum(gross - scheduled, axis=1)
+            self.rows = np.arange(size)
+            self.last = buckets - 1
+
+        self.min_max = policy == MIN_MAX
+        self.minimum = np.maximum(minimum, safety_stock)
+        self.maximum = np.maximum(maximum, self.minimum)
+
+    def order(self, t: int, available: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Planned order receipts of bucket t.
+
+        Args:
+            t: Bucket index
+            available: Projected balance after gross requirements and receipts
+
+        Returns:
+            tuple: (net requirement up to safety stock, lot-sized planned quantity)
+        """
+        net = np.maximum(self.safety_stock - available, 0.0)
+        planned = net
+
+        lots = self.lot_size > 0
+        if lots.any():
+            count = np.ceil(np.divide(net, self.lot_size, out=np.zeros_like(net), where=lots) - LOT_EPSILON)
+            planned = np.where(lots, np.maximum(count, 0.0) * self.lot_size, planned)
+
+        if self.poq.any():
+            end = np.minimum(t + self.periods - 1, self.last)
+            ahead = self.cumulative[self.rows, end] - self.cumulative[:, t]
+            planned = np.where(self.poq & (net > 0), net + np.maximum(ahead, 0.0), planned)
+
+        if self.min_max.any():
+            refill = self.min_max & (available < self.minimum)
+            planned = np.where(refill, self.maximum - available, planned)
+
+        return net, planned
@@ -0,0 +1,223 @@
+"""
+Low-Level Code (LLC) Service
+Lowest BOM level of every item, computed by topological sort over active BOMs.
+Also guards BOM writes against circular references.
+"""
+from collections import deque
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, Set, Tuple
+import models
+from services.bom_graph import BOMGraph, load_bom_graph, lock_bom_structure
+
+
+class BOMCycleError(ValueError):
+    """Raised when a BOM structure contains (or would contain) a circular reference"""
+
+
+def compute_low_level_codes(graph: BOMGraph) -> Tuple[Dict[int, int], Set[int]]:
+    """
+    Compute low-level codes for every item in the graph (Kahn's algorithm).
+
+    Args:
+        graph: BOM graph snapshot
+
+    Returns:
+        tuple: (low-level code by item ID, IDs of items caught in a cycle)
+    """
+    indegree = {child_id: len(edges) for child_id, edges in graph.parents.items()}
+    llc = {parent_id: 0 for parent_id in graph.children if parent_id not in indegree}
+    queue = deque(llc.keys())
+
+    while queue:
+        node = queue.popleft()
+        for edge in graph.children.get(node, ()):
+            child_id = edge.child_item_id
+            llc[child_id] = max(llc.get(child_id, 0), llc[node] + 1)
+            indegree[child_id] -= 1
+            if indegree[child_id] == 0:
+                queue.append(child_id)
+
+    cycle_items = {item_id for item_id, remaining in indegree.items() if remaining > 0}
+    return llc, cycle_items
+
+
+def ensure_acyclic(graph: BOMGraph, parent_item_id: int, child_item_ids: Iterable[int]) -> None:
+    """
+    Check that making child_item_ids active components of parent_item_id
+    does not close a loop in the active BOM structure.
+
+    Args:
+        graph: BOM graph snapshot (before the write)
+        parent_item_id: Parent item receiving the components
+        child_item_ids: Components being added or activated
+
+    Raises:
+        BOMCycleError: If a child is the parent itself or already uses it
+    """
+    for child_id in set(child_item_ids):
+        if child_id == parent_item_id:
+            raise BOMCycleError("Parent and child cannot be the same item")
+
+        seen = {child_id}
+        stack = [child_id]
+        while stack:
+            node = stack.pop()
+            for edge in graph.children.get(node, ()):
+                if edge.child_item_id == parent_item_id:
+                    raise BOMCycleError(
+                        f"Circular BOM reference: item {parent_item_id} is already "
+                        f"a component of item {child_id}"
+                    )
+                if edge.child_item_id not in seen:
+                    seen.add(edge.child_item_id)
+                    stack.append(edge.child_item_id)
+
+
+def get_low_level_codes(db: Session) -> Dict[int, int]:
+    """
+    Load persisted low-level codes.
+
+    Args:
+        db: Database session
+
+    Returns:
+        dict: Low-level code by item ID (items without a row are level 0)
+    """
+    return dict(db.query(
+        models.ItemLowLevelCode.item_id,
+        models.ItemLowLevelCode.low_level_code
+    ).all())
+
+
+def rebuild_low_level_codes(db: Session) -> dict:
+    """
+    Recompute and persist the low-level code of every item (the caller commits).
+
+    Like refresh_low_level_codes, expects the transaction to hold
+    bom_graph.lock_bom_structure so no BOM write interleaves.
+
+    Args:
+        db: Database session
+
+    Returns:
+        dict: Summary with item count, deepest level and items in cycles
+    """
+    graph = load_bom_graph(db)
+    llc, cycle_items = compute_low_level_codes(graph)
+
+    item_ids = [row[0] for row in db.query(models.MasterItem.id).all()]
+
+    db.query(models.ItemLowLevelCode).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.ItemLowLevelCode, [
+        {"item_id": item_id, "low_level_code": llc.get(item_id, 0)}
+        for item_id in item_ids
+    ])
+
+    return {
+        "items": len(item_ids),
+        "max_low_level_code": max(llc.values(), default=0),
+        "cycle_item_ids": sorted(cycle_items)
+    }
+
+
+def refresh_low_level_codes(db: Session, seed_item_ids: Iterable[int]) -> None:
+    """
+    Incrementally maintain low-level codes in the transaction of a BOM change (the caller commits).
+
+    Called after the change is flushed and before the commit, so the codes
+    are committed together with the BOM lines. The graph is read from the
+    session's own (uncommitted) view.
+
+    Precondition: the transaction started with bom_graph.lock_bom_structure.
+    Its version-row lock serializes BOM writers, so each refresh sees the
+    previous writer's lines and codes; without it, concurrent refreshes can
+    store codes computed from each other's stale structure.
+
+    Only the seed items and everything below them in the (new) active BOM
+    structure are recomputed; their other parents keep their stored codes.
+    Seeds should be the changed parent plus the children it had before the
+    change, so components that were removed can move up again.
+
+    Args:
+        db: Database session
+        seed_item_ids: Items whose structure changed
+    """
+    if db.query(models.ItemLowLevelCode.item_id).first() is None:
+        rebuild_low_level_codes(db)
+        return
+
+    graph = load_bom_graph(db)
+
+    affected = set(seed_item_ids)
+    stack = list(affected)
+    while stack:
+        node = stack.pop()
+        for edge in graph.children.get(node, ()):
+            if edge.child_item_id not in affected:
+                affected.add(edge.child_item_id)
+                stack.append(edge.child_item_id)
+
+    outside_parents = {
+        edge.parent_item_id
+        for item_id in affected
+        for edge in graph.parents.get(item_id, ())
+        if edge.parent_item_id not in affected
+    }
+    stored_rows = {
+        row.item_id: row for row in db.query(models.ItemLowLevelCode).filter(
+            models.ItemLowLevelCode.item_id.in_(affected | outside_parents)
+        ).all()
+    }
+
+    indegree = {
+        item_id: sum(1 for edge in graph.parents.get(item_id, ()) if edge.parent_item_id in affected)
+        for item_id in affected
+    }
+    queue = deque(item_id for item_id, count in indegree.items() if count == 0)
+    llc = {}
+
+    while queue:
+        node = queue.popleft()
+        llc[node] = max(
+            (
+                (llc[edge.parent_item_id] if edge.parent_item_id in affected
+                 else stored_rows[edge.parent_item_id].low_level_code if edge.parent_item_id in stored_rows
+                 else 0) + 1
+                for edge in graph.parents.get(node, ())
+            ),
+            default=0
+        )
+        for edge in graph.children.get(node, ()):
+            indegree[edge.child_item_id] -= 1
+            if indegree[edge.child_item_id] == 0:
+                queue.append(edge.child_item_id)
+
+    for item_id, code in llc.items():
+        row = stored_rows.get(item_id)
+        if row is None:
+            db.add(models.ItemLowLevelCode(item_id=item_id, low_level_code=code))
+        elif row.low_level_code != code:
+            row.low_level_code = code
+
+
+def ensure_low_level_codes(db: Session) -> bool:
+    """
+    Build the low-level code table if it is empty (e.g. a database created before it existed).
+
+    Args:
+        db: Database session
+
+    Returns:
+        bool: Whether the table was built (False if it had rows, or another worker built it first)
+    """
+    if db.query(models.ItemLowLevelCode.item_id).first() is not None:
+        return False
+    try:
+        lock_bom_structure(db)
+        rebuild_low_level_codes(db)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return True
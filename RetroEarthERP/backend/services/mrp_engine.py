@@ -0,0 +1,355 @@
+"""
+Time-Phased MRP Engine
+Multi-level netting in low-level-code order over array-backed item x bucket vectors
+"""
+import heapq
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+import models
+from services.bom_gozinto import GozintoMatrix, connected_components, sub_matrix
+from services.lot_sizing import LotSizer, LotSizingRule
+
+
+# Days per planning bucket
+BUCKET_DAYS = {"DAY": 1, "WEEK": 7}
+
+# Worker processes for partitioned MRP (0 = one per CPU)
+MRP_WORKERS = int(os.getenv("MRP_WORKERS", "0")) or os.cpu_count() or 1
+
+# Smaller runs (items x buckets) are planned in-process; pool start-up would dominate
+PARALLEL_MIN_CELLS = 1_000_000
+
+# Sub-problems per worker, so families of uneven size still balance
+CHUNKS_PER_WORKER = 4
+
+
+class MRPHorizon:
+    """Planning horizon split into equal buckets starting at start_date"""
+
+    def __init__(self, start_date: date, end_date: date, bucket: str = "DAY"):
+        if bucket not in BUCKET_DAYS:
+            raise ValueError(f"Invalid bucket. Must be one of: {list(BUCKET_DAYS)}")
+        self.bucket = bucket
+        self.bucket_days = BUCKET_DAYS[bucket]
+        self.start_date = start_date
+        self.num_buckets = max((end_date - start_date).days // self.bucket_days + 1, 1)
+
+    def bucket_of(self, day: date) -> int:
+        """Bucket index of a date (past dates fall into the first bucket)"""
+        index = (day - self.start_date).days // self.bucket_days
+        return min(max(index, 0), self.num_buckets - 1)
+
+    def bucket_date(self, index: int) -> date:
+        """Start date of a bucket"""
+        return self.start_date + timedelta(days=index * self.bucket_days)
+
+    def to_buckets(self, days: int) -> int:
+        """Lead time in whole buckets (rounded up)"""
+        return -(-int(days) // self.bucket_days) if days > 0 else 0
+
+    @classmethod
+    def covering(cls, demand: Dict[int, List[Tuple[date, float]]], bucket: str = "DAY") -> "MRPHorizon":
+        """Horizon from today up to the latest demand date"""
+        today = date.today()
+        end_date = max((day for dated in demand.values() for day, _ in dated), default=today)
+        return cls(today, end_date, bucket)
+
+
+# Result of an MRP run; all 2-D arrays are (items x buckets)
+MRPPlan = namedtuple("MRPPlan", [
+    "horizon",
+    "item_ids",            # np.ndarray: row -> item ID
+    "index",               # dict: item ID -> row
+    "low_level_codes",     # np.ndarray: low-level code per row
+    "is_make",             # np.ndarray[bool]: item has a BOM (planned orders are work orders)
+    "lead_time_buckets",   # np.ndarray: lead time per row, in buckets
+    "on_hand",             # np.ndarray: starting on-hand per row
+    "gross",               # gross requirements (independent + dependent)
+    "receipts",            # scheduled receipts (open purchase orders)
+    "projected",           # projected available balance at the end of each bucket
+    "net_requirements",    # shortfall against safety stock before lot sizing
+    "planned_receipts",    # planned order receipts (due bucket, lot-sized)
+    "planned_releases",    # planned order releases (start bucket)
+])
+
+
+def _to_matrix(
+    rows: Dict[int, int],
+    entries: Dict[int, Iterable[Tuple[date, float]]],
+    horizon: MRPHorizon
+) -> np.ndarray:
+    """Spread dated quantities by item into an (items x buckets) array"""
+    array = np.zeros((len(rows), horizon.num_buckets), dtype=np.float64)
+    for item_id, dated in entries.items():
+        row = rows.get(item_id)
+        if row is None:
+            continue
+        for day, qty in dated:
+            array[row, horizon.bucket_of(day)] += qty
+    return array
+
+
+def _item_universe(matrix: GozintoMatrix, demand: Dict[int, list]) -> Tuple[np.ndarray, Dict[int, int], np.ndarray]:
+    """Items of an MRP run: the BOM structure plus demanded items without BOM lines"""
+    extra_ids = sorted(set(demand) - matrix.index.keys())
+    item_ids = np.concatenate((matrix.item_ids, np.array(extra_ids, dtype=np.int64)))
+    index = dict(matrix.index)
+    for offset, item_id in enumerate(extra_ids):
+        index[item_id] = len(matrix.item_ids) + offset
+    low_level_codes = np.concatenate((matrix.low_level_codes, np.zeros(len(extra_ids), dtype=np.int64)))
+    return item_ids, index, low_level_codes
+
+
+def run_mrp(
+    matrix: GozintoMatrix,
+    horizon: MRPHorizon,
+    demand: Dict[int, List[Tuple[date, float]]],
+    on_hand: Dict[int, float],
+    receipts: Dict[int, List[Tuple[date, float]]],
+    lead_time_days: Dict[int, int],
+    restrict_to: Optional[Set[int]] = None,
+    lot_sizing: Optional[Dict[int, LotSizingRule]] = None
+) -> MRPPlan:
+    """
+    Run a multi-level, time-phased MRP.
+
+    Items are netted level by level in low-level-code order; within a level
+    all items are processed together, bucket by bucket, carrying the
+    projected available balance forward. Planned orders are lot-sized per
+    item (lot-for-lot without safety stock by default), released lead time
+    earlier (past-due releases fall into the first bucket) and exploded into
+    gross requirements of their components through the Gozinto matrix before
+    the next level is netted.
+
+    Args:
+        matrix: Direct-requirements matrix of the active BOM structure
+        horizon: Planning horizon and bucket size
+        demand: Independent demand as (date, qty) per item ID
+        on_hand: Starting on-hand quantity per item ID
+        receipts: Scheduled receipts as (date, qty) per item ID
+        lead_time_days: Lead time per item ID (missing = 0)
+        restrict_to: Only net these items (must be closed under parents, so
+                     their dependent demand is complete); None = all items
+        lot_sizing: Lot-sizing rule per item ID (missing = lot-for-lot)
+
+    Returns:
+        MRPPlan: Time-phased arrays for every item in the BOM structure and demand
+    """
+    item_ids, index, low_level_codes = _item_universe(matrix, demand)
+    size = len(item_ids)
+    buckets = horizon.num_buckets
+
+    active = np.ones(size, dtype=bool)
+    if restrict_to is not None:
+        active[:] = False
+        active[[index[item_id] for item_id in restrict_to if item_id in index]] = True
+
+    is_make = np.zeros(size, dtype=bool)
+    is_make[matrix.parent_idx] = True
+
+    lead_time_buckets = np.fromiter(
+        (horizon.to_buckets(lead_time_days.get(int(item_id), 0) or 0) for item_id in item_ids),
+        dtype=np.int64, count=size
+    )
+    start_on_hand = np.fromiter(
+        (on_hand.get(int(item_id), 0.0) for item_id in item_ids), dtype=np.float64, count=size
+    )
+
+    gross = _to_matrix(index, demand, horizon)
+    scheduled = _to_matrix(index, receipts, horizon)
+    projected = np.zeros((size, buckets), dtype=np.float64)
+    net_requirements = np.zeros((size, buckets), dtype=np.float64)
+    planned_receipts = np.zeros((size, buckets), dtype=np.float64)
+    planned_releases = np.zeros((size, buckets), dtype=np.float64)
+
+    edges_by_level = {
+        int(matrix.low_level_codes[matrix.parent_idx[start]]): (start, end)
+        for start, end in matrix.level_bounds
+    }
+    coefficient = matrix.bom_qty * (1.0 + matrix.scrap_rate)
+
+    for level in range(int(low_level_codes.max(initial=0)) + 1):
+        rows = np.flatnonzero((low_level_codes == level) & active)
+        if not len(rows):
+            continue
+
+        # Net the whole level bucket by bucket
+        sizer = None
+        if lot_sizing:
+            sizer = LotSizer(
+                lot_sizing, item_ids[rows], gross[rows], scheduled[rows],
+                horizon.num_buckets * horizon.bucket_days
+            )
+        balance = start_on_hand[rows].copy()
+        for t in range(buckets):
+            available = balance + scheduled[rows, t] - gross[rows, t]
+            if sizer is None:
+                net = planned = np.maximum(-available, 0.0)
+            else:
+                net, planned = sizer.order(t, available)
+            net_requirements[rows, t] = net
+            planned_receipts[rows, t] = planned
+            balance = available + planned
+            projected[rows, t] = balance
+
+        # Offset receipts by lead time into releases
+        for lead_time in np.unique(lead_time_buckets[rows]).tolist():
+            group = rows[lead_time_buckets[rows] == lead_time]
+            if lead_time == 0:
+                planned_releases[group] = planned_receipts[group]
+                continue
+            if lead_time < buckets:
+                planned_releases[group, :buckets - lead_time] = planned_receipts[group, lead_time:]
+            past_due = planned_receipts[group, :min(lead_time, buckets)].sum(axis=1)
+            planned_releases[group, 0] += past_due
+
+        # Explode releases of this level into dependent demand of the next ones
+        bounds = edges_by_level.get(level)
+        if bounds:
+            start, end = bounds
+            parents = matrix.parent_idx[start:end]
+            np.add.at(
+                gross,
+                matrix.child_idx[start:end],
+                planned_releases[parents] * coefficient[start:end, None]
+            )
+
+    return MRPPlan(
+        horizon, item_ids, index, low_level_codes, is_make, lead_time_buckets,
+        start_on_hand, gross, scheduled, projected, net_requirements, planned_receipts, planned_releases
+    )
+
+
+def to_quantity(value: float) -> Decimal:
+    """Round an engine quantity to the precision of the quantity columns"""
+    return Decimal(str(round(float(value), 4)))
+
+
+def result_cells(plan: MRPPlan) -> Tuple[List[int], List[int]]:
+    """(row, bucket) cells that produce an MRP result: gross requirement or planned order"""
+    rows, buckets = np.nonzero((plan.gross > 0) | (plan.planned_receipts > 0))
+    return rows.tolist(), buckets.tolist()
+
+
+def result_values(plan: MRPPlan, row: int, t: int) -> dict:
+    """MRPResult column values of one item and bucket"""
+    planned = plan.planned_receipts[row, t]
+    if planned > 0:
+        action = models.SuggestedAction.MAKE if plan.is_make[row] else models.SuggestedAction.BUY
+    else:
+        action = models.SuggestedAction.NONE
+
+    return {
+        "gross_requirement": to_quantity(plan.gross[row, t]),
+        "on_hand_qty": to_quantity(plan.projected[row, t - 1] if t else plan.on_hand[row]),
+        "open_po_qty": to_quantity(plan.receipts[row, t]),
+        "net_requirement": to_quantity(plan.net_requirements[row, t]),
+        "suggested_action": action,
+        "suggested_qty": to_quantity(planned)
+    }
+
+
+def _run_chunk(args) -> MRPPlan:
+    """Worker entry point: plan one group of product families"""
+    return run_mrp(*args)
+
+
+def _select(values: dict, item_ids: Set[int]) -> dict:
+    """Entries of an item-keyed dict that belong to a chunk"""
+    return {item_id: value for item_id, value in values.items() if item_id in item_ids}
+
+
+def run_mrp_partitioned(
+    matrix: GozintoMatrix,
+    horizon: MRPHorizon,
+    demand: Dict[int, List[Tuple[date, float]]],
+    on_hand: Dict[int, float],
+    receipts: Dict[int, List[Tuple[date, float]]],
+    lead_time_days: Dict[int, int],
+    restrict_to: Optional[Set[int]] = None,
+    lot_sizing: Optional[Dict[int, LotSizingRule]] = None,
+    max_workers: Optional[int] = None
+) -> MRPPlan:
+    """
+    Run MRP per independent product family in a process pool.
+
+    Families (connected components of the BOM graph) share no items, so
+    netting them separately gives exactly the result of run_mrp over the
+    whole structure. Families are packed into balanced chunks, each chunk
+    is planned by a worker process from its slice of the inputs, and the
+    partial plans are merged back in run_mrp's row order. Small runs, or
+    structures with a single family, are planned in-process.
+
+    Args:
+        matrix, horizon, demand, on_hand, receipts, lead_time_days, restrict_to, lot_sizing: As run_mrp
+        max_workers: Worker processes (None = MRP_WORKERS)
+
+    Returns:
+        MRPPlan: Same plan as run_mrp
+    """
+    args = (matrix, horizon, demand, on_hand, receipts, lead_time_days, restrict_to, lot_sizing)
+    workers = max_workers or MRP_WORKERS
+    item_ids, index, low_level_codes = _item_universe(matrix, demand)
+    size = len(item_ids)
+    if workers < 2 or size * horizon.num_buckets < PARALLEL_MIN_CELLS:
+        return run_mrp(*args)
+
+    components = connected_components(matrix)
+    if len(components) < 2:
+        return run_mrp(*args)
+
+    # Largest families first onto the least loaded chunk
+    chunk_count = min(len(components), workers * CHUNKS_PER_WORKER)
+    loads = [(0, chunk) for chunk in range(chunk_count)]
+    members: List[List[np.ndarray]] = [[] for _ in range(chunk_count)]
+    for rows in sorted(components, key=len, reverse=True):
+        load, chunk = heapq.heappop(loads)
+        members[chunk].append(rows)
+        heapq.heappush(loads, (load + len(rows), chunk))
+
+    # Demanded items without BOM lines are planned with the first chunk
+    extra_items = set(item_ids[len(matrix.item_ids):].tolist())
+    tasks = []
+    for chunk, chunk_rows in enumerate(members):
+        sub = sub_matrix(matrix, np.sort(np.concatenate(chunk_rows)))
+        chunk_items = set(sub.index) | (extra_items if chunk == 0 else set())
+        tasks.append((
+            sub, horizon,
+            *(_select(values, chunk_items) for values in (demand, on_hand, receipts, lead_time_days)),
+            None if restrict_to is None else restrict_to & chunk_items,
+            _select(lot_sizing, chunk_items) if lot_sizing else None
+        ))
+
+    buckets = horizon.num_buckets
+    is_make = np.zeros(size, dtype=bool)
+    lead_time_buckets = np.zeros(size, dtype=np.int64)
+    start_on_hand = np.zeros(size, dtype=np.float64)
+    arrays = {
+        field: np.zeros((size, buckets), dtype=np.float64)
+        for field in ("gross", "receipts", "projected", "net_requirements", "planned_receipts", "planned_releases")
+    }
+
+    # Fresh interpreters: forking the server would copy its threads' locks and open DB connections
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(tasks)),
+        mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        for part in executor.map(_run_chunk, tasks):
+            rows = np.fromiter((index[item_id] for item_id in part.item_ids.tolist()), dtype=np.int64)
+            is_make[rows] = part.is_make
+            lead_time_buckets[rows] = part.lead_time_buckets
+            start_on_hand[rows] = part.on_hand
+            for field, array in arrays.items():
+                array[rows] = getattr(part, field)
+
+    return MRPPlan(
+        horizon, item_ids, index, low_level_codes, is_make, lead_time_buckets, start_on_hand,
+        arrays["gross"], arrays["receipts"], arrays["projected"], arrays["net_requirements"],
+        arrays["planned_receipts"], arrays["planned_releases"]
+    )
@@ -0,0 +1,65 @@
+"""
+Net-Change MRP Service
+Tracks items whose planning inputs changed so a calculated plan can be re-planned incrementally
+"""
+from datetime import datetime
+from sqlalchemy.orm import Session
+from typing import Iterable, Optional, Set
+import models
+from services.inventory_balance import UPSERT_INSERTS
+from utils.datetime_utils import get_utc_now
+
+
+# Sources that mark items dirty
+SOURCE_INVENTORY = "INVENTORY"
+SOURCE_PURCHASE_ORDER = "PURCHASE_ORDER"
+SOURCE_SALES_ORDER = "SALES_ORDER"
+SOURCE_BOM = "BOM"
+SOURCE_LOT_SIZING = "LOT_SIZING"
+
+
+def mark_items_dirty(db: Session, item_ids: Iterable[int], source: str) -> None:
+    """
+    Record that the planning inputs of items changed.
+
+    Runs inside the caller's transaction (the caller commits), so the mark
+    becomes visible together with the change itself. One INSERT ... ON
+    CONFLICT DO UPDATE, so concurrent postings marking the same new item
+    cannot fail each other on the primary key.
+
+    Args:
+        db: Database session
+        item_ids: Changed items
+        source: What changed (one of the SOURCE_* constants)
+    """
+    item_ids = {item_id for item_id in item_ids if item_id is not None}
+    if not item_ids:
+        return
+
+    now = get_utc_now()
+    statement = UPSERT_INSERTS[db.get_bind().dialect.name](models.MRPDirtyItem)
+    statement = statement.on_conflict_do_update(
+        index_elements=[models.MRPDirtyItem.item_id],
+        set_={"source": statement.excluded.source, "marked_at": statement.excluded.marked_at}
+    )
+    # Sorted so concurrent postings lock the rows in the same order
+    db.execute(statement, [
+        {"item_id": item_id, "source": source, "marked_at": now} for item_id in sorted(item_ids)
+    ])
+
+
+def get_dirty_items(db: Session, since: Optional[datetime] = None) -> Set[int]:
+    """
+    Get items marked dirty after a point in time.
+
+    Args:
+        db: Database session
+        since: Last calculation time of the plan (None = every marked item)
+
+    Returns:
+        set: Item IDs
+    """
+    query = db.query(models.MRPDirtyItem.item_id)
+    if since is not None:
+        query = query.filter(models.MRPDirtyItem.marked_at > since)
+    return {row[0] for row in query.all()}
@@ -0,0 +1,265 @@
+"""
+MRP Pegging
+Demand-to-supply pegging of an MRP run, traced through the BOM levels to the end demand
+"""
+from collections import namedtuple
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import models
+from services.bom_gozinto import GozintoMatrix
+from services.mrp_engine import MRPPlan, to_quantity
+from services.planning_snapshot import PlanningSnapshot
+
+
+# Supply kinds, in the order they are consumed within a bucket
+SUPPLY_ON_HAND = "ON_HAND"
+SUPPLY_PURCHASE_ORDER = "PURCHASE_ORDER"
+SUPPLY_PLANNED_ORDER = "PLANNED_ORDER"
+
+# End demand kinds; STOCK is supply not tied to a demand (lot-size surplus, safety stock)
+DEMAND_SALES_ORDER = "SALES_ORDER"
+DEMAND_PLAN_ITEM = "PLAN_ITEM"
+DEMAND_STOCK = "STOCK"
+
+# Quantity treated as fully allocated
+PEG_EPSILON = 1e-9
+
+
+# Independent demand a requirement is pegged to
+EndDemand = namedtuple("EndDemand", ["demand_type", "ref_id", "item_id", "date"])
+
+
+def load_end_demand(
+    db: Session,
+    plan: models.ProductionPlan,
+    snapshot: PlanningSnapshot
+) -> Dict[int, List[Tuple[date, float, EndDemand]]]:
+    """
+    Independent demand of a plan, line by line.
+
+    Same quantities as plan_demand, but each sales order or plan line is
+    kept separately so requirements can be pegged to it.
+
+    Args:
+        db: Database session
+        plan: Production plan
+        snapshot: Planning snapshot the plan is calculated on
+
+    Returns:
+        dict: (date, qty, end demand) per item ID
+    """
+    demand: Dict[int, List[Tuple[date, float, EndDemand]]] = {}
+
+    if plan.source_type == 'ACTUAL':
+        SOH = models.TrnSalesOrderHead
+        SOD = models.TrnSalesOrderDetail
+        rows = db.query(
+            SOD.id,
+            SOD.item_id,
+            func.coalesce(SOH.delivery_date, SOH.so_date),
+            SOD.qty_ordered - SOD.qty_delivered
+        ).join(
+            SOH, SOH.id == SOD.so_id
+        ).filter(
+            SOH.status.in_([models.SOStatus.CONFIRMED, models.SOStatus.PARTIAL_DELIVERED]),
+            SOD.qty_ordered > SOD.qty_delivered
+        ).all()
+        for line_id, item_id, day, qty in rows:
+            demand.setdefault(item_id, []).append(
+                (day, float(qty), EndDemand(DEMAND_SALES_ORDER, line_id, item_id, day))
+            )
+        return demand
+
+    for item in plan.items:
+        if item.item_id in snapshot.items:
+            demand.setdefault(item.item_id, []).append((
+                item.delivery_date,
+                float(item.quantity),
+                EndDemand(DEMAND_PLAN_ITEM, item.id, item.item_id, item.delivery_date)
+            ))
+    return demand
+
+
+def load_open_po_lines(db: Session) -> Dict[int, List[Tuple[date, float, int]]]:
+    """
+    Open purchase order lines (the scheduled receipts of MRP), line by line.
+
+    Args:
+        db: Database session
+
+    Returns:
+        dict: (expected date, open qty, PO detail ID) per item ID
+    """
+    POH = models.TrnPurchaseOrderHead
+    POD = models.TrnPurchaseOrderDetail
+    rows = db.query(
+        POD.id,
+        POD.item_id,
+        func.coalesce(POH.delivery_date, POH.po_date),
+        POD.qty_ordered - POD.qty_received
+    ).join(
+        POH, POH.id == POD.po_id
+    ).filter(
+        POD.qty_ordered > POD.qty_received,
+        POH.status != models.POStatus.CANCELLED
+    ).all()
+
+    lines: Dict[int, List[Tuple[date, float, int]]] = {}
+    for line_id, item_id, day, qty in rows:
+        lines.setdefault(item_id, []).append((day, float(qty), line_id))
+    return lines
+
+
+def build_pegging(
+    plan_id: int,
+    mrp: MRPPlan,
+    matrix: GozintoMatrix,
+    end_demand: Dict[int, List[Tuple[date, float, EndDemand]]],
+    po_lines: Dict[int, List[Tuple[date, float, int]]]
+) -> List[dict]:
+    """
+    Peg the supply of an MRP run to the demand it covers.
+
+    Items are walked in low-level-code order, like the netting itself. The
+    requirements of an item (its independent demand lines plus the component
+    demand of its parents' planned orders) take its supply first-in-first-out:
+    on-hand, then open PO lines and planned orders by due bucket. The pegs of
+    a planned order are exploded, at its release bucket, into requirements of
+    its components that carry the same end demand one level deeper, so every
+    row traces back to a sales order or plan line. Planned quantity no demand
+    takes (lot-size surplus, safety stock) is pegged to STOCK.
+
+    Args:
+        plan_id: Plan the pegging belongs to
+        mrp: Result of the MRP run
+        matrix: Gozinto matrix the run used
+        end_demand: Independent demand lines (see load_end_demand)
+        po_lines: Open PO lines (see load_open_po_lines)
+
+    Returns:
+        list: MRPPegging column values, one dict per allocation
+    """
+    horizon = mrp.horizon
+    coefficient = matrix.bom_qty * (1.0 + matrix.scrap_rate)
+    components: Dict[int, List[Tuple[int, float]]] = {}
+    for parent, child, per_parent in zip(
+        matrix.parent_idx.tolist(), matrix.child_idx.tolist(), coefficient.tolist()
+    ):
+        components.setdefault(parent, []).append((child, per_parent))
+
+    # Requirement: (bucket, qty, end demand, level, parent item ID)
+    requirements: Dict[int, list] = {}
+    for item_id, lines in end_demand.items():
+        row = mrp.index.get(item_id)
+        if row is None:
+            continue
+        for day, qty, end in lines:
+            requirements.setdefault(row, []).append((horizon.bucket_of(day), qty, end, 0, None))
+
+    pegging = []
+    has_orders = mrp.planned_receipts.any(axis=1)
+    for row in np.lexsort((np.arange(len(mrp.item_ids)), mrp.low_level_codes)).tolist():
+        demands = requirements.pop(row, None)
+        if not demands and not has_orders[row]:
+            continue
+        item_id = int(mrp.item_ids[row])
+
+        # Supply: [bucket, kind order, remaining qty, supply type, ref ID, supply date]
+        supplies = []
+        if mrp.on_hand[row] > PEG_EPSILON:
+            supplies.append([-1, 0, float(mrp.on_hand[row]), SUPPLY_ON_HAND, None, None])
+        for day, qty, line_id in po_lines.get(item_id, ()):
+            supplies.append([horizon.bucket_of(day), 1, qty, SUPPLY_PURCHASE_ORDER, line_id, day])
+        for t in np.flatnonzero(mrp.planned_receipts[row] > PEG_EPSILON).tolist():
+            supplies.append([
+                t, 2, float(mrp.planned_receipts[row, t]), SUPPLY_PLANNED_ORDER, None, horizon.bucket_date(t)
+            ])
+        supplies.sort(key=lambda supply: (supply[0], supply[1], supply[4] or 0))
+
+        # Pegs of each planned order: receipt bucket -> [(qty, end demand, level)]
+        order_pegs: Dict[int, List[Tuple[float, EndDemand, int]]] = {}
+        position = 0
+        for bucket, qty, end, level, parent_item_id in sorted(
+            demands or (), key=lambda demand: (demand[0], demand[2].date or date.max)
+        ):
+            while qty > PEG_EPSILON and position < len(supplies):
+                supply = supplies[position]
+                taken = min(qty, supply[2])
+                quantity = to_quantity(taken)
+                if quantity:
+                    pegging.append({
+                        "plan_id": plan_id,
+                        "item_id": item_id,
+                        "level": level,
+                        "parent_item_id": parent_item_id,
+                        "requirement_date": horizon.bucket_date(bucket),
+                        "quantity": quantity,
+                        "supply_type": supply[3],
+                        "supply_ref_id": supply[4],
+                        "supply_date": supply[5],
+                        "demand_type": end.demand_type,
+                        "demand_ref_id": end.ref_id,
+                        "demand_item_id": end.item_id,
+                        "demand_date": end.date
+                    })
+                if supply[3] == SUPPLY_PLANNED_ORDER:
+                    order_pegs.setdefault(supply[0], []).append((taken, end, level))
+                supply[2] -= taken
+                qty -= taken
+                if supply[2] <= PEG_EPSILON:
+                    position += 1
+
+        surplus = EndDemand(DEMAND_STOCK, None, item_id, None)
+        for supply in supplies[position:]:
+            if supply[3] == SUPPLY_PLANNED_ORDER and supply[2] > PEG_EPSILON:
+                order_pegs.setdefault(supply[0], []).append((supply[2], surplus, 0))
+
+        # Component requirements of the planned orders, at their release bucket
+        children = components.get(row)
+        if not children:
+            continue
+        lead_time = int(mrp.lead_time_buckets[row])
+        for t, pegs in order_pegs.items():
+            release = max(t - lead_time, 0)
+            for child, per_parent in children:
+                child_demands = requirements.setdefault(child, [])
+                for qty, end, level in pegs:
+                    child_demands.append((release, qty * per_parent, end, level + 1, item_id))
+
+    return pegging
+
+
+def purchase_order_impact(
+    db: Session,
+    po_detail_id: int,
+    slip_to: Optional[date] = None
+) -> List[dict]:
+    """
+    Requirements pegged to an open PO line, across all calculated plans.
+
+    Answers "what breaks if this PO slips" from the pegging index alone,
+    without re-planning.
+
+    Args:
+        db: Database session
+        po_detail_id: Purchase order line
+        slip_to: New expected date; pegs required before it are flagged late
+
+    Returns:
+        list: Pegged requirements with their end demand, in requirement date order
+    """
+    P = models.MRPPegging
+    rows = db.query(P).filter(
+        P.supply_type == SUPPLY_PURCHASE_ORDER,
+        P.supply_ref_id == po_detail_id
+    ).order_by(P.requirement_date, P.id).all()
+
+    impact = []
+    for peg in rows:
+        data = {column.name: getattr(peg, column.name) for column in P.__table__.columns}
+        data["late"] = slip_to is not None and peg.requirement_date < slip_to
+        impact.append(data)
+    return impact
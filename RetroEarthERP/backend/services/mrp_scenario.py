@@ -0,0 +1,268 @@
+"""
+What-If MRP Scenarios
+MRP runs on the live planning snapshot overlaid, copy-on-write, with demand, inventory and BOM deltas
+"""
+from collections import ChainMap
+from datetime import date
+from decimal import Decimal
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Mapping, Tuple
+import models
+from services import bom_gozinto, bom_graph
+from services.mrp_engine import MRPHorizon, result_cells, result_values, run_mrp_partitioned
+from services.planning_snapshot import PlanningSnapshot, load_planning_snapshot, plan_demand
+from utils.datetime_utils import get_utc_now
+
+
+DELTA_TYPES = ("DEMAND", "INVENTORY", "BOM")
+
+
+class ScenarioError(ValueError):
+    """Raised when scenario deltas are invalid"""
+
+
+def validate_deltas(db: Session, deltas: Iterable) -> None:
+    """
+    Check scenario deltas before they are saved.
+
+    Args:
+        db: Database session
+        deltas: Objects with delta_type, item_id, child_item_id, delta_date, quantity
+
+    Raises:
+        ScenarioError: If a delta is incomplete or refers to unknown items
+    """
+    item_ids = set()
+    for delta in deltas:
+        if delta.delta_type not in DELTA_TYPES:
+            raise ScenarioError(f"Invalid delta type {delta.delta_type}. Must be one of: {list(DELTA_TYPES)}")
+        if delta.delta_type == "DEMAND" and delta.delta_date is None:
+            raise ScenarioError(f"Demand delta for item {delta.item_id} needs a delta_date")
+        if delta.delta_type == "BOM":
+            if delta.child_item_id is None or delta.child_item_id == delta.item_id:
+                raise ScenarioError(f"BOM delta for item {delta.item_id} needs a different child_item_id")
+            if delta.quantity < 0:
+                raise ScenarioError("BOM delta quantity cannot be negative (0 removes the line)")
+            item_ids.add(delta.child_item_id)
+        item_ids.add(delta.item_id)
+
+    if item_ids:
+        found = {
+            row[0] for row in db.query(models.MasterItem.id).filter(models.MasterItem.id.in_(item_ids)).all()
+        }
+        missing = item_ids - found
+        if missing:
+            raise ScenarioError(f"Items not found: {sorted(missing)}")
+
+
+def _overlay_demand(
+    base: Mapping[int, List[Tuple[date, float]]],
+    deltas: List[models.MRPScenarioDelta]
+) -> Mapping[int, List[Tuple[date, float]]]:
+    """Demand with deltas applied; only changed items get a new (date-aggregated, non-negative) list"""
+    by_item: Dict[int, Dict[date, float]] = {}
+    for delta in deltas:
+        if delta.item_id not in by_item:
+            by_item[delta.item_id] = {}
+            for day, qty in base.get(delta.item_id, ()):
+                by_item[delta.item_id][day] = by_item[delta.item_id].get(day, 0.0) + qty
+        dated = by_item[delta.item_id]
+        dated[delta.delta_date] = dated.get(delta.delta_date, 0.0) + float(delta.quantity)
+
+    overrides = {
+        item_id: [(day, qty) for day, qty in sorted(dated.items()) if qty > 0]
+        for item_id, dated in by_item.items()
+    }
+    return ChainMap(overrides, base)
+
+
+def _overlay_on_hand(base: Mapping[int, float], deltas: List[models.MRPScenarioDelta]) -> Mapping[int, float]:
+    """On-hand with stock adjustments applied (never below zero)"""
+    overrides: Dict[int, float] = {}
+    for delta in deltas:
+        current = overrides.get(delta.item_id, base.get(delta.item_id, 0.0))
+        overrides[delta.item_id] = current + float(delta.quantity)
+    return ChainMap({item_id: max(qty, 0.0) for item_id, qty in overrides.items()}, base)
+
+
+def _overlay_graph(graph: bom_graph.BOMGraph, deltas: List[models.MRPScenarioDelta]) -> bom_graph.BOMGraph:
+    """
+    Active BOM structure with line quantities changed, removed (0) or added.
+
+    Unchanged lines are shared with the live graph.
+    """
+    overrides = {(delta.item_id, delta.child_item_id): delta.quantity for delta in deltas}
+    applied = set()
+    edges = []
+    for lines in graph.children.values():
+        for edge in lines:
+            key = (edge.parent_item_id, edge.child_item_id)
+            if key not in overrides:
+                edges.append(edge)
+            elif key not in applied:
+                # First line of the pair takes the new quantity, duplicates are dropped
+                applied.add(key)
+                if overrides[key] > 0:
+                    edges.append(edge._replace(quantity=Decimal(overrides[key]), percentage=None))
+
+    for (parent_id, child_id), quantity in overrides.items():
+        if (parent_id, child_id) in applied or quantity <= 0:
+            continue
+        edges.append(bom_graph.BOMEdge(
+            0, parent_id, child_id, 'ASSEMBLY', 0, Decimal(quantity), None, False, False, 0,
+            None, None, None, 0, None, 'What-if', graph.active_revision.get(parent_id, 1), True
+        ))
+
+    return bom_graph.BOMGraph(graph.version, edges)
+
+
+def run_scenario(db: Session, scenario: models.MRPScenario) -> int:
+    """
+    Run MRP for a scenario and replace its results (the caller commits).
+
+    The live snapshot, BOM graph and Gozinto matrix are never modified:
+    deltas are overlays on top of them, and only the parts a delta touches
+    (demand of an item, its stock, the BOM structure) are copied. Live
+    MRPResult rows are not read or written.
+
+    Args:
+        db: Database session
+        scenario: Scenario with its deltas
+
+    Returns:
+        int: Number of scenario results
+
+    Raises:
+        BOMCycleError: If BOM deltas make the structure circular
+    """
+    snapshot = load_planning_snapshot(db)
+    deltas = {delta_type: [] for delta_type in DELTA_TYPES}
+    for delta in scenario.deltas:
+        deltas[delta.delta_type].append(delta)
+
+    base_demand = plan_demand(scenario.plan, snapshot) if scenario.plan else snapshot.open_so
+    demand = _overlay_demand(base_demand, deltas["DEMAND"]) if deltas["DEMAND"] else base_demand
+
+    if deltas["BOM"]:
+        graph = _overlay_graph(bom_graph.get_bom_graph(db), deltas["BOM"])
+        matrix = bom_gozinto.build_matrix(graph)
+        make_items = frozenset(graph.children.keys())
+    else:
+        matrix = bom_gozinto.get_gozinto_matrix(db)
+        make_items = snapshot.make_items
+
+    view = PlanningSnapshot(
+        snapshot.items,
+        _overlay_on_hand(snapshot.on_hand, deltas["INVENTORY"]) if deltas["INVENTORY"] else snapshot.on_hand,
+        snapshot.open_po,
+        snapshot.open_so,
+        make_items,
+        snapshot.production_lead_time_days,
+        snapshot.lot_sizing
+    )
+
+    horizon = MRPHorizon.covering(demand, scenario.bucket or "DAY")
+    mrp = run_mrp_partitioned(
+        matrix, horizon, demand, view.on_hand, view.open_po, view.lead_times(), lot_sizing=view.lot_sizing
+    )
+
+    rows, buckets = result_cells(mrp)
+    results = [
+        {
+            "scenario_id": scenario.id,
+            "item_id": int(mrp.item_ids[row]),
+            "required_date": horizon.bucket_date(t),
+            **result_values(mrp, row, t)
+        }
+        for row, t in zip(rows, buckets)
+    ]
+
+    db.query(models.MRPScenarioResult).filter(models.MRPScenarioResult.scenario_id == scenario.id).delete()
+    if results:
+        db.execute(insert(models.MRPScenarioResult), results)
+
+    scenario.status = models.MRPStatus.COMPLETED
+    scenario.run_date = get_utc_now()
+    return len(results)
+
+
+def compare_scenarios(db: Session, base_id: int, other_id: int) -> dict:
+    """
+    Compare the net requirements and planned orders of two scenarios.
+
+    Args:
+        db: Database session
+        base_id: Scenario compared against
+        other_id: Scenario compared
+
+    Returns:
+        dict: Per-item totals and per-date lines that differ (other - base)
+    """
+    R = models.MRPScenarioResult
+
+    def load(scenario_id):
+        return {
+            (item_id, required_date): (float(net or 0), float(suggested or 0))
+            for item_id, required_date, net, suggested in db.query(
+                R.item_id, R.required_date, R.net_requirement, R.suggested_qty
+            ).filter(R.scenario_id == scenario_id).all()
+        }
+
+    base = load(base_id)
+    other = load(other_id)
+    keys = base.keys() | other.keys()
+
+    item_ids = {item_id for item_id, _ in keys}
+    items = {}
+    if item_ids:
+        items = {
+            row.id: row for row in db.query(
+                models.MasterItem.id, models.MasterItem.item_code, models.MasterItem.item_name
+            ).filter(models.MasterItem.id.in_(item_ids)).all()
+        }
+
+    totals: Dict[int, List[float]] = {}
+    lines = []
+    for item_id, required_date in keys:
+        base_net, base_qty = base.get((item_id, required_date), (0.0, 0.0))
+        other_net, other_qty = other.get((item_id, required_date), (0.0, 0.0))
+        total = totals.setdefault(item_id, [0.0, 0.0, 0.0, 0.0])
+        total[0] += base_net
+        total[1] += other_net
+        total[2] += base_qty
+        total[3] += other_qty
+        if base_net != other_net or base_qty != other_qty:
+            lines.append({
+                "item_id": item_id,
+                "item_code": items[item_id].item_code if item_id in items else None,
+                "required_date": required_date,
+                "base_net_requirement": base_net,
+                "other_net_requirement": other_net,
+                "net_difference": round(other_net - base_net, 4),
+                "base_suggested_qty": base_qty,
+                "other_suggested_qty": other_qty
+            })
+
+    summary = []
+    for item_id, (base_net, other_net, base_qty, other_qty) in totals.items():
+        item = items.get(item_id)
+        summary.append({
+            "item_id": item_id,
+            "item_code": item.item_code if item else None,
+            "item_name": item.item_name if item else None,
+            "base_net_requirement": round(base_net, 4),
+            "other_net_requirement": round(other_net, 4),
+            "net_difference": round(other_net - base_net, 4),
+            "base_suggested_qty": round(base_qty, 4),
+            "other_suggested_qty": round(other_qty, 4)
+        })
+
+    summary.sort(key=lambda x: (-abs(x["net_difference"]), x["item_code"] or ""))
+    lines.sort(key=lambda x: (x["item_code"] or "", x["required_date"]))
+    return {
+        "base_scenario_id": base_id,
+        "other_scenario_id": other_id,
+        "items": summary,
+        "lines": lines
+    }
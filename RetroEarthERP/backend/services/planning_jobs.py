@@ -0,0 +1,406 @@
+"""
+Planning Job Runner
+Runs plan calculation/processing in an in-process worker pool, tracked in the planning_jobs table
+"""
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from sqlalchemy import create_engine, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Optional
+import models
+from database import SessionLocal, engine
+from utils.datetime_utils import get_utc_now
+
+
+# Worker threads shared by all planning jobs of this process
+MAX_WORKERS = int(os.getenv("PLANNING_JOB_WORKERS", "2"))
+
+# Job statuses that never change again
+FINISHED_STATUSES = ("COMPLETED", "FAILED", "CANCELLED")
+
+# Minimum seconds between progress writes of a job (each write also picks up cancellation)
+PROGRESS_WRITE_SECONDS = 1.0
+
+# Seconds between heartbeats of the unfinished jobs of this process
+HEARTBEAT_SECONDS = 15
+
+# An unfinished job of another host without a heartbeat for this long has lost its worker
+# (jobs of this host are checked through their process instead)
+HEARTBEAT_TIMEOUT = timedelta(seconds=120)
+
+# Owner of the jobs submitted by this process
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# A job task runs on its own session and reports progress (percent) through the callback.
+# It must not commit: the runner commits its work together with the job's final state.
+JobTask = Callable[[Session, Callable[[int], None]], dict]
+
+# Progress, heartbeats and cancellation checks use short connections of their own, outside the
+# job's transaction. On SQLite they give up at once instead of waiting for the job's write lock
+# (they are best effort; the next checkpoint tries again).
+if engine.dialect.name == "sqlite":
+    _status_engine = create_engine(engine.url, connect_args={"check_same_thread": False, "timeout": 0})
+else:
+    _status_engine = engine
+
+
+class JobCancelled(Exception):
+    """Raised at a progress checkpoint of a job whose cancellation was requested"""
+
+
+class JobConflictError(ValueError):
+    """Raised when a plan already has an unfinished job"""
+
+
+class JobNotCancellableError(ValueError):
+    """Raised when cancelling a job that already finished"""
+
+
+def _write_status(job_id: int, **values) -> Optional[bool]:
+    """
+    Update a job row in its own short transaction.
+
+    Returns:
+        bool: The row's cancel_requested, or None if the write was skipped (database busy)
+    """
+    J = models.PlanningJob
+    try:
+        with _status_engine.begin() as connection:
+            return connection.execute(
+                update(J).where(J.id == job_id).values(**values).returning(J.cancel_requested)
+            ).scalar()
+    except OperationalError:
+        return None
+
+
+class JobContext:
+    """State of a submitted job in the process running it; progress and cancellation go through the job row"""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.progress = 0
+        self._written_at = 0.0
+        self._cancelled = threading.Event()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """Ask the job to stop at its next progress checkpoint"""
+        self._cancelled.set()
+
+    def report(self, percent: int) -> None:
+        """
+        Record progress of the running job.
+
+        At most every PROGRESS_WRITE_SECONDS the progress is written to the
+        job row, which also reads the cancellation flag that any server
+        process may have set.
+
+        Raises:
+            JobCancelled: If cancellation was requested (the job's work is rolled back)
+        """
+        self.progress = max(self.progress, min(int(percent), 100))
+        now = time.monotonic()
+        if not self._cancelled.is_set() and now - self._written_at >= PROGRESS_WRITE_SECONDS:
+            self._written_at = now
+            if _write_status(self.job_id, progress=self.progress, heartbeat_at=get_utc_now()):
+                self._cancelled.set()
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="planning-job")
+_jobs: Dict[int, JobContext] = {}
+_jobs_lock = threading.Lock()
+_heartbeat_thread: Optional[threading.Thread] = None
+
+
+def _heartbeat_loop() -> None:
+    """Keep the heartbeat of this process's jobs fresh, also during long steps without checkpoints"""
+    J = models.PlanningJob
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        with _jobs_lock:
+            job_ids = list(_jobs)
+        if not job_ids:
+            continue
+        try:
+            with _status_engine.begin() as connection:
+                connection.execute(
+                    update(J).where(J.id.in_(job_ids), J.status.notin_(FINISHED_STATUSES)).values(
+                        heartbeat_at=get_utc_now()
+                    )
+                )
+        except OperationalError:
+            pass
+
+
+def _start_heartbeat() -> None:
+    """Start the heartbeat thread of this process (once)"""
+    global _heartbeat_thread
+    with _jobs_lock:
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="planning-job-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+
+def _finish(db: Session, job_id: int, context: JobContext, status: str,
+            error: Optional[str] = None, result: Optional[dict] = None) -> bool:
+    """
+    Persist the final state of a job, committed together with the job's work.
+
+    Only an unfinished row is updated: if the job was already force-cancelled
+    (its worker was presumed dead), the work is rolled back instead.
+
+    Returns:
+        bool: Whether the job's state (and work) was committed
+    """
+    values = {
+        "status": status,
+        "progress": context.progress,
+        "error": error,
+        "result": result,
+        "finished_at": get_utc_now()
+    }
+    if context.cancel_requested:
+        values["cancel_requested"] = True
+
+    updated = db.query(models.PlanningJob).filter(
+        models.PlanningJob.id == job_id,
+        models.PlanningJob.status.notin_(FINISHED_STATUSES)
+    ).update(values, synchronize_session=False)
+    if not updated:
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+
+def _run_job(job_id: int, task: JobTask, context: JobContext) -> None:
+    """Worker entry point: run one job on its own session"""
+    db = SessionLocal()
+    try:
+        job = db.get(models.PlanningJob, job_id)
+        if context.cancel_requested or job.cancel_requested or job.status != 'QUEUED':
+            context.cancel()
+            _finish(db, job_id, context, 'CANCELLED')
+            return
+
+        job.status = 'RUNNING'
+        job.started_at = get_utc_now()
+        job.heartbeat_at = job.started_at
+        db.commit()
+
+        try:
+            result = task(db, context.report)
+        except JobCancelled:
+            db.rollback()
+            _finish(db, job_id, context, 'CANCELLED')
+        except Exception as exc:
+            db.rollback()
+            # HTTPException carries its message in detail
+            _finish(db, job_id, context, 'FAILED', error=str(getattr(exc, 'detail', None) or exc))
+        else:
+            context.progress = 100
+            _finish(db, job_id, context, 'COMPLETED', result=result)
+    finally:
+        with _jobs_lock:
+            _jobs.pop(job_id, None)
+        db.close()
+
+
+def _local_worker_alive(job: models.PlanningJob) -> Optional[bool]:
+    """
+    Whether the process running a job of this host is still there.
+
+    Returns:
+        bool: Whether it runs, or None if the job belongs to another host (or the check is unavailable)
+    """
+    host, _, pid = (job.worker_id or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit() or os.name != "posix":
+        return None
+    if int(pid) == os.getpid():
+        with _jobs_lock:
+            return job.id in _jobs
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _worker_lost(job: models.PlanningJob) -> bool:
+    """
+    Whether an unfinished job's worker is gone.
+
+    A job of this host is lost only when its process is. Heartbeats decide
+    for other hosts; they cannot be relied on for local jobs because on
+    SQLite the job's own transaction blocks them for the whole run.
+    """
+    alive = _local_worker_alive(job)
+    if alive is not None:
+        return not alive
+
+    last_seen = job.heartbeat_at or job.created_at
+    if last_seen is None:
+        return False
+    now = get_utc_now()
+    if last_seen.tzinfo is None:
+        now = now.replace(tzinfo=None)
+    return now - last_seen > HEARTBEAT_TIMEOUT
+
+
+def _cancel_lost_job(db: Session, job: models.PlanningJob) -> None:
+    """
+    Mark an unfinished job whose worker is gone as cancelled.
+
+    Its work was never committed: should the worker still be running, its
+    final update finds the job finished and rolls the work back.
+    """
+    db.query(models.PlanningJob).filter(
+        models.PlanningJob.id == job.id,
+        models.PlanningJob.status.notin_(FINISHED_STATUSES)
+    ).update({
+        "status": 'CANCELLED',
+        "cancel_requested": True,
+        "error": f"Worker {job.worker_id or 'unknown'} stopped responding",
+        "finished_at": get_utc_now()
+    }, synchronize_session=False)
+    db.commit()
+    db.refresh(job)
+
+
+def submit_job(
+    db: Session,
+    plan_id: int,
+    job_type: str,
+    parameters: dict,
+    user_id: int,
+    task: JobTask
+) -> models.PlanningJob:
+    """
+    Queue a planning job on the worker pool.
+
+    An unfinished job of the plan whose worker is gone is cancelled first;
+    one that is still alive blocks the new job.
+
+    Args:
+        db: Database session
+        plan_id: Plan the job works on
+        job_type: CALCULATE or PROCESS
+        parameters: Request parameters, stored with the job
+        user_id: User submitting the job
+        task: Work to run; must return a JSON-serializable result
+
+    Returns:
+        PlanningJob: The queued job
+
+    Raises:
+        JobConflictError: If the plan already has a queued or running job
+    """
+    unfinished = db.query(models.PlanningJob).filter(
+        models.PlanningJob.plan_id == plan_id,
+        models.PlanningJob.status.notin_(FINISHED_STATUSES)
+    ).all()
+    for job in unfinished:
+        if not _worker_lost(job):
+            raise JobConflictError(f"Plan {plan_id} already has an unfinished job ({job.id})")
+        _cancel_lost_job(db, job)
+
+    job = models.PlanningJob(
+        plan_id=plan_id,
+        job_type=job_type,
+        parameters=parameters,
+        status='QUEUED',
+        progress=0,
+        cancel_requested=False,
+        worker_id=WORKER_ID,
+        heartbeat_at=get_utc_now(),
+        created_by=user_id
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    _start_heartbeat()
+    context = JobContext(job.id)
+    with _jobs_lock:
+        _jobs[job.id] = context
+    _executor.submit(_run_job, job.id, task, context)
+    return job
+
+
+def get_job(db: Session, job_id: int) -> Optional[dict]:
+    """
+    Get a job with its progress.
+
+    Progress is written to the job row by its worker (throttled), so any
+    server process can answer; the process running the job adds its
+    latest in-memory value.
+
+    Args:
+        db: Database session
+        job_id: Job ID
+
+    Returns:
+        dict: Job fields, or None if the job does not exist
+    """
+    job = db.get(models.PlanningJob, job_id)
+    if job is None:
+        return None
+
+    data = {column.name: getattr(job, column.name) for column in models.PlanningJob.__table__.columns}
+    with _jobs_lock:
+        context = _jobs.get(job_id)
+    if context is not None and job.status not in FINISHED_STATUSES:
+        data["progress"] = max(job.progress or 0, context.progress)
+        data["cancel_requested"] = bool(job.cancel_requested) or context.cancel_requested
+    return data
+
+
+def cancel_job(db: Session, job_id: int) -> Optional[dict]:
+    """
+    Request cancellation of a job.
+
+    The request is stored in the job row, so the worker sees it at its
+    next progress checkpoint whichever server process runs it, and rolls
+    back its work. Only a job whose worker is gone (see _worker_lost) is
+    marked cancelled directly.
+
+    Args:
+        db: Database session
+        job_id: Job ID
+
+    Returns:
+        dict: Job fields (as get_job), or None if the job does not exist
+
+    Raises:
+        JobNotCancellableError: If the job already finished
+    """
+    job = db.get(models.PlanningJob, job_id)
+    if job is None:
+        return None
+    if job.status in FINISHED_STATUSES:
+        raise JobNotCancellableError(f"Job {job_id} already finished ({job.status})")
+
+    if _worker_lost(job):
+        _cancel_lost_job(db, job)
+    else:
+        with _jobs_lock:
+            context = _jobs.get(job_id)
+        if context is not None:
+            context.cancel()
+        job.cancel_requested = True
+        db.commit()
+
+    db.expire_all()
+    return get_job(db, job_id)
@@ -0,0 +1,178 @@
+"""
+Planning Snapshot Loader
+Supply, demand and item master data for MRP netting, each loaded with one grouped query
+"""
+from collections import namedtuple
+from datetime import date
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from typing import Dict, List, Tuple
+import models
+from services import bom_graph
+from services.lot_sizing import LotSizingRule, build_rule
+
+
+# Item master fields used by planning
+ItemPlanningData = namedtuple("ItemPlanningData", [
+    "id",
+    "item_code",
+    "item_name",
+    "lead_time_days",
+    "safety_stock",
+    "reorder_point",
+    "reorder_quantity",
+    "standard_cost",
+])
+
+
+class PlanningSnapshot:
+    """
+    Read-only planning inputs for one MRP run.
+
+    - items: ItemPlanningData by item ID
+    - on_hand: total on-hand quantity by item (all warehouses)
+    - open_po: open purchase order quantity as (date, qty) by item
+    - open_so: open sales order demand as (date, qty) by item
+    - make_items: items with an active BOM (everything else is bought)
+    - production_lead_time_days: BOM production lead time of make items
+    - lot_sizing: lot-sizing rule by item (items without one are lot-for-lot)
+    """
+
+    __slots__ = ("items", "on_hand", "open_po", "open_so", "make_items", "production_lead_time_days", "lot_sizing")
+
+    def __init__(self, items, on_hand, open_po, open_so, make_items, production_lead_time_days, lot_sizing):
+        self.items: Dict[int, ItemPlanningData] = items
+        self.on_hand: Dict[int, float] = on_hand
+        self.open_po: Dict[int, List[Tuple[date, float]]] = open_po
+        self.open_so: Dict[int, List[Tuple[date, float]]] = open_so
+        self.make_items = make_items
+        self.production_lead_time_days: Dict[int, int] = production_lead_time_days
+        self.lot_sizing: Dict[int, LotSizingRule] = lot_sizing
+
+    def is_make(self, item_id: int) -> bool:
+        """Whether the item is produced (has an active BOM) rather than bought"""
+        return item_id in self.make_items
+
+    def lead_time_days(self, item_id: int) -> int:
+        """Production lead time for make items (if set on the BOM), else the item lead time"""
+        production_days = self.production_lead_time_days.get(item_id)
+        if production_days:
+            return production_days
+        item = self.items.get(item_id)
+        return (item.lead_time_days or 0) if item else 0
+
+    def lead_times(self) -> Dict[int, int]:
+        """Lead time in days for every item"""
+        return {item_id: self.lead_time_days(item_id) for item_id in self.items}
+
+    def open_po_total(self, item_id: int) -> float:
+        """Total open purchase order quantity of an item"""
+        return sum(qty for _, qty in self.open_po.get(item_id, ()))
+
+
+def _dated_quantities(rows) -> Dict[int, List[Tuple[date, float]]]:
+    """Group (item_id, date, qty) rows into (date, qty) lists by item"""
+    result: Dict[int, List[Tuple[date, float]]] = {}
+    for item_id, day, qty in rows:
+        if qty and qty > 0:
+            result.setdefault(item_id, []).append((day, float(qty)))
+    return result
+
+
+def plan_demand(plan: models.ProductionPlan, snapshot: PlanningSnapshot) -> Dict[int, List[Tuple[date, float]]]:
+    """
+    Independent demand of a production plan.
+
+    Args:
+        plan: Production plan
+        snapshot: Planning snapshot
+
+    Returns:
+        dict: (date, qty) per item ID; ACTUAL plans use open sales orders, others their plan items
+    """
+    if plan.source_type == 'ACTUAL':
+        # Remaining quantity on confirmed sales orders
+        return snapshot.open_so
+
+    # MANUAL / FORECAST: plan items
+    demand: Dict[int, List[Tuple[date, float]]] = {}
+    for item in plan.items:
+        if item.item_id in snapshot.items:
+            demand.setdefault(item.item_id, []).append((item.delivery_date, float(item.quantity)))
+    return demand
+
+
+def load_planning_snapshot(db: Session) -> PlanningSnapshot:
+    """
+    Load everything MRP netting reads, with one grouped query per source.
+
+    Args:
+        db: Database session
+
+    Returns:
+        PlanningSnapshot: Planning inputs
+    """
+    I = models.MasterItem
+    items = {
+        row[0]: ItemPlanningData(*row) for row in db.query(
+            I.id, I.item_code, I.item_name, I.lead_time_days,
+            I.safety_stock, I.reorder_point, I.reorder_quantity, I.standard_cost
+        ).all()
+    }
+
+    on_hand = {
+        item_id: float(qty or 0) for item_id, qty in db.query(
+            models.InventoryBalance.item_id,
+            func.sum(models.InventoryBalance.qty_on_hand)
+        ).group_by(models.InventoryBalance.item_id).all()
+    }
+
+    # Open PO lines (not yet received) by item and expected delivery date
+    POH = models.TrnPurchaseOrderHead
+    POD = models.TrnPurchaseOrderDetail
+    po_date = func.coalesce(POH.delivery_date, POH.po_date)
+    open_po = _dated_quantities(db.query(
+        POD.item_id,
+        po_date,
+        func.sum(POD.qty_ordered - POD.qty_received)
+    ).join(
+        POH, POH.id == POD.po_id
+    ).filter(
+        POD.qty_ordered > POD.qty_received,
+        POH.status != models.POStatus.CANCELLED
+    ).group_by(POD.item_id, po_date).all())
+
+    # Remaining quantity on confirmed sales orders by item and delivery date
+    SOH = models.TrnSalesOrderHead
+    SOD = models.TrnSalesOrderDetail
+    so_date = func.coalesce(SOH.delivery_date, SOH.so_date)
+    open_so = _dated_quantities(db.query(
+        SOD.item_id,
+        so_date,
+        func.sum(SOD.qty_ordered - SOD.qty_delivered)
+    ).join(
+        SOH, SOH.id == SOD.so_id
+    ).filter(
+        SOH.status.in_([models.SOStatus.CONFIRMED, models.SOStatus.PARTIAL_DELIVERED]),
+        SOD.qty_ordered > SOD.qty_delivered
+    ).group_by(SOD.item_id, so_date).all())
+
+    # Make/buy and production lead time from the cached BOM graph
+    graph = bom_graph.get_bom_graph(db)
+    production_lead_time_days = {}
+    for parent_id, lines in graph.children.items():
+        production_days = max(float(edge.production_lead_time_days or 0) for edge in lines)
+        if production_days:
+            production_lead_time_days[parent_id] = int(-(-production_days // 1))
+
+    # Lot-sizing rules: explicit settings, else item reorder quantity / safety stock
+    settings = {row.item_id: row for row in db.query(models.ItemLotSizing).all()}
+    lot_sizing = {}
+    for item_id, item in items.items():
+        rule = build_rule(item, settings.get(item_id))
+        if rule is not None:
+            lot_sizing[item_id] = rule
+
+    return PlanningSnapshot(
+        items, on_hand, open_po, open_so, frozenset(graph.children.keys()), production_lead_time_days, lot_sizing
+    )
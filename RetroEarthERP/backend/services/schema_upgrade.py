@@ -0,0 +1,85 @@
+"""
+Schema Upgrades
+Startup additions to tables that already existed (create_all only creates missing tables)
+"""
+from typing import List
+from sqlalchemy import Column, inspect, literal, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn, CreateIndex
+import models
+
+
+# Columns added to existing tables, by table
+ADDED_COLUMNS = {
+    "master_machines": ("hours_per_day",),
+    "mrp_scenarios": ("plan_id", "bucket", "description"),
+    "trn_job_order_head": ("due_date",),
+}
+
+# Indexes added to existing tables: (table, index name)
+ADDED_INDEXES = (
+    ("master_bom", "ix_master_bom_child_item_id"),  # where-used / parent lookups
+)
+
+# Transaction-scoped lock serializing the upgrade across workers (Postgres)
+SCHEMA_UPGRADE_LOCK_ID = 7302
+
+
+def _add_column(connection: Connection, column: Column) -> None:
+    """ALTER TABLE ... ADD COLUMN for a model column; a scalar default also fills the existing rows"""
+    dialect = connection.dialect
+    ddl = (
+        f"ALTER TABLE {dialect.identifier_preparer.format_table(column.table)} "
+        f"ADD COLUMN {CreateColumn(column).compile(dialect=dialect)}"
+    )
+    if column.default is not None and column.default.is_scalar:
+        default = literal(column.default.arg, column.type).compile(
+            dialect=dialect, compile_kwargs={"literal_binds": True}
+        )
+        ddl += f" DEFAULT {default}"
+    for foreign_key in column.foreign_keys:
+        ddl += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+    connection.execute(text(ddl))
+
+
+def upgrade_schema(engine: Engine) -> List[str]:
+    """
+    Add the columns and indexes of existing tables that their models gained later.
+
+    Runs at startup after create_all, in one transaction; on Postgres an
+    advisory lock keeps concurrent workers from upgrading at the same time.
+    Only what the catalog does not list yet is added, so an up-to-date
+    database is left unchanged.
+
+    Args:
+        engine: Database engine
+
+    Returns:
+        list: Columns (table.column) and indexes added
+    """
+    tables = models.Base.metadata.tables
+    applied = []
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": SCHEMA_UPGRADE_LOCK_ID})
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+
+        for table_name, column_names in ADDED_COLUMNS.items():
+            if table_name not in existing_tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table_name)}
+            for column_name in column_names:
+                if column_name not in present:
+                    _add_column(connection, tables[table_name].c[column_name])
+                    applied.append(f"{table_name}.{column_name}")
+
+        for table_name, index_name in ADDED_INDEXES:
+            if table_name not in existing_tables or index_name in {
+                index["name"] for index in inspector.get_indexes(table_name)
+            }:
+                continue
+            index = next(index for index in tables[table_name].indexes if index.name == index_name)
+            connection.execute(CreateIndex(index, if_not_exists=True))
+            applied.append(index_name)
+    return applied
@@ -0,0 +1,238 @@
+"""
+Stock Transaction Posting
+Multi-line receipts and issues posted with one query per master table and bulk balance, layer and transaction writes
+"""
+from collections import namedtuple
+from decimal import Decimal
+from typing import Dict, List, Sequence, Tuple
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm import Session
+import models
+from services import inventory_balance, mrp_net_change
+
+
+# Stock transaction line with its master data resolved
+PostingLine = namedtuple("PostingLine", [
+    "item",          # MasterItem
+    "warehouse_id",
+    "location_id",   # None if no location
+    "lot_number",
+    "qty",
+])
+
+
+class StockPostingError(ValueError):
+    """Raised when a stock transaction line is invalid"""
+
+
+class MasterDataNotFoundError(StockPostingError):
+    """Raised when an item, warehouse or location code does not exist"""
+
+
+def resolve_lines(db: Session, items: Sequence) -> List[PostingLine]:
+    """
+    Resolve the item, warehouse and location codes of all lines with one IN query per master table.
+
+    Items are matched by item code, then by ID (the frontend sends the ID as
+    value). Lines are validated in order, so the first invalid line is reported.
+
+    Args:
+        db: Database session
+        items: StockTransactionItem lines
+
+    Returns:
+        list: PostingLine per input line
+
+    Raises:
+        MasterDataNotFoundError: If a code does not exist
+        StockPostingError: If a lot-controlled item has no lot number
+    """
+    codes = {line.item_code for line in items}
+    by_code = {
+        item.item_code: item
+        for item in db.query(models.MasterItem).filter(models.MasterItem.item_code.in_(codes)).all()
+    }
+    ids = {int(code) for code in codes - by_code.keys() if code.isdigit()}
+    by_id = {}
+    if ids:
+        by_id = {item.id: item for item in db.query(models.MasterItem).filter(models.MasterItem.id.in_(ids)).all()}
+
+    warehouses = {
+        warehouse.warehouse_code: warehouse
+        for warehouse in db.query(models.MasterWarehouse).filter(
+            models.MasterWarehouse.warehouse_code.in_({line.warehouse_code for line in items})
+        ).all()
+    }
+
+    location_codes = {line.location_code for line in items if line.location_code}
+    locations = {}
+    if location_codes and warehouses:
+        locations = {
+            (location.warehouse_id, location.location_code): location.id
+            for location in db.query(models.LocationMaster).filter(
+                models.LocationMaster.warehouse_id.in_([warehouse.id for warehouse in warehouses.values()]),
+                models.LocationMaster.location_code.in_(location_codes)
+            ).all()
+        }
+
+    lines = []
+    for line in items:
+        item = by_code.get(line.item_code)
+        if item is None and line.item_code.isdigit():
+            item = by_id.get(int(line.item_code))
+        if item is None:
+            raise MasterDataNotFoundError(f"Item not found: {line.item_code}")
+
+        warehouse = warehouses.get(line.warehouse_code)
+        if warehouse is None:
+            raise MasterDataNotFoundError(f"Warehouse not found: {line.warehouse_code}")
+
+        location_id = None
+        if line.location_code:
+            location_id = locations.get((warehouse.id, line.location_code))
+            if location_id is None:
+                raise MasterDataNotFoundError(
+                    f"Location not found: {line.location_code} in warehouse {warehouse.warehouse_code}"
+                )
+
+        if item.lot_control and not line.lot_number:
+            raise StockPostingError(f"Item {line.item_code} requires Lot Number")
+
+        lines.append(PostingLine(item, warehouse.id, location_id, line.lot_number, line.qty))
+    return lines
+
+
+def _balance_key(line: PostingLine) -> inventory_balance.BalanceKey:
+    """Balance key of a line"""
+    return line.item.id, line.warehouse_id, line.location_id, line.lot_number
+
+
+def consume_fifo_layers(db: Session, lines: Sequence[PostingLine]) -> None:
+    """
+    Consume the FIFO cost layers of issued lines (the caller commits).
+
+    All layers of the issued items are read with one locked query and
+    consumed in memory oldest first; the quantities taken are written back
+    as deltas (qty_remaining - taken) with one executemany UPDATE, so a
+    concurrent issue that read the same layers cannot be overwritten. A
+    line without (enough) layers consumes what there is; its quantity is
+    still issued.
+
+    Args:
+        db: Database session
+        lines: Issued lines
+    """
+    L = models.InventoryCostLayer
+    layers = db.query(L.id, L.item_id, L.warehouse_id, L.location_id, L.qty_remaining).filter(
+        L.item_id.in_({line.item.id for line in lines}),
+        L.warehouse_id.in_({line.warehouse_id for line in lines}),
+        L.qty_remaining > 0
+    ).order_by(L.receipt_date, L.id).with_for_update().all()
+
+    # Remaining qty per layer, oldest first, per (item, warehouse, location)
+    queues: Dict[Tuple[int, int, int], List[list]] = {}
+    for layer in layers:
+        queues.setdefault((layer.item_id, layer.warehouse_id, layer.location_id), []).append(
+            [layer.id, layer.qty_remaining]
+        )
+
+    taken: Dict[int, Decimal] = {}
+    for line in lines:
+        remaining_to_issue = line.qty
+        for layer in queues.get((line.item.id, line.warehouse_id, line.location_id), ()):
+            if remaining_to_issue <= 0:
+                break
+            qty_to_take = min(layer[1], remaining_to_issue)
+            if qty_to_take <= 0:
+                continue
+            layer[1] -= qty_to_take
+            remaining_to_issue -= qty_to_take
+            taken[layer[0]] = taken.get(layer[0], Decimal(0)) + qty_to_take
+
+    if taken:
+        layer_table = L.__table__
+        db.execute(
+            update(layer_table).where(layer_table.c.id == bindparam("layer_id")).values(
+                qty_remaining=layer_table.c.qty_remaining - bindparam("taken")
+            ),
+            [{"layer_id": layer_id, "taken": qty} for layer_id, qty in sorted(taken.items())]
+        )
+
+
+def post_stock_transaction(db: Session, transaction, user_id: int) -> int:
+    """
+    Post a multi-line stock transaction (the caller commits).
+
+    Master data is resolved and every line validated before anything is
+    written; issue balances are checked and decremented in one statement per
+    key before the transaction rows are inserted. Any error leaves the session to be rolled back, so
+    the document posts all lines or none.
+
+    Args:
+        db: Database session
+        transaction: StockTransactionCreate ('receipt' or 'issue')
+        user_id: Posting user
+
+    Returns:
+        int: Number of lines posted
+
+    Raises:
+        MasterDataNotFoundError: If a code does not exist
+        StockPostingError: If a line is invalid
+        InsufficientStockError: If an issue exceeds the quantity on hand
+    """
+    lines = resolve_lines(db, transaction.items)
+    if not lines:
+        return 0
+
+    if transaction.type == 'issue':
+        inventory_balance.issue_stock_batch(db, [(_balance_key(line), line.qty) for line in lines])
+
+    IT = models.InventoryTransaction
+    transaction_ids = db.execute(
+        insert(IT).returning(IT.id, sort_by_parameter_order=True).execution_options(render_nulls=True),
+        [
+            {
+                "transaction_date": transaction.transaction_date,
+                "item_id": line.item.id,
+                "warehouse_id": line.warehouse_id,
+                "location_id": line.location_id,
+                "lot_number": line.lot_number,
+                "transaction_type": transaction.type,
+                "reference_no": transaction.reference_no,
+                "qty": line.qty,
+                "created_by": user_id
+            }
+            for line in lines
+        ]
+    ).scalars().all()
+
+    if transaction.type == 'receipt':
+        # Standard cost until receipts carry the PO price
+        receipt_date = (
+            transaction.transaction_date.date()
+            if hasattr(transaction.transaction_date, 'date') else transaction.transaction_date
+        )
+        unit_costs = [line.item.standard_cost or Decimal(0) for line in lines]
+        db.execute(insert(models.InventoryCostLayer).execution_options(render_nulls=True), [
+            {
+                "item_id": line.item.id,
+                "warehouse_id": line.warehouse_id,
+                "location_id": line.location_id,
+                "receipt_date": receipt_date,
+                "qty_remaining": line.qty,
+                "unit_cost": unit_cost,
+                "receipt_transaction_id": transaction_id,
+                "lot_number": line.lot_number
+            }
+            for line, unit_cost, transaction_id in zip(lines, unit_costs, transaction_ids)
+        ])
+        inventory_balance.receive_stock_batch(
+            db, [(_balance_key(line), line.qty, unit_cost) for line, unit_cost in zip(lines, unit_costs)]
+        )
+
+    elif transaction.type == 'issue':
+        consume_fifo_layers(db, lines)
+
+    mrp_net_change.mark_items_dirty(db, {line.item.id for line in lines}, mrp_net_change.SOURCE_INVENTORY)
+    return len(lines)
@@ -0,0 +1,113 @@
+"""
+Vendor Sourcing Index
+Item-vendor sourcing rules loaded once per run into an in-memory index for PR generation
+"""
+from collections import namedtuple
+from decimal import Decimal
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional
+import models
+
+
+# Sourcing of one item from one vendor
+VendorSource = namedtuple("VendorSource", [
+    "vendor_id",
+    "priority",        # lower = preferred
+    "lead_time_days",  # order-to-receipt days
+    "min_order_qty",
+    "last_price",      # None if never quoted
+])
+
+VENDOR_TYPES = [models.PartnerType.VENDOR, models.PartnerType.BOTH]
+
+
+def _vendor_lead_time(vendor) -> int:
+    """Vendor production + transit lead time in days"""
+    return int((vendor.lead_time_production_days or 0) + (vendor.lead_time_transit_days or 0))
+
+
+class SourcingIndex:
+    """
+    Vendors by item, for choosing the vendor of each purchase line.
+
+    - sources: VendorSource list by item ID, best first (priority, then last price)
+    - default: source used for items without sourcing rows (first active vendor), or None
+    """
+
+    __slots__ = ("sources", "default")
+
+    def __init__(self, sources, default):
+        self.sources: Dict[int, List[VendorSource]] = sources
+        self.default: Optional[VendorSource] = default
+
+    def source_for(self, item_id: int, quantity: Decimal) -> Optional[VendorSource]:
+        """
+        Vendor to buy a quantity of an item from.
+
+        The best-ranked vendor whose minimum order quantity the line meets;
+        if it meets none, the preferred vendor (the line is raised to its MOQ).
+
+        Args:
+            item_id: Item to buy
+            quantity: Required quantity
+
+        Returns:
+            VendorSource: Chosen source, or None if there is no vendor at all
+        """
+        candidates = self.sources.get(item_id)
+        if not candidates:
+            return self.default
+        for source in candidates:
+            if quantity >= source.min_order_qty:
+                return source
+        return candidates[0]
+
+
+def order_quantity(source: VendorSource, quantity: Decimal) -> Decimal:
+    """Required quantity raised to the vendor's minimum order quantity"""
+    return max(quantity, source.min_order_qty)
+
+
+def load_sourcing_index(db: Session) -> SourcingIndex:
+    """
+    Load active sourcing rows of active vendors with one query.
+
+    Args:
+        db: Database session
+
+    Returns:
+        SourcingIndex: Sources by item plus the default vendor
+    """
+    S = models.ItemVendorSource
+    V = models.MasterBusinessPartner
+    rows = db.query(
+        S.item_id, S.vendor_id, S.priority, S.lead_time_days, S.min_order_qty, S.last_price,
+        V.lead_time_production_days, V.lead_time_transit_days
+    ).join(
+        V, V.id == S.vendor_id
+    ).filter(
+        S.is_active == True,
+        V.is_active == True,
+        V.partner_type.in_(VENDOR_TYPES)
+    ).all()
+
+    sources: Dict[int, List[VendorSource]] = {}
+    for row in rows:
+        lead_time = row.lead_time_days
+        if lead_time is None:
+            lead_time = _vendor_lead_time(row)
+        sources.setdefault(row.item_id, []).append(VendorSource(
+            row.vendor_id, row.priority or 0, int(lead_time), row.min_order_qty or Decimal(0), row.last_price
+        ))
+
+    no_price = Decimal("Infinity")
+    for candidates in sources.values():
+        candidates.sort(key=lambda source: (
+            source.priority,
+            source.last_price if source.last_price is not None else no_price,
+            source.vendor_id
+        ))
+
+    vendor = db.query(V).filter(V.partner_type.in_(VENDOR_TYPES), V.is_active == True).first()
+    default = VendorSource(vendor.id, 0, _vendor_lead_time(vendor), Decimal(0), None) if vendor else None
+    return SourcingIndex(sources, default)